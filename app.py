@@ -1,7 +1,33 @@
-from flask import Flask, request, jsonify, session, redirect, render_template
+from flask import Flask, Blueprint, request, jsonify, session, redirect, render_template, current_app
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
+from datetime import datetime
+import os
+from sqlalchemy.orm import joinedload
+import click
 from support_routes import support_bp
+from export_routes import export_bp
+from job_routes import job_bp
+from database import init_database, reporting_route, snapshot_reporting_database
+from dashboard_services import get_dashboard_snapshot, invalidate_dashboard_snapshot
+from production_services import BOMCycleError, explode_bom, explode_production_run, run_mrp
+from forecast_services import (
+    FORECAST_FREQUENCIES, FORECAST_DEFAULT_HORIZON, check_forecast_parameters, run_demand_forecast
+)
+from job_services import JOB_WORKERS, JOB_WORKER_THREADS, ensure_job_runner, submit_job, job_to_dict
+from search_services import search_items, item_search_filter, ensure_item_search, rebuild_item_search
+from cache_services import cached_response, bump_table_versions
+from serialization import FieldSelectionError, project, json_response, json_rows, stream_json_rows
+from startup_profile import STARTUP_STEPS, profile_startup, check_thresholds
+from query_budget import QUERY_BUDGETS, QUERY_BUDGET_ROWS, count_queries, check_query_budgets
+from inventory_services import (
+    LOW_STOCK_SORT_FIELDS, list_low_stock_items, get_low_stock_page,
+    apply_stock_summary_delta, rebuild_stock_summaries, ensure_stock_summaries,
+    BULK_MAX_MOVEMENTS, apply_inventory_movements, apply_stock_transfers,
+    TRANSACTIONS_DEFAULT_LIMIT, TRANSACTION_EXPANSIONS, get_transactions_page, parse_datetime_param,
+    get_warehouse_layout_compact, AllocationError, allocate_fefo, allocate_sales_order,
+    NEAR_EXPIRY_DEFAULT_DAYS, get_near_expiry_page, rebuild_near_expiry, ensure_near_expiry
+)
 from models import (
     # Core Entities
     Category, Item, Warehouse, 
@@ -50,85 +76,289 @@ from models import (
     EmployeeShift, ProductionEfficiency,
     CustomerInteraction, DiscountPromotion,
     ProductReturn,
-    db
+    db, transaction_type_enum, init_db, seed_defaults, invalidate_role_permissions,
+    load_user_identity, invalidate_user_identities
+)
+
+# Default fields and ?expand= relations of the list endpoints. Rows are
+# selected as plain columns and encoded without building ORM objects; see
+# serialization.project for ?fields= and ?expand=.
+ROLE_COLUMNS = (
+    ('id', Role.id),
+    ('name', Role.name)
+)
+PERMISSION_COLUMNS = (
+    ('id', Permission.id),
+    ('permission_name', Permission.permission_name)
+)
+USER_COLUMNS = (
+    ('id', User.id),
+    ('username', User.username),
+    ('email', User.email),
+    ('role_id', User.role_id),
+    ('is_active', User.is_active),
+    ('department', User.department),
+    ('position', User.position),
+    ('profile_image', User.profile_image)
+)
+USER_EXPANSIONS = {
+    'role': (Role, User.role_id, ('id', 'name'))
+}
+ROLE_PERMISSION_COLUMNS = (
+    ('role_id', RolePermission.role_id),
+    ('permission_id', RolePermission.permission_id)
+)
+ROLE_PERMISSION_EXPANSIONS = {
+    'role': (Role, RolePermission.role_id, ('id', 'name')),
+    'permission': (Permission, RolePermission.permission_id, ('id', 'permission_name'))
+}
+CATEGORY_COLUMNS = (
+    ('id', Category.id),
+    ('name', Category.name),
+    ('description', Category.description)
+)
+ITEM_COLUMNS = (
+    ('id', Item.id),
+    ('name', Item.name),
+    ('category_id', Item.category_id),
+    ('sku', Item.sku),
+    ('description', Item.description),
+    ('unit_of_measure', Item.unit_of_measure),
+    ('cost', Item.cost),
+    ('price', Item.price),
+    ('reorder_level', Item.reorder_level)
+)
+ITEM_EXPANSIONS = {
+    'category': (Category, Item.category_id, ('id', 'name'))
+}
+WAREHOUSE_COLUMNS = (
+    ('id', Warehouse.id),
+    ('name', Warehouse.name),
+    ('location', Warehouse.location),
+    ('capacity', Warehouse.capacity),
+    ('contact_info', Warehouse.contact_info)
+)
+INVENTORY_COLUMNS = (
+    ('id', Inventory.id),
+    ('item_id', Inventory.item_id),
+    ('warehouse_id', Inventory.warehouse_id),
+    ('quantity', Inventory.quantity),
+    ('last_updated', Inventory.last_updated)
+)
+INVENTORY_EXPANSIONS = {
+    'item': (Item, Inventory.item_id, ('id', 'name', 'sku')),
+    'warehouse': (Warehouse, Inventory.warehouse_id, ('id', 'name'))
+}
+SECTION_COLUMNS = (
+    ('id', WarehouseSection.id),
+    ('warehouse_id', WarehouseSection.warehouse_id),
+    ('section_name', WarehouseSection.section_name),
+    ('row_count', WarehouseSection.row_count),
+    ('column_count', WarehouseSection.column_count)
+)
+SECTION_EXPANSIONS = {
+    'warehouse': (Warehouse, WarehouseSection.warehouse_id, ('id', 'name'))
+}
+SLOT_COLUMNS = (
+    ('id', WarehouseSlot.id),
+    ('section_id', WarehouseSlot.section_id),
+    ('row_number', WarehouseSlot.row_number),
+    ('column_number', WarehouseSlot.column_number),
+    ('item_id', WarehouseSlot.item_id),
+    ('quantity', WarehouseSlot.quantity)
+)
+SLOT_EXPANSIONS = {
+    'item': (Item, WarehouseSlot.item_id, ('id', 'name', 'sku')),
+    'section': (WarehouseSection, WarehouseSlot.section_id, ('id', 'section_name'))
+}
+# item_name is kept for the dashboard; it comes from the same join as ?expand=item would
+RECENT_TRANSACTION_COLUMNS = (
+    ('id', InventoryTransaction.id),
+    ('item_id', InventoryTransaction.item_id),
+    ('item_name', Item.name),
+    ('warehouse_id', InventoryTransaction.warehouse_id),
+    ('transaction_type', InventoryTransaction.transaction_type),
+    ('quantity', InventoryTransaction.quantity),
+    ('transaction_date', InventoryTransaction.transaction_date),
+    ('reference', InventoryTransaction.reference)
 )
+RECENT_TRANSACTIONS_LIMIT = 10
+FORECAST_COLUMNS = (
+    ('id', DemandForecast.id),
+    ('item_id', DemandForecast.item_id),
+    ('frequency', DemandForecast.frequency),
+    ('forecast_date', DemandForecast.forecast_date),
+    ('forecasted_quantity', DemandForecast.forecasted_quantity),
+    ('accuracy_rate', DemandForecast.accuracy_rate),
+    ('method', DemandForecast.method)
+)
+FORECAST_EXPANSIONS = {
+    'item': (Item, DemandForecast.item_id, ('id', 'name', 'sku'))
+}
+
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///katilo.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = 'your-secret-key'
-db.init_app(app)  # Connect SQLAlchemy to this Flask app
+def request_projection(model, columns, expansions=None):
+    # project() with this request's ?fields= and ?expand=
+    return project(model, columns, expansions, request.args.get('fields'), request.args.get('expand'))
+
+# Every route, error handler and CLI command of the main app lives on this
+# blueprint; create_app() assembles it with the feature blueprints
+main_bp = Blueprint('main', __name__, cli_group=None)
 login_manager = LoginManager()
-login_manager.init_app(app)
 # Configure upload folder for attachments (needed for support file uploads)
 UPLOAD_FOLDER = 'static/uploads/support'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-# Ensure upload directory exists
-import os
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-app.register_blueprint(support_bp)
 
-
-# Create database tables
-with app.app_context():
-    db.create_all()
-    
-    default_permissions = [
-        'view_users', 'create_users', 'edit_users', 'delete_users',
-        'view_roles', 'create_roles', 'edit_roles', 'delete_roles',
-        'view_inventory', 'manage_inventory',
-        'view_categories', 'manage_categories',
-        'view_items', 'manage_items',
-        'view_transactions', 'manage_transactions'
-    ]
-    for perm_name in default_permissions:
-        if not Permission.query.filter_by(permission_name=perm_name).first():
-            permission = Permission(permission_name=perm_name)
-            db.session.add(permission)
-            
-    # Create admin role if it doesn't exist
-    admin_role = Role.query.filter_by(name='admin').first()
-    if not admin_role:
-        admin_role = Role(name='admin')
-        db.session.add(admin_role)
-        db.session.commit()
-        
-        # Assign all permissions to admin role
-        for permission in Permission.query.all():
-            role_permission = RolePermission(
-                role_id=admin_role.id,
-                permission_id=permission.id
-            )
-            db.session.add(role_permission)
-    
-    # Create default user role if it doesn't exist
-    if not Role.query.filter_by(name='user').first():
-        user_role = Role(name='user')
-        db.session.add(user_role)
-    
-    db.session.commit()
+@main_bp.cli.command('init-db')
+@click.option('--no-seed', is_flag=True, help='Only create tables and indexes')
+def init_db_command(no_seed):
+    # Create missing tables and indexes, then seed default permissions and roles
+    init_db()
+    click.echo('Database schema is up to date')
+    rebuilt = ensure_stock_summaries()
+    if rebuilt is not None:
+        click.echo(f'Built stock summary for {rebuilt} items')
+    indexed = ensure_item_search()
+    if indexed is not None:
+        click.echo(f'Built item search index for {indexed} items')
+    listed = ensure_near_expiry()
+    if listed is not None:
+        click.echo(f'Built near-expiry report for {listed} batch slots')
+    if not no_seed:
+        seed_defaults()
+        click.echo('Seeded default permissions and roles')
+
+@main_bp.cli.command('seed')
+def seed_command():
+    # Upsert default permissions, roles and admin grants (safe to run repeatedly)
+    seed_defaults()
+    click.echo('Seeded default permissions and roles')
+
+@main_bp.cli.command('rebuild-stock-summary')
+def rebuild_stock_summary_command():
+    # Recompute item_stock_summaries from inventory (run once after upgrading)
+    count = rebuild_stock_summaries()
+    click.echo(f'Rebuilt stock summary for {count} items')
+
+@main_bp.cli.command('rebuild-near-expiry')
+def rebuild_near_expiry_command():
+    # Recompute near_expiry_report from batches and batch slots (run once after upgrading)
+    count = rebuild_near_expiry()
+    click.echo(f'Rebuilt near-expiry report with {count} batch slots')
+
+@main_bp.cli.command('rebuild-item-search')
+def rebuild_item_search_command():
+    # Re-index every item for /api/items/search (run once after upgrading)
+    count = rebuild_item_search()
+    click.echo(f'Indexed {count} items for search')
+
+@main_bp.cli.command('forecast-run')
+@click.option('--frequency', type=click.Choice(FORECAST_FREQUENCIES), default='weekly')
+@click.option('--horizon', type=int, default=FORECAST_DEFAULT_HORIZON, help='Periods to forecast ahead')
+@click.option('--history', type=int, default=None, help='Periods of OUT history to fit on')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: one per core)')
+def forecast_run_command(frequency, horizon, history, workers):
+    # Fit per-item demand models on OUT history and write DemandForecast rows
+    result = run_demand_forecast(frequency=frequency, horizon=horizon, history=history, workers=workers)
+    click.echo(f"Forecast {result['items_forecast']} items, {result['forecasts_written']} rows "
+               f"in {result['duration_seconds']}s {result['methods']}")
+
+@main_bp.cli.command('mrp-run')
+@click.option('--incremental', is_flag=True, help='Only recompute items whose inputs changed since the last run')
+def mrp_run_command(incremental):
+    # Net demand against stock and open receipts into proposed replenishment plans
+    result = run_mrp(incremental=incremental)
+    click.echo(f"MRP run {result['run_id']}: {result['items_recomputed']} items recomputed, "
+               f"{result['plans_written']} plans written in {result['duration_seconds']}s")
+
+@main_bp.cli.command('reporting-snapshot')
+def reporting_snapshot_command():
+    # Refresh the SQLite reporting copy (or just its heartbeat for a replica); run periodically
+    result = snapshot_reporting_database()
+    click.echo(f"Reporting heartbeat {result['heartbeat']}" + (' (database copied)' if result['copied'] else ''))
+
+@main_bp.cli.command('profile-startup')
+@click.option('--repeat', type=int, default=3, help='Fresh interpreters to run; the median is reported')
+@click.option('--threshold', 'thresholds', multiple=True, metavar='STEP=MS',
+              help='Fail when STEP takes longer than MS milliseconds, e.g. "import app=800" or "total=2000"')
+def profile_startup_command(repeat, thresholds):
+    # Cold-start breakdown: imports, app factory, schema creation and seeding
+    try:
+        limits = {step.strip(): float(ms) for step, ms in (item.rsplit('=', 1) for item in thresholds)}
+    except ValueError:
+        raise click.BadParameter('expected STEP=MS', param_hint='--threshold')
+    unknown = set(limits) - set(STARTUP_STEPS)
+    if unknown:
+        raise click.BadParameter(f"unknown step(s): {', '.join(sorted(unknown))}", param_hint='--threshold')
+    result = profile_startup(repeat=repeat)
+
+    click.echo(f"{'step':<34} {'ms':>10}")
+    for step, ms in result['steps'].items():
+        click.echo(f"{step:<34} {ms:>10.1f}")
+    click.echo(f"\n{'slowest imports':<54} {'self ms':>9} {'total ms':>9}")
+    for name, self_ms, total_ms in result['modules']:
+        click.echo(f"{name:<54} {self_ms:>9.1f} {total_ms:>9.1f}")
+
+    exceeded = check_thresholds(result['steps'], limits)
+    for step, ms, limit in exceeded:
+        click.echo(f'FAIL {step}: {ms:.1f} ms > {limit:.1f} ms', err=True)
+    if exceeded:
+        raise SystemExit(1)
+
+@main_bp.cli.command('query-budget')
+@click.option('--rows', type=int, default=QUERY_BUDGET_ROWS, help='Rows seeded per table')
+def query_budget_command(rows):
+    # SQL statements per listed GET on a throwaway database; fails when any
+    # endpoint errors or goes over its budget in query_budget.QUERY_BUDGETS
+    counts = count_queries(rows=rows)
+
+    click.echo(f"{'endpoint':<58} {'status':>6} {'queries':>8} {'budget':>7}")
+    for url, budget in QUERY_BUDGETS:
+        click.echo(f"{url:<58} {counts[url]['status']:>6} {counts[url]['queries']:>8} {budget:>7}")
+
+    failures = check_query_budgets(counts)
+    for url, status, queries, budget in failures:
+        reason = f'status {status}' if status != 200 else f'{queries} queries > {budget}'
+        click.echo(f'FAIL {url}: {reason}', err=True)
+    if failures:
+        raise SystemExit(1)
+
+@main_bp.cli.command('jobs-worker')
+@click.option('--workers', type=int, default=None, help='Worker threads (default: KATILO_JOB_WORKERS or 2)')
+def jobs_worker_command(workers):
+    # Run queued background jobs in this process until interrupted
+    workers = max(1, workers or JOB_WORKERS or JOB_WORKER_THREADS)
+    runner = ensure_job_runner(current_app._get_current_object(), workers=workers)
+    click.echo(f'Job worker running with {runner.workers} threads')
+    try:
+        while runner.thread.is_alive():
+            runner.thread.join(1)
+    except KeyboardInterrupt:
+        runner.stop()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_user_identity(int(user_id))
 
-@app.errorhandler(401)
+@main_bp.app_errorhandler(401)
 def unauthorized(error):
     return render_template('unauthorized.html'), 401
 
 # Also add a handler for 403 Forbidden errors
-@app.errorhandler(403)
+@main_bp.app_errorhandler(403)
 def forbidden(error):
     return render_template('unauthorized.html'), 403
 
 # Error handlers
-@app.errorhandler(404)
+@main_bp.app_errorhandler(FieldSelectionError)
+def invalid_field_selection(error):
+    return jsonify({'message': str(error)}), 400
+
+@main_bp.app_errorhandler(404)
 def page_not_found(e):
     return render_template('errors/404.html'), 404
 
 # Authentication Routes
-@app.route('/api/auth/register', methods=['POST'])
+@main_bp.route('/api/auth/register', methods=['POST'])
 def register():
     data = request.get_json()
     
@@ -149,6 +379,7 @@ def register():
     if not default_role:
         default_role = Role(name='user')
         db.session.add(default_role)
+        bump_table_versions(Role)
         
     db.session.add(user)
     db.session.commit()
@@ -160,7 +391,7 @@ def register():
         'role': default_role.name
     }), 201
 
-@app.route('/api/auth/login', methods=['POST'])
+@main_bp.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
     
@@ -185,14 +416,14 @@ def login():
     
     return jsonify({'message': 'بيانات الدخول غير صحيحة'}), 401
 
-@app.route('/api/auth/logout')
+@main_bp.route('/api/auth/logout')
 @login_required
 def logout():
     logout_user()
     return redirect('/')  # Direct redirect to home page
 
 
-@app.route('/api/auth/profile')
+@main_bp.route('/api/auth/profile')
 @login_required
 def get_profile():
     return jsonify({
@@ -205,7 +436,7 @@ def get_profile():
         'position': current_user.position
     })
 
-@app.route('/api/auth/profile', methods=['PUT'])
+@main_bp.route('/api/auth/profile', methods=['PUT'])
 @login_required
 def update_profile():
     data = request.get_json()
@@ -223,6 +454,7 @@ def update_profile():
         current_user.set_password(data['password'])
     
     db.session.commit()
+    invalidate_user_identities()
     
     return jsonify({
         'id': current_user.id,
@@ -236,16 +468,14 @@ def update_profile():
 
 
 # Role Management Routes
-@app.route('/api/roles', methods=['GET'])
+@main_bp.route('/api/roles', methods=['GET'])
 @login_required
+@cached_response(Role)
 def get_roles():
-    roles = Role.query.all()
-    return jsonify([{
-        'id': r.id,
-        'name': r.name
-    } for r in roles])
+    statement, shape = request_projection(Role, ROLE_COLUMNS)
+    return json_rows(statement.order_by(Role.id), shape)
 
-@app.route('/api/roles', methods=['POST'])
+@main_bp.route('/api/roles', methods=['POST'])
 @login_required
 def create_role():
     if not current_user.role or current_user.role.name != 'admin':
@@ -254,6 +484,7 @@ def create_role():
     data = request.get_json()
     role = Role(name=data['name'])
     db.session.add(role)
+    bump_table_versions(Role)
     db.session.commit()
     
     return jsonify({
@@ -262,19 +493,16 @@ def create_role():
     }), 201
 
 # Permission Management Routes
-@app.route('/api/permissions', methods=['GET'])
+@main_bp.route('/api/permissions', methods=['GET'])
 @login_required
 def get_permissions():
     if not current_user.role or current_user.role.name != 'admin':
         return jsonify({'message': 'Unauthorized'}), 403
         
-    permissions = Permission.query.all()
-    return jsonify([{
-        'id': p.id,
-        'permission_name': p.permission_name
-    } for p in permissions])
+    statement, shape = request_projection(Permission, PERMISSION_COLUMNS)
+    return json_rows(statement.order_by(Permission.id), shape)
 
-@app.route('/api/roles/<int:role_id>/permissions', methods=['POST'])
+@main_bp.route('/api/roles/<int:role_id>/permissions', methods=['POST'])
 @login_required
 def assign_permission_to_role(role_id):
     if not current_user.role or current_user.role.name != 'admin':
@@ -287,30 +515,22 @@ def assign_permission_to_role(role_id):
     )
     db.session.add(role_permission)
     db.session.commit()
+    invalidate_role_permissions()
     
     return jsonify({'message': 'Permission assigned successfully'}), 201
 
 
 # Admin User Management Routes
-@app.route('/api/admin/users', methods=['GET'])
+@main_bp.route('/api/admin/users', methods=['GET'])
 @login_required
 def get_users():
     if not current_user.role or current_user.role.name != 'admin':
         return jsonify({'message': 'Unauthorized'}), 403
         
-    users = User.query.all()
-    return jsonify([{
-        'id': u.id,
-        'username': u.username,
-        'email': u.email,
-        'role_id': u.role_id,
-        'is_active': u.is_active,
-        'department': u.department,
-        'position': u.position,
-        'profile_image': u.profile_image
-    } for u in users])
-
-@app.route('/api/admin/users', methods=['POST'])
+    statement, shape = request_projection(User, USER_COLUMNS, USER_EXPANSIONS)
+    return json_rows(statement.order_by(User.id), shape)
+
+@main_bp.route('/api/admin/users', methods=['POST'])
 @login_required
 def create_user():
     if not current_user.role or current_user.role.name != 'admin':
@@ -351,7 +571,7 @@ def create_user():
         'is_active': user.is_active
     }), 201
 
-@app.route('/api/admin/users/<int:id>', methods=['PUT'])
+@main_bp.route('/api/admin/users/<int:id>', methods=['PUT'])
 @login_required
 def update_user(id):
     if not current_user.role or current_user.role.name != 'admin':
@@ -392,6 +612,7 @@ def update_user(id):
         user.set_password(data['password'])
     
     db.session.commit()
+    invalidate_user_identities()
     
     return jsonify({
         'id': user.id,
@@ -403,7 +624,7 @@ def update_user(id):
         'position': user.position
     })
 
-@app.route('/api/admin/users/<int:id>', methods=['DELETE'])
+@main_bp.route('/api/admin/users/<int:id>', methods=['DELETE'])
 @login_required
 def delete_user(id):
     if not current_user.role or current_user.role.name != 'admin':
@@ -417,10 +638,11 @@ def delete_user(id):
     
     db.session.delete(user)
     db.session.commit()
+    invalidate_user_identities()
     
     return '', 204
 
-@app.route('/api/admin/users/<int:id>/toggle-status', methods=['PUT'])
+@main_bp.route('/api/admin/users/<int:id>/toggle-status', methods=['PUT'])
 @login_required
 def toggle_user_status(id):
     if not current_user.role or current_user.role.name != 'admin':
@@ -434,6 +656,7 @@ def toggle_user_status(id):
     
     user.is_active = not user.is_active
     db.session.commit()
+    invalidate_user_identities()
     
     return jsonify({
         'id': user.id,
@@ -441,19 +664,16 @@ def toggle_user_status(id):
     })
 
 # Admin Role Management Routes
-@app.route('/api/admin/role-permissions', methods=['GET'])
+@main_bp.route('/api/admin/role-permissions', methods=['GET'])
 @login_required
 def get_role_permissions():
     if not current_user.role or current_user.role.name != 'admin':
         return jsonify({'message': 'Unauthorized'}), 403
         
-    role_permissions = RolePermission.query.all()
-    return jsonify([{
-        'role_id': rp.role_id,
-        'permission_id': rp.permission_id
-    } for rp in role_permissions])
+    statement, shape = request_projection(RolePermission, ROLE_PERMISSION_COLUMNS, ROLE_PERMISSION_EXPANSIONS)
+    return json_rows(statement.order_by(RolePermission.role_id, RolePermission.permission_id), shape)
 
-@app.route('/api/admin/roles/<int:id>', methods=['PUT'])
+@main_bp.route('/api/admin/roles/<int:id>', methods=['PUT'])
 @login_required
 def update_role(id):
     if not current_user.role or current_user.role.name != 'admin':
@@ -473,14 +693,16 @@ def update_role(id):
             return jsonify({'message': 'Role name already exists'}), 400
         role.name = data['name']
     
+    bump_table_versions(Role)
     db.session.commit()
+    invalidate_user_identities()
     
     return jsonify({
         'id': role.id,
         'name': role.name
     })
 
-@app.route('/api/admin/roles/<int:id>', methods=['DELETE'])
+@main_bp.route('/api/admin/roles/<int:id>', methods=['DELETE'])
 @login_required
 def delete_role(id):
     if not current_user.role or current_user.role.name != 'admin':
@@ -501,11 +723,14 @@ def delete_role(id):
     RolePermission.query.filter_by(role_id=id).delete()
     
     db.session.delete(role)
+    bump_table_versions(Role)
     db.session.commit()
+    invalidate_role_permissions()
+    invalidate_user_identities()
     
     return '', 204
 
-@app.route('/api/admin/roles/<int:role_id>/permissions/<int:permission_id>', methods=['DELETE'])
+@main_bp.route('/api/admin/roles/<int:role_id>/permissions/<int:permission_id>', methods=['DELETE'])
 @login_required
 def remove_permission_from_role(role_id, permission_id):
     if not current_user.role or current_user.role.name != 'admin':
@@ -518,6 +743,7 @@ def remove_permission_from_role(role_id, permission_id):
     
     db.session.delete(role_permission)
     db.session.commit()
+    invalidate_role_permissions()
     
     return '', 204
 
@@ -526,57 +752,66 @@ def remove_permission_from_role(role_id, permission_id):
 
 
 # Category Routes
-@app.route('/api/categories', methods=['GET'])
+@main_bp.route('/api/categories', methods=['GET'])
 @login_required
+@cached_response(Category)
 def get_categories():
-    categories = Category.query.all()
-    return jsonify([{'id': c.id, 'name': c.name, 'description': c.description} for c in categories])
+    statement, shape = request_projection(Category, CATEGORY_COLUMNS)
+    return json_rows(statement.order_by(Category.id), shape)
 
-@app.route('/api/categories', methods=['POST'])
+@main_bp.route('/api/categories', methods=['POST'])
 @login_required
 def create_category():
     data = request.get_json()
     category = Category(name=data['name'], description=data.get('description'))
     db.session.add(category)
+    bump_table_versions(Category)
     db.session.commit()
     return jsonify({'id': category.id, 'name': category.name, 'description': category.description}), 201
 
-@app.route('/api/categories/<int:id>', methods=['PUT'])
+@main_bp.route('/api/categories/<int:id>', methods=['PUT'])
 @login_required
 def update_category(id):
     category = Category.query.get_or_404(id)
     data = request.get_json()
     category.name = data.get('name', category.name)
     category.description = data.get('description', category.description)
+    bump_table_versions(Category)
     db.session.commit()
     return jsonify({'id': category.id, 'name': category.name, 'description': category.description})
 
-@app.route('/api/categories/<int:id>', methods=['DELETE'])
+@main_bp.route('/api/categories/<int:id>', methods=['DELETE'])
 @login_required
 def delete_category(id):
     category = Category.query.get_or_404(id)
     db.session.delete(category)
+    bump_table_versions(Category)
     db.session.commit()
     return '', 204
 
 # Item Routes
-@app.route('/api/items', methods=['GET'])
+@main_bp.route('/api/items', methods=['GET'])
 @login_required
+@cached_response(Item, Category)
 def get_items():
-    items = Item.query.all()
-    return jsonify([{
-        'id': i.id,
-        'name': i.name,
-        'category_id': i.category_id,
-        'sku': i.sku,
-        'description': i.description,
-        'unit_of_measure': i.unit_of_measure,
-        'cost': i.cost,
-        'price': i.price,
-        'reorder_level': i.reorder_level
-    } for i in items])
-
-@app.route('/api/items', methods=['POST'])
+    statement, shape = request_projection(Item, ITEM_COLUMNS, ITEM_EXPANSIONS)
+    # Optional full-text filter (same matching as /api/items/search, unranked)
+    if request.args.get('q'):
+        statement = statement.where(item_search_filter(Item.id, request.args['q']))
+    return stream_json_rows(statement.order_by(Item.id), shape)
+
+@main_bp.route('/api/items/search', methods=['GET'])
+@login_required
+def search_items_route():
+    # Ranked full-text search over item name, SKU, description and category, for typeahead
+    return jsonify(search_items(
+        request.args.get('q', ''),
+        category_id=request.args.get('category_id', type=int),
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', 20, type=int)
+    ))
+
+@main_bp.route('/api/items', methods=['POST'])
 @login_required
 def create_item():
     data = request.get_json()
@@ -591,6 +826,7 @@ def create_item():
         reorder_level=data['reorder_level']
     )
     db.session.add(item)
+    bump_table_versions(Item)
     db.session.commit()
     return jsonify({
         'id': item.id,
@@ -599,7 +835,7 @@ def create_item():
         'category_id': item.category_id
     }), 201
 
-@app.route('/api/items/<int:id>', methods=['PUT'])
+@main_bp.route('/api/items/<int:id>', methods=['PUT'])
 @login_required
 def update_item(id):
     item = Item.query.get_or_404(id)
@@ -607,31 +843,28 @@ def update_item(id):
     for key, value in data.items():
         if hasattr(item, key):
             setattr(item, key, value)
+    bump_table_versions(Item)
     db.session.commit()
     return jsonify({'id': item.id, 'name': item.name, 'sku': item.sku})
 
-@app.route('/api/items/<int:id>', methods=['DELETE'])
+@main_bp.route('/api/items/<int:id>', methods=['DELETE'])
 @login_required
 def delete_item(id):
     item = Item.query.get_or_404(id)
     db.session.delete(item)
+    bump_table_versions(Item)
     db.session.commit()
     return '', 204
 
 # Warehouse Routes
-@app.route('/api/warehouses', methods=['GET'])
+@main_bp.route('/api/warehouses', methods=['GET'])
 @login_required
+@cached_response(Warehouse)
 def get_warehouses():
-    warehouses = Warehouse.query.all()
-    return jsonify([{
-        'id': w.id,
-        'name': w.name,
-        'location': w.location,
-        'capacity': w.capacity,
-        'contact_info': w.contact_info
-    } for w in warehouses])
+    statement, shape = request_projection(Warehouse, WAREHOUSE_COLUMNS)
+    return json_rows(statement.order_by(Warehouse.id), shape)
 
-@app.route('/api/warehouses', methods=['POST'])
+@main_bp.route('/api/warehouses', methods=['POST'])
 @login_required
 def create_warehouse():
     data = request.get_json()
@@ -642,23 +875,20 @@ def create_warehouse():
         contact_info=data.get('contact_info')
     )
     db.session.add(warehouse)
+    bump_table_versions(Warehouse)
     db.session.commit()
     return jsonify({'id': warehouse.id, 'name': warehouse.name}), 201
 
 # Inventory Routes
-@app.route('/api/inventory', methods=['GET'])
+@main_bp.route('/api/inventory', methods=['GET'])
 @login_required
 def get_inventory():
-    inventory = Inventory.query.all()
-    return jsonify([{
-        'id': inv.id,
-        'item_id': inv.item_id,
-        'warehouse_id': inv.warehouse_id,
-        'quantity': inv.quantity,
-        'last_updated': inv.last_updated.isoformat()
-    } for inv in inventory])
+    statement, shape = request_projection(Inventory, INVENTORY_COLUMNS, INVENTORY_EXPANSIONS)
+    if request.args.get('q'):
+        statement = statement.where(item_search_filter(Inventory.item_id, request.args['q']))
+    return stream_json_rows(statement.order_by(Inventory.id), shape)
 
-@app.route('/api/inventory/update', methods=['POST'])
+@main_bp.route('/api/inventory/update', methods=['POST'])
 @login_required
 def update_inventory():
     data = request.get_json()
@@ -685,6 +915,7 @@ def update_inventory():
         if transaction_type == 'OUT' or quantity < 0:
             return jsonify({'message': 'لا يوجد مخزون كافٍ لهذا العنصر في المستودع المحدد'}), 400
             
+        quantity_before = 0
         inventory = Inventory(
             item_id=item_id,
             warehouse_id=warehouse_id,
@@ -693,6 +924,7 @@ def update_inventory():
         db.session.add(inventory)
     else:
         # Update existing inventory
+        quantity_before = inventory.quantity
         new_quantity = inventory.quantity + quantity
         
         # Prevent negative inventory for OUT transactions
@@ -702,21 +934,26 @@ def update_inventory():
         inventory.quantity = new_quantity
     
     # Create transaction record with the absolute quantity value
+    moved_at = datetime.utcnow()
     transaction = InventoryTransaction(
         item_id=item_id,
         warehouse_id=warehouse_id,
         transaction_type=transaction_type,
         quantity=abs(quantity),
+        transaction_date=moved_at,
         reference=reference
     )
     db.session.add(transaction)
     
     try:
+        # Keep the per-item stock summary in the same transaction as the movement
+        apply_stock_summary_delta(item_id, quantity_before, inventory.quantity, moved_at)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Database error: {str(e)}'}), 500
     
+    invalidate_dashboard_snapshot()
     return jsonify({
         'inventory_id': inventory.id,
         'quantity': inventory.quantity,
@@ -724,36 +961,176 @@ def update_inventory():
     })
 
 
+@main_bp.route('/api/inventory/bulk-update', methods=['POST'])
+@login_required
+def bulk_update_inventory():
+    # Apply many movements with one lock pass, one ledger insert and one commit
+    data = request.get_json() or {}
+    movements = data.get('movements')
+
+    if not isinstance(movements, list) or not movements:
+        return jsonify({'message': 'movements must be a non-empty list'}), 400
+    if len(movements) > BULK_MAX_MOVEMENTS:
+        return jsonify({'message': f'Too many movements (max {BULK_MAX_MOVEMENTS})'}), 400
+
+    atomic = bool(data.get('atomic', False))
+    try:
+        applied, errors, stock_rows = apply_inventory_movements(movements, atomic=atomic)
+    except Exception as e:
+        return jsonify({'message': f'Database error: {str(e)}'}), 500
+    if applied:
+        invalidate_dashboard_snapshot()
+
+    status = 400 if errors and not applied else 200
+    return jsonify({
+        'applied': applied,
+        'failed': len(errors),
+        'errors': [e.to_dict() for e in errors],
+        'inventory': stock_rows
+    }), status
+
+
+@main_bp.route('/api/inventory/transfer', methods=['POST'])
+@login_required
+def transfer_inventory():
+    # Move stock between warehouses/slots in one transaction. Accepts a single
+    # transfer object, or {"transfers": [...], "atomic": true} for rebalancing.
+    data = request.get_json() or {}
+    is_batch = 'transfers' in data
+    transfers = data['transfers'] if is_batch else [data]
+
+    if not isinstance(transfers, list) or not transfers:
+        return jsonify({'message': 'transfers must be a non-empty list'}), 400
+    if len(transfers) > BULK_MAX_MOVEMENTS:
+        return jsonify({'message': f'Too many transfers (max {BULK_MAX_MOVEMENTS})'}), 400
+
+    atomic = bool(data.get('atomic', True)) if is_batch else True
+    try:
+        applied, errors, stock_rows = apply_stock_transfers(transfers, atomic=atomic)
+    except Exception as e:
+        return jsonify({'message': f'Database error: {str(e)}'}), 500
+    if applied:
+        invalidate_dashboard_snapshot()
+
+    if not is_batch:
+        if errors:
+            return jsonify({'message': errors[0].message}), 400
+        return jsonify({'inventory': stock_rows})
+
+    status = 400 if errors and not applied else 200
+    return jsonify({
+        'applied': applied,
+        'failed': len(errors),
+        'errors': [e.to_dict() for e in errors],
+        'inventory': stock_rows
+    }), status
+
+
+@main_bp.route('/api/batches/allocate', methods=['POST'])
+@login_required
+def allocate_batches():
+    # First-expired-first-out pick of one item across its batch slots
+    data = request.get_json() or {}
+    try:
+        item_id = int(data['item_id'])
+        quantity = int(data['quantity'])
+        warehouse_id = int(data['warehouse_id']) if data.get('warehouse_id') else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'message': 'item_id and quantity must be integers'}), 400
+    if quantity <= 0:
+        return jsonify({'message': 'Quantity must be positive'}), 400
+
+    post_stock = bool(data.get('post_stock', False))
+    try:
+        allocations = allocate_fefo(item_id, quantity, warehouse_id=warehouse_id,
+                                    post_stock=post_stock, reference=data.get('reference', ''))
+    except AllocationError as e:
+        return jsonify(e.to_dict()), 409
+    if post_stock:
+        invalidate_dashboard_snapshot()
+
+    return jsonify({'allocations': allocations})
+
+
+@main_bp.route('/api/batches/near-expiry', methods=['GET'])
+@login_required
+def get_near_expiry_batches():
+    # Batch slots expiring within ?days= days, soonest first, from the precomputed report
+    days = request.args.get('days', NEAR_EXPIRY_DEFAULT_DAYS, type=int)
+    if days is None or days < 0:
+        return jsonify({'message': 'days must be a non-negative integer'}), 400
+
+    return jsonify(get_near_expiry_page(
+        days=days,
+        warehouse_id=request.args.get('warehouse_id', type=int),
+        item_id=request.args.get('item_id', type=int),
+        include_expired=request.args.get('include_expired') in ('1', 'true'),
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', 50, type=int)
+    ))
+
+
+@main_bp.route('/api/sales-orders/<int:id>/allocate', methods=['POST'])
+@login_required
+def allocate_sales_order_route(id):
+    # FEFO allocation for every open line of the order in one pass
+    data = request.get_json(silent=True) or {}
+    post_stock = bool(data.get('post_stock', False))
+    try:
+        allocations, shortages = allocate_sales_order(
+            id,
+            warehouse_id=data.get('warehouse_id'),
+            post_stock=post_stock,
+            allow_partial=bool(data.get('allow_partial', False))
+        )
+    except LookupError as e:
+        return jsonify({'message': str(e)}), 404
+    except AllocationError as e:
+        return jsonify(e.to_dict()), 409
+    if post_stock and allocations:
+        invalidate_dashboard_snapshot()
+
+    return jsonify({'allocations': allocations, 'shortages': shortages})
+
+
 # Inventory Transaction Routes
-@app.route('/api/transactions', methods=['GET'])
+@main_bp.route('/api/transactions', methods=['GET'])
 @login_required
 def get_transactions():
-    transactions = InventoryTransaction.query.all()
-    return jsonify([{
-        'id': t.id,
-        'item_id': t.item_id,
-        'warehouse_id': t.warehouse_id,
-        'transaction_type': t.transaction_type,
-        'quantity': t.quantity,
-        'transaction_date': t.transaction_date.isoformat(),
-        'reference': t.reference
-    } for t in transactions])
+    # Cursor-paginated ledger; pass next_cursor back as ?cursor= for the next page
+    transaction_type = request.args.get('transaction_type')
+    if transaction_type and transaction_type not in transaction_type_enum.enums:
+        return jsonify({'message': f'Invalid transaction type: {transaction_type}'}), 400
+
+    try:
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        page = get_transactions_page(
+            item_id=request.args.get('item_id', type=int),
+            warehouse_id=request.args.get('warehouse_id', type=int),
+            transaction_type=transaction_type,
+            date_from=parse_datetime_param(date_from) if date_from else None,
+            date_to=parse_datetime_param(date_to) if date_to else None,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', TRANSACTIONS_DEFAULT_LIMIT, type=int),
+            fields=request.args.get('fields'),
+            expand=request.args.get('expand')
+        )
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return json_response(page)
 
 
 # Warehouse Section Routes
-@app.route('/api/warehouse-sections', methods=['GET'])
+@main_bp.route('/api/warehouse-sections', methods=['GET'])
 @login_required
+@cached_response(WarehouseSection, Warehouse)
 def get_warehouse_sections():
-    sections = WarehouseSection.query.all()
-    return jsonify([{
-        'id': s.id,
-        'warehouse_id': s.warehouse_id,
-        'section_name': s.section_name,
-        'row_count': s.row_count,
-        'column_count': s.column_count
-    } for s in sections])
+    statement, shape = request_projection(WarehouseSection, SECTION_COLUMNS, SECTION_EXPANSIONS)
+    return json_rows(statement.order_by(WarehouseSection.id), shape)
 
-@app.route('/api/warehouse-sections', methods=['POST'])
+@main_bp.route('/api/warehouse-sections', methods=['POST'])
 @login_required
 def create_warehouse_section():
     data = request.get_json()
@@ -764,6 +1141,7 @@ def create_warehouse_section():
         column_count=data.get('column_count', 10)
     )
     db.session.add(section)
+    bump_table_versions(WarehouseSection)
     db.session.commit()
     return jsonify({
         'id': section.id,
@@ -771,7 +1149,7 @@ def create_warehouse_section():
         'warehouse_id': section.warehouse_id
     }), 201
 
-@app.route('/api/warehouse-sections/<int:id>', methods=['PUT'])
+@main_bp.route('/api/warehouse-sections/<int:id>', methods=['PUT'])
 @login_required
 def update_warehouse_section(id):
     section = WarehouseSection.query.get_or_404(id)
@@ -779,6 +1157,7 @@ def update_warehouse_section(id):
     for key, value in data.items():
         if hasattr(section, key):
             setattr(section, key, value)
+    bump_table_versions(WarehouseSection)
     db.session.commit()
     return jsonify({
         'id': section.id,
@@ -787,29 +1166,23 @@ def update_warehouse_section(id):
         'column_count': section.column_count
     })
 
-@app.route('/api/warehouse-sections/<int:id>', methods=['DELETE'])
+@main_bp.route('/api/warehouse-sections/<int:id>', methods=['DELETE'])
 @login_required
 def delete_warehouse_section(id):
     section = WarehouseSection.query.get_or_404(id)
     db.session.delete(section)
+    bump_table_versions(WarehouseSection)
     db.session.commit()
     return '', 204
 
 # Warehouse Slot Routes
-@app.route('/api/warehouse-slots', methods=['GET'])
+@main_bp.route('/api/warehouse-slots', methods=['GET'])
 @login_required
 def get_warehouse_slots():
-    slots = WarehouseSlot.query.all()
-    return jsonify([{
-        'id': s.id,
-        'section_id': s.section_id,
-        'row_number': s.row_number,
-        'column_number': s.column_number,
-        'item_id': s.item_id,
-        'quantity': s.quantity
-    } for s in slots])
+    statement, shape = request_projection(WarehouseSlot, SLOT_COLUMNS, SLOT_EXPANSIONS)
+    return json_rows(statement.order_by(WarehouseSlot.id), shape)
 
-@app.route('/api/warehouse-slots', methods=['POST'])
+@main_bp.route('/api/warehouse-slots', methods=['POST'])
 @login_required
 def create_warehouse_slot():
     data = request.get_json()
@@ -829,7 +1202,7 @@ def create_warehouse_slot():
         'column_number': slot.column_number
     }), 201
 
-@app.route('/api/warehouse-slots/<int:id>', methods=['PUT'])
+@main_bp.route('/api/warehouse-slots/<int:id>', methods=['PUT'])
 @login_required
 def update_warehouse_slot(id):
     slot = WarehouseSlot.query.get_or_404(id)
@@ -845,7 +1218,7 @@ def update_warehouse_slot(id):
         'quantity': slot.quantity
     })
 
-@app.route('/api/warehouse-slots/<int:id>', methods=['DELETE'])
+@main_bp.route('/api/warehouse-slots/<int:id>', methods=['DELETE'])
 @login_required
 def delete_warehouse_slot(id):
     slot = WarehouseSlot.query.get_or_404(id)
@@ -854,29 +1227,32 @@ def delete_warehouse_slot(id):
     return '', 204
 
 # Additional utility endpoints for warehouse layout management
-@app.route('/api/warehouse-sections/<int:id>/slots', methods=['GET'])
+@main_bp.route('/api/warehouse-sections/<int:id>/slots', methods=['GET'])
 @login_required
 def get_section_slots(id):
-    slots = WarehouseSlot.query.filter_by(section_id=id).all()
-    return jsonify([{
-        'id': s.id,
-        'row_number': s.row_number,
-        'column_number': s.column_number,
-        'item_id': s.item_id,
-        'quantity': s.quantity
-    } for s in slots])
+    # Same fields as /api/warehouse-slots without the section_id every row shares
+    statement, shape = request_projection(
+        WarehouseSlot, [column for column in SLOT_COLUMNS if column[0] != 'section_id'], SLOT_EXPANSIONS)
+    return json_rows(statement.where(WarehouseSlot.section_id == id).order_by(WarehouseSlot.id), shape)
 
-@app.route('/api/warehouses/<int:id>/sections', methods=['GET'])
+@main_bp.route('/api/warehouses/<int:id>/sections', methods=['GET'])
 @login_required
 def get_warehouse_layout(id):
-    sections = WarehouseSection.query.filter_by(warehouse_id=id).all()
+    # ?format=compact returns each section's grid as dense row-major arrays
+    if request.args.get('format') == 'compact':
+        return jsonify(get_warehouse_layout_compact(id))
+
+    sections = WarehouseSection.query.options(joinedload(WarehouseSection.slots))\
+        .filter_by(warehouse_id=id).order_by(WarehouseSection.id).all()
     return jsonify([{
         'id': s.id,
+        'warehouse_id': s.warehouse_id,
         'section_name': s.section_name,
         'row_count': s.row_count,
         'column_count': s.column_count,
         'slots': [{
             'id': slot.id,
+            'section_id': slot.section_id,
             'row_number': slot.row_number,
             'column_number': slot.column_number,
             'item_id': slot.item_id,
@@ -885,8 +1261,9 @@ def get_warehouse_layout(id):
     } for s in sections])
 
 # Dashboard API Endpoints
-@app.route('/api/dashboard/stats')
+@main_bp.route('/api/dashboard/stats')
 @login_required
+@reporting_route
 def get_dashboard_stats():
     # Get counts
     items_count = Item.query.count()
@@ -901,51 +1278,127 @@ def get_dashboard_stats():
         'totalTransactions': transactions_count
     })
 
-@app.route('/api/dashboard/low-stock')
+@main_bp.route('/api/dashboard/snapshot')
 @login_required
-def get_low_stock_items():
-    # Get items with quantity below reorder level
-    items = Item.query.all()
-    low_stock_items = []
-    
-    for item in items:
-        # Calculate total quantity across all warehouses
-        total_quantity = db.session.query(db.func.sum(Inventory.quantity))\
-            .filter(Inventory.item_id == item.id).scalar() or 0
-        
-        if total_quantity <= item.reorder_level:
-            low_stock_items.append({
-                'id': item.id,
-                'name': item.name,
-                'quantity': total_quantity,
-                'reorder_level': item.reorder_level
-            })
-    
-    return jsonify(low_stock_items)
+def get_dashboard_snapshot_route():
+    # Every dashboard card and chart, precomputed with SQL aggregates and cached briefly
+    return jsonify(get_dashboard_snapshot())
 
-@app.route('/api/dashboard/recent-transactions')
+@main_bp.route('/api/dashboard/low-stock')
 @login_required
+@reporting_route
+def get_low_stock_items():
+    # Items at or below their reorder level, computed in a single grouped query.
+    # A bare array of every such item, as this endpoint has always returned; with
+    # page or per_page it is one page in an envelope with the total count.
+    sort_by = request.args.get('sort', 'shortage')
+    if sort_by not in LOW_STOCK_SORT_FIELDS:
+        return jsonify({'message': f'Invalid sort field: {sort_by}'}), 400
+
+    filters = {
+        'category_id': request.args.get('category_id', type=int),
+        'warehouse_id': request.args.get('warehouse_id', type=int),
+        'sort_by': sort_by,
+        'descending': request.args.get('order', 'desc') != 'asc'
+    }
+    if 'page' not in request.args and 'per_page' not in request.args:
+        return jsonify(list_low_stock_items(**filters))
+    return jsonify(get_low_stock_page(
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', 50, type=int),
+        **filters
+    ))
+
+@main_bp.route('/api/dashboard/recent-transactions')
+@login_required
+@reporting_route
 def get_recent_transactions():
-    # Get 10 most recent transactions
-    transactions = InventoryTransaction.query.order_by(
-        InventoryTransaction.transaction_date.desc()
-    ).limit(10).all()
-    
-    result = []
-    for txn in transactions:
-        item = Item.query.get(txn.item_id)
-        result.append({
-            'id': txn.id,
-            'item_id': txn.item_id,
-            'item_name': item.name if item else None,
-            'warehouse_id': txn.warehouse_id,
-            'transaction_type': txn.transaction_type,
-            'quantity': txn.quantity,
-            'transaction_date': txn.transaction_date.isoformat(),
-            'reference': txn.reference
-        })
-    
-    return jsonify(result)
+    # Most recent transactions with their item names, in one joined query
+    statement, shape = request_projection(InventoryTransaction, RECENT_TRANSACTION_COLUMNS, TRANSACTION_EXPANSIONS)
+    return json_rows(
+        statement.outerjoin(Item, Item.id == InventoryTransaction.item_id)
+        .order_by(InventoryTransaction.transaction_date.desc(), InventoryTransaction.id.desc())
+        .limit(RECENT_TRANSACTIONS_LIMIT),
+        shape
+    )
+
+# Production Planning Routes
+@main_bp.route('/api/bom/explode', methods=['GET'])
+@login_required
+def explode_bom_route():
+    # Flattened gross component requirements for N units of a product
+    item_id = request.args.get('item_id', type=int)
+    bom_id = request.args.get('bom_id', type=int)
+    quantity = request.args.get('quantity', 1, type=float)
+    if item_id is None and bom_id is None:
+        return jsonify({'message': 'item_id or bom_id is required'}), 400
+    if quantity <= 0:
+        return jsonify({'message': 'Quantity must be positive'}), 400
+
+    try:
+        return jsonify(explode_bom(item_id=item_id, quantity=quantity, bom_id=bom_id))
+    except BOMCycleError as e:
+        return jsonify(e.to_dict()), 409
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 404
+
+@main_bp.route('/api/mrp/run', methods=['POST'])
+@login_required
+def run_mrp_route():
+    # Rewrites the 'Proposed' InventoryReplenishmentPlan rows from current demand and supply
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(run_mrp(incremental=bool(data.get('incremental'))))
+    except BOMCycleError as e:
+        db.session.rollback()
+        return jsonify(e.to_dict()), 409
+
+@main_bp.route('/api/forecasts/run', methods=['POST'])
+@login_required
+def run_demand_forecast_route():
+    # Queues a refit of every item with OUT history as a 'forecast' job; poll
+    # /api/jobs/<id> for its result
+    if not current_user.role or current_user.role.name != 'admin':
+        return jsonify({'message': 'Unauthorized'}), 403
+
+    data = request.get_json(silent=True) or {}
+    try:
+        params = {
+            'frequency': data.get('frequency', 'weekly'),
+            'horizon': int(data.get('horizon', FORECAST_DEFAULT_HORIZON)),
+            'history': int(data['history']) if data.get('history') else None,
+            'workers': int(data['workers']) if data.get('workers') else None
+        }
+        check_forecast_parameters(params['frequency'], params['horizon'], params['history'])
+    except (TypeError, ValueError) as e:
+        return jsonify({'message': str(e)}), 400
+    job = submit_job('forecast', params, created_by=current_user.id)
+    return jsonify(job_to_dict(job)), 202
+
+@main_bp.route('/api/forecasts', methods=['GET'])
+@login_required
+def get_forecasts():
+    # One frequency's forecasts (weekly unless ?frequency=daily), by item and period
+    frequency = request.args.get('frequency', 'weekly')
+    if frequency not in FORECAST_FREQUENCIES:
+        return jsonify({'message': f'Invalid frequency: {frequency}'}), 400
+    statement, shape = request_projection(DemandForecast, FORECAST_COLUMNS, FORECAST_EXPANSIONS)
+    statement = statement.where(DemandForecast.frequency == frequency)
+    item_id = request.args.get('item_id', type=int)
+    if item_id is not None:
+        statement = statement.where(DemandForecast.item_id == item_id)
+    return stream_json_rows(statement.order_by(DemandForecast.item_id, DemandForecast.forecast_date), shape)
+
+@main_bp.route('/api/production-runs/<int:id>/requirements', methods=['GET'])
+@login_required
+def get_production_run_requirements(id):
+    # Every line of the run exploded in one pass, with run-wide totals
+    try:
+        return jsonify(explode_production_run(id))
+    except LookupError as e:
+        return jsonify({'message': str(e)}), 404
+    except BOMCycleError as e:
+        return jsonify(e.to_dict()), 409
 
 # # # # # # # # # # # # # # # # # # # # # # 
 # # # # # # # # # # # # # # # # # # # # # # 
@@ -964,63 +1417,63 @@ def get_recent_transactions():
 # # # # # # # # # # # # # # # # # # # # # # 
 # # # # # # # # # # # # # # # # # # # # # # 
 
-@app.route('/')
+@main_bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/login')
+@main_bp.route('/login')
 def login_page():
     return render_template('login.html')
 
-@app.route('/register')
+@main_bp.route('/register')
 @login_required
 
 def register_page():
     return render_template('register.html')
 
-@app.route('/dashboard')
+@main_bp.route('/dashboard')
 @login_required
 def dashboard():
     return render_template('dashboard.html')
 
-@app.route('/inventory-management')
+@main_bp.route('/inventory-management')
 @login_required
 def inventory_page():
     return render_template('inventory.html')
 
-@app.route('/warehouse-layout')
+@main_bp.route('/warehouse-layout')
 @login_required
 def warehouse_layout_page():
     return render_template('warehouse_layout.html')
 
-@app.route('/categories-management')
+@main_bp.route('/categories-management')
 @login_required
 def categories_page():
     return render_template('categories.html')
 
-@app.route('/items-management')
+@main_bp.route('/items-management')
 @login_required
 def items_page():
     return render_template('items.html')
 
-@app.route('/transactions-history')
+@main_bp.route('/transactions-history')
 @login_required
 def transactions_page():
     return render_template('transactions.html')
 
-@app.route('/user-profile')
+@main_bp.route('/user-profile')
 @login_required
 def profile_page():
     return render_template('profile.html')
 
-@app.route('/admin/users')
+@main_bp.route('/admin/users')
 @login_required
 def admin_users_page():
     if not current_user.role or current_user.role.name != 'admin':
         return redirect('/dashboard')
     return render_template('admin_users.html')
 
-@app.route('/admin/roles')
+@main_bp.route('/admin/roles')
 @login_required
 def admin_roles_page():
     if not current_user.role or current_user.role.name != 'admin':
@@ -1031,5 +1484,32 @@ def admin_roles_page():
 
 
 
+def create_app(config=None):
+    # Application factory. Nothing here touches the database, so importing the
+    # app or booting a worker is cheap; run `flask init-db` to create the schema.
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'your-secret-key'
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    if config:
+        app.config.update(config)
+    init_database(app)  # Connect SQLAlchemy to this Flask app (see database.py for the settings)
+    login_manager.init_app(app)
+    # Ensure upload directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    app.register_blueprint(main_bp)
+    app.register_blueprint(support_bp)
+    app.register_blueprint(export_bp)
+    app.register_blueprint(job_bp)
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
+    # The development server sets up a fresh database on its own
+    with app.app_context():
+        init_db()
+        ensure_stock_summaries()
+        ensure_item_search()
+        ensure_near_expiry()
+        seed_defaults()
     app.run(debug=True)
@@ -0,0 +1,114 @@
+# Item search benchmark: typeahead latency of /api/items/search over a large catalogue.
+#
+# Usage (from the project root):
+#   python benchmarks/bench_item_search.py                  # 500k items
+#   python benchmarks/bench_item_search.py 100000 500000    # custom sizes
+#
+# Item names are three words and descriptions six, drawn with a Zipf-like skew
+# from a few thousand generated Arabic and Latin words plus a list of real ones
+# (some with diacritics or hamza forms), so the common words and short prefixes
+# match tens of thousands of items. Each query fetches page 1 with 20 results,
+# as the typeahead does.
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, Category, Item
+from search_services import search_items, rebuild_item_search
+
+WORDS = [
+    'مِسْمار', 'صامولة', 'أنبوب', 'إبريق', 'زيت', 'مستشفى', 'كابل', 'لوح', 'غطاء', 'مضخة',
+    'صمام', 'حزام', 'فلتر', 'بطارية', 'مصباح', 'steel', 'copper', 'bolt', 'nut', 'washer',
+    'pipe', 'valve', 'pump', 'filter', 'cable', 'panel', 'bearing', 'gasket', 'hose', 'sensor'
+]
+QUERIES = ['مس', 'مسما', 'انبوب', 'ابريق ز', 'مستشفي', 'st', 'stee', 'copper b', 'valve pump',
+           'SKU-00012', 'SKU-0004999', 'bear', 'فلتر زيت', 'zzz']
+
+
+def create_bench_app(db_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def vocabulary(rng, size=4000):
+    arabic = 'ابتثجحخدذرزسشصضطظعغفقكلمنهوي'
+    latin = 'abcdefghijklmnopqrstuvwxyz'
+    words = list(WORDS)
+    while len(words) < size:
+        letters = arabic if len(words) % 2 else latin
+        words.append(''.join(rng.choice(letters) for _ in range(rng.randint(4, 8))))
+    return words, [1 / (rank + 1) for rank in range(len(words))]
+
+
+def seed(item_count):
+    rng = random.Random(42)
+    words, weights = vocabulary(rng)
+    db.session.bulk_insert_mappings(Category, [{'id': c, 'name': f'{rng.choice(WORDS)} {c}'} for c in range(1, 51)])
+    for start in range(1, item_count + 1, 50000):
+        db.session.bulk_insert_mappings(Item, [{
+            'id': i,
+            'name': ' '.join(rng.choices(words, weights, k=3)) + f' {i % 1000}',
+            'category_id': rng.randint(1, 50),
+            'sku': f'SKU-{i:07d}',
+            'description': ' '.join(rng.choices(words, weights, k=6)),
+            'cost': 1.0,
+            'price': 2.0,
+            'reorder_level': 10
+        } for i in range(start, min(start + 50000, item_count + 1))])
+    db.session.commit()
+
+
+def run(item_count, repeat=20):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_bench_app(db_path)
+        with app.app_context():
+            db.create_all()
+            seed(item_count)
+            started = time.perf_counter()
+            rebuild_item_search()
+            index_seconds = time.perf_counter() - started
+
+            rows = []
+            for query in QUERIES:
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    result = search_items(query, per_page=20)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                rows.append((query, result['total'], statistics.median(timings), timings[int(len(timings) * 0.95) - 1]))
+
+            db.session.remove()
+            db.engine.dispose()
+        return index_seconds, rows
+    finally:
+        os.remove(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark item search latency')
+    parser.add_argument('sizes', nargs='*', type=int, default=[500000])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        index_seconds, rows = run(size)
+        print(f'{size} items, index built in {index_seconds:.1f}s')
+        print(f"  {'query':<14} {'matches':>9} {'p50 ms':>8} {'p95 ms':>8}")
+        for query, total, p50, p95 in rows:
+            print(f'  {query:<14} {total:>9} {p50:>8.2f} {p95:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
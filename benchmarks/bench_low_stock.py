@@ -0,0 +1,148 @@
+# Low-stock benchmark: legacy per-item SUM loop vs the grouped low-stock engine.
+#
+# Usage (from the project root):
+#   python benchmarks/bench_low_stock.py                 # 1k, 10k, 100k items
+#   python benchmarks/bench_low_stock.py 1000 5000       # custom sizes
+#   python benchmarks/bench_low_stock.py --legacy-max 100000   # also time the legacy loop at 100k
+#
+# Each size is seeded into a throwaway SQLite file with 3 warehouses and roughly
+# a third of the items below their reorder level. The legacy loop is skipped
+# above --legacy-max items because it issues one query per item.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event, func
+from models import db, Category, Item, Warehouse, Inventory
+from inventory_services import get_low_stock_page, rebuild_stock_summaries
+
+
+def create_bench_app(db_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def seed(item_count, warehouse_count=3):
+    rng = random.Random(42)
+    db.session.add(Category(id=1, name='Bench'))
+    db.session.bulk_insert_mappings(Warehouse, [
+        {'id': w, 'name': f'WH {w}'} for w in range(1, warehouse_count + 1)
+    ])
+    db.session.bulk_insert_mappings(Item, [{
+        'id': i,
+        'name': f'Item {i}',
+        'category_id': 1,
+        'sku': f'SKU-{i:07d}',
+        'cost': 1.0,
+        'price': 2.0,
+        'reorder_level': 30
+    } for i in range(1, item_count + 1)])
+    db.session.bulk_insert_mappings(Inventory, [{
+        'item_id': i,
+        'warehouse_id': w,
+        'quantity': rng.randint(0, 40)
+    } for i in range(1, item_count + 1) for w in range(1, warehouse_count + 1)
+        if rng.random() < 0.7])
+    db.session.commit()
+    rebuild_stock_summaries()
+
+
+def legacy_low_stock():
+    # Verbatim copy of the loop the endpoint used before the grouped engine
+    low_stock_items = []
+    for item in Item.query.all():
+        total_quantity = db.session.query(func.sum(Inventory.quantity))\
+            .filter(Inventory.item_id == item.id).scalar() or 0
+        if total_quantity <= item.reorder_level:
+            low_stock_items.append({
+                'id': item.id,
+                'name': item.name,
+                'quantity': total_quantity,
+                'reorder_level': item.reorder_level
+            })
+    return low_stock_items
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def measure(fn):
+    with QueryCounter(db.engine) as counter:
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+    db.session.expunge_all()
+    return result, counter.count, elapsed
+
+
+def run(item_count, legacy_max):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_bench_app(db_path)
+        with app.app_context():
+            db.create_all()
+            seed(item_count)
+
+            rows = []
+            if item_count <= legacy_max:
+                result, queries, elapsed = measure(legacy_low_stock)
+                rows.append(('legacy loop', len(result), queries, elapsed))
+            else:
+                rows.append(('legacy loop', None, None, None))
+
+            result, queries, elapsed = measure(lambda: get_low_stock_page(per_page=50))
+            rows.append(('engine page 1', result['total'], queries, elapsed))
+
+            result, queries, elapsed = measure(
+                lambda: get_low_stock_page(warehouse_id=2, sort_by='name', descending=False, per_page=50))
+            rows.append(('engine by warehouse', result['total'], queries, elapsed))
+
+            db.session.remove()
+            db.engine.dispose()
+        return rows
+    finally:
+        os.remove(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the low-stock endpoint query paths')
+    parser.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-max', type=int, default=10000,
+                        help='skip the legacy loop above this many items')
+    args = parser.parse_args()
+
+    print(f"{'items':>8}  {'path':<20} {'low stock':>10} {'queries':>8} {'ms':>10}")
+    for size in args.sizes:
+        for name, matched, queries, elapsed in run(size, args.legacy_max):
+            if queries is None:
+                print(f'{size:>8}  {name:<20} {"skipped":>10}')
+                continue
+            print(f'{size:>8}  {name:<20} {matched:>10} {queries:>8} {elapsed * 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# MRP benchmark: full and incremental netting runs over a synthetic catalogue.
+#
+# Usage (from the project root):
+#   python benchmarks/bench_mrp.py                 # 50k items
+#   python benchmarks/bench_mrp.py 10000 50000     # custom sizes
+#
+# A tenth of the items are manufactured from three components each, over four
+# BOM levels; every item has stock, and a quarter carry open sales demand or an
+# open purchase order. After the full run, 1% of the stock rows change and an
+# incremental run is timed.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import update, bindparam
+from models import (
+    db, Category, Item, Warehouse, Inventory, BOM, BOMDetail, Customer, SalesOrder,
+    SalesOrderDetail, Supplier, SupplierItem, PurchaseOrder, PurchaseOrderDetail,
+    ProductionRun, ProductionRunDetail
+)
+from production_services import run_mrp, invalidate_bom_cache
+
+
+def create_bench_app(db_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def seed(item_count, levels=4):
+    rng = random.Random(42)
+    db.session.add(Category(id=1, name='Bench'))
+    db.session.add(Warehouse(id=1, name='WH 1'))
+    db.session.add(Customer(id=1, customer_name='Bench customer'))
+    db.session.add(Supplier(id=1, supplier_name='Bench supplier'))
+    db.session.bulk_insert_mappings(Item, [{
+        'id': i,
+        'name': f'Item {i}',
+        'category_id': 1,
+        'sku': f'SKU-{i:07d}',
+        'cost': 1.0,
+        'price': 2.0,
+        'reorder_level': 10
+    } for i in range(1, item_count + 1)])
+
+    # Manufactured items split into levels; each draws components from the level below it
+    manufactured = list(range(1, item_count // 10 + 1))
+    per_level = max(1, len(manufactured) // levels)
+    boms, details = [], []
+    for index, product_id in enumerate(manufactured):
+        level = index // per_level
+        below = manufactured[(level + 1) * per_level:(level + 2) * per_level] or \
+            range(len(manufactured) + 1, item_count + 1)
+        boms.append({'id': product_id, 'final_product_id': product_id})
+        for component_id in rng.sample(list(below), 3):
+            details.append({'bom_id': product_id, 'component_item_id': component_id,
+                            'quantity_required': rng.choice((0.5, 1, 2, 4))})
+    db.session.bulk_insert_mappings(BOM, boms)
+    db.session.bulk_insert_mappings(BOMDetail, details)
+
+    db.session.bulk_insert_mappings(Inventory, [{
+        'id': i, 'item_id': i, 'warehouse_id': 1, 'quantity': rng.randint(0, 50)
+    } for i in range(1, item_count + 1)])
+    db.session.bulk_insert_mappings(SupplierItem, [{
+        'supplier_id': 1, 'item_id': i, 'cost': 1.0
+    } for i in range(len(manufactured) + 1, item_count + 1)])
+
+    db.session.add(SalesOrder(id=1, customer_id=1, status='Pending'))
+    db.session.add(PurchaseOrder(id=1, supplier_id=1, status='Approved'))
+    db.session.add(ProductionRun(id=1, status='Planned'))
+    db.session.bulk_insert_mappings(SalesOrderDetail, [{
+        'sales_order_id': 1, 'item_id': i, 'quantity_ordered': rng.randint(1, 40), 'unit_price': 2.0
+    } for i in range(1, item_count + 1) if rng.random() < 0.25])
+    db.session.bulk_insert_mappings(PurchaseOrderDetail, [{
+        'po_id': 1, 'item_id': i, 'quantity_ordered': rng.randint(1, 40), 'unit_price': 1.0
+    } for i in range(len(manufactured) + 1, item_count + 1) if rng.random() < 0.25])
+    db.session.bulk_insert_mappings(ProductionRunDetail, [{
+        'production_run_id': 1, 'item_id': i, 'quantity_planned': rng.randint(1, 20)
+    } for i in manufactured[:per_level]])
+    db.session.commit()
+    invalidate_bom_cache()
+
+
+def touch_stock(item_count, fraction=0.01):
+    rng = random.Random(7)
+    db.session.execute(
+        update(Inventory.__table__).where(Inventory.__table__.c.InventoryID == bindparam('b_id'))
+        .values(Quantity=bindparam('b_quantity')),
+        [{'b_id': i, 'b_quantity': rng.randint(0, 50)}
+         for i in rng.sample(range(1, item_count + 1), max(1, int(item_count * fraction)))]
+    )
+    db.session.commit()
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def run(item_count):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_bench_app(db_path)
+        with app.app_context():
+            db.create_all()
+            seed(item_count)
+
+            rows = []
+            result, elapsed = timed(run_mrp)
+            rows.append(('full run', result, elapsed))
+            touch_stock(item_count)
+            result, elapsed = timed(lambda: run_mrp(incremental=True))
+            rows.append(('incremental (1%)', result, elapsed))
+
+            db.session.remove()
+            db.engine.dispose()
+        return rows
+    finally:
+        os.remove(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark full and incremental MRP runs')
+    parser.add_argument('sizes', nargs='*', type=int, default=[50000])
+    args = parser.parse_args()
+
+    print(f"{'items':>8}  {'run':<18} {'recomputed':>10} {'plans':>8} {'ms':>10}")
+    for size in args.sizes:
+        for name, result, elapsed in run(size):
+            print(f"{size:>8}  {name:<18} {result['items_recomputed']:>10} "
+                  f"{result['plans_written']:>8} {elapsed * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
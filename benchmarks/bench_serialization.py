@@ -0,0 +1,192 @@
+# List serialization benchmark: ORM entities + jsonify vs column tuples + the
+# fast encoder, for the /api/items, /api/inventory and /api/transactions bodies.
+#
+# Usage (from the project root):
+#   python benchmarks/bench_serialization.py                # 10k and 100k items
+#   python benchmarks/bench_serialization.py 50000          # custom sizes
+#
+# Each size is seeded into a throwaway SQLite file with 3 warehouses (about two
+# stock rows per item) and one transaction per stock row. Timings cover the
+# query and the encoded response body; the transactions figure is one page at
+# the maximum limit. The encoder line shows whether orjson is installed.
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+from sqlalchemy import select
+from models import db, Category, Item, Warehouse, Inventory, InventoryTransaction
+from inventory_services import TRANSACTIONS_MAX_LIMIT, get_transactions_page
+from serialization import orjson, json_response, stream_json_rows
+from app import ITEM_COLUMNS, INVENTORY_COLUMNS
+
+
+def create_bench_app(db_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def seed(item_count, warehouse_count=3):
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    db.session.add(Category(id=1, name='Bench'))
+    db.session.bulk_insert_mappings(Warehouse, [
+        {'id': w, 'name': f'WH {w}'} for w in range(1, warehouse_count + 1)
+    ])
+    db.session.bulk_insert_mappings(Item, [{
+        'id': i,
+        'name': f'صنف {i}',
+        'category_id': 1,
+        'sku': f'SKU-{i:07d}',
+        'description': f'Bench item {i}',
+        'unit_of_measure': 'pcs',
+        'cost': 1.5,
+        'price': 2.25,
+        'reorder_level': 30
+    } for i in range(1, item_count + 1)])
+    stock = [(i, w) for i in range(1, item_count + 1) for w in range(1, warehouse_count + 1) if rng.random() < 0.7]
+    db.session.bulk_insert_mappings(Inventory, [{
+        'item_id': i,
+        'warehouse_id': w,
+        'quantity': rng.randint(0, 40),
+        'last_updated': start + timedelta(seconds=n)
+    } for n, (i, w) in enumerate(stock)])
+    db.session.bulk_insert_mappings(InventoryTransaction, [{
+        'item_id': i,
+        'warehouse_id': w,
+        'transaction_type': 'IN',
+        'quantity': rng.randint(1, 40),
+        'transaction_date': start + timedelta(seconds=n),
+        'reference': f'PO-{n}'
+    } for n, (i, w) in enumerate(stock)])
+    db.session.commit()
+
+
+# Verbatim copies of what the endpoints did before the column-tuple path
+
+def legacy_items():
+    items = Item.query.all()
+    return jsonify([{
+        'id': i.id,
+        'name': i.name,
+        'category_id': i.category_id,
+        'sku': i.sku,
+        'description': i.description,
+        'unit_of_measure': i.unit_of_measure,
+        'cost': i.cost,
+        'price': i.price,
+        'reorder_level': i.reorder_level
+    } for i in items]).get_data()
+
+
+def legacy_inventory():
+    inventory = Inventory.query.all()
+    return jsonify([{
+        'id': inv.id,
+        'item_id': inv.item_id,
+        'warehouse_id': inv.warehouse_id,
+        'quantity': inv.quantity,
+        'last_updated': inv.last_updated.isoformat()
+    } for inv in inventory]).get_data()
+
+
+def legacy_transactions():
+    rows = InventoryTransaction.query.order_by(
+        InventoryTransaction.transaction_date.desc(),
+        InventoryTransaction.id.desc()
+    ).limit(TRANSACTIONS_MAX_LIMIT + 1).all()[:TRANSACTIONS_MAX_LIMIT]
+    return jsonify({'transactions': [{
+        'id': t.id,
+        'item_id': t.item_id,
+        'warehouse_id': t.warehouse_id,
+        'transaction_type': t.transaction_type,
+        'quantity': t.quantity,
+        'transaction_date': t.transaction_date.isoformat(),
+        'reference': t.reference
+    } for t in rows]}).get_data()
+
+
+def fast_items():
+    return b''.join(stream_json_rows(
+        select(*[column for _, column in ITEM_COLUMNS]).order_by(Item.id),
+        [name for name, _ in ITEM_COLUMNS]
+    ).response)
+
+
+def fast_inventory():
+    return b''.join(stream_json_rows(
+        select(*[column for _, column in INVENTORY_COLUMNS]).order_by(Inventory.id),
+        [name for name, _ in INVENTORY_COLUMNS]
+    ).response)
+
+
+def fast_transactions():
+    return json_response(get_transactions_page(limit=TRANSACTIONS_MAX_LIMIT)).get_data()
+
+
+CASES = [
+    ('items', legacy_items, fast_items),
+    ('inventory', legacy_inventory, fast_inventory),
+    ('transactions', legacy_transactions, fast_transactions)
+]
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        # Fresh session each run so the legacy path pays for hydration every time
+        db.session.remove()
+        started = time.perf_counter()
+        body = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), len(body)
+
+
+def run(item_count, repeat=5):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = create_bench_app(db_path)
+        with app.app_context():
+            db.create_all(bind_key=None)
+            seed(item_count)
+            rows = []
+            with app.test_request_context():
+                for name, legacy, fast in CASES:
+                    legacy_ms, legacy_bytes = timed(legacy, repeat)
+                    fast_ms, fast_bytes = timed(fast, repeat)
+                    rows.append((name, legacy_ms, fast_ms, legacy_bytes, fast_bytes))
+            db.session.remove()
+            db.engine.dispose()
+        return rows
+    finally:
+        os.remove(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark list endpoint serialization')
+    parser.add_argument('sizes', nargs='*', type=int, default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson ' + orjson.__version__ if orjson is not None else 'json (stdlib)'}")
+    for size in args.sizes:
+        print(f'{size} items')
+        print(f"  {'endpoint':<13} {'legacy ms':>10} {'fast ms':>9} {'speedup':>8} {'legacy KB':>10} {'fast KB':>8}")
+        for name, legacy_ms, fast_ms, legacy_bytes, fast_bytes in run(size, args.repeat):
+            print(f'  {name:<13} {legacy_ms:>10.1f} {fast_ms:>9.1f} {legacy_ms / fast_ms:>7.1f}x'
+                  f' {legacy_bytes / 1024:>10.0f} {fast_bytes / 1024:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy import event, select, update
+from models import db, TableVersion, _insert_ignore
+
+##############################################################################
+# TABLE VERSIONS
+##############################################################################
+
+# How often each process re-reads the versions bumped by other workers. Writes
+# made in this process are seen on the next request.
+TABLE_VERSION_CHECK_SECONDS = 2
+
+_version_lock = threading.Lock()
+_versions = {'tables': {}, 'checked_at': None, 'generation': 0}
+
+
+def _load_table_versions():
+    # Plain Core read on its own connection: no ORM and no request transaction
+    table = TableVersion.__table__
+    with db.engine.connect() as connection:
+        return {name: (version, modified_at) for name, version, modified_at in connection.execute(
+            select(table.c.TableName, table.c.Version, table.c.ModifiedAt)
+        )}
+
+
+def get_table_versions(tables):
+    # [(version, modified_at), ...] for the given table names; (0, None) for a
+    # table that has never been bumped
+    with _version_lock:
+        checked_at = _versions['checked_at']
+        if checked_at is not None and time.monotonic() - checked_at < TABLE_VERSION_CHECK_SECONDS:
+            return [_versions['tables'].get(name, (0, None)) for name in tables]
+        generation = _versions['generation']
+
+    loaded = _load_table_versions()
+    with _version_lock:
+        # A commit in this process while we were reading may not be included
+        if _versions['generation'] == generation:
+            _versions['tables'] = loaded
+            _versions['checked_at'] = time.monotonic()
+    return [loaded.get(name, (0, None)) for name in tables]
+
+
+def bump_table_versions(*models, connection=None):
+    # Call before the commit of a write to any of `models`; the new versions
+    # are committed with it. Pass the flush's connection from inside a flush.
+    execute = (connection or db.session).execute
+    table = TableVersion.__table__
+    names = [model.__tablename__ for model in models]
+    now = datetime.utcnow()
+    execute(_insert_ignore(table), [
+        {'TableName': name, 'Version': 0, 'ModifiedAt': now} for name in names
+    ])
+    execute(
+        update(table).where(table.c.TableName.in_(names)).values(Version=table.c.Version + 1, ModifiedAt=now)
+    )
+    db.session.info.setdefault('bumped_tables', set()).update(names)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_bumped_versions(session):
+    names = session.info.pop('bumped_tables', None)
+    if names:
+        with _version_lock:
+            _versions['checked_at'] = None
+            _versions['generation'] += 1
+        evict_cached_responses(names)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_bumped_versions(session):
+    session.info.pop('bumped_tables', None)
+
+##############################################################################
+# RESPONSE CACHE
+##############################################################################
+
+# Serialized response bodies kept per process, least recently used evicted
+# first. Bodies larger than a quarter of the budget are never kept.
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('KATILO_RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+_response_lock = threading.Lock()
+_responses = OrderedDict()
+_response_cache = {'bytes': 0}
+
+
+def _get_cached_body(key, etag):
+    with _response_lock:
+        entry = _responses.get(key)
+        if entry is None or entry[1] != etag:
+            return None
+        _responses.move_to_end(key)
+        return entry[2]
+
+
+def _store_cached_body(key, tables, etag, body):
+    if len(body) > RESPONSE_CACHE_MAX_BYTES // 4:
+        return
+    with _response_lock:
+        previous = _responses.pop(key, None)
+        if previous is not None:
+            _response_cache['bytes'] -= len(previous[2])
+        _responses[key] = (tables, etag, body)
+        _response_cache['bytes'] += len(body)
+        while _response_cache['bytes'] > RESPONSE_CACHE_MAX_BYTES:
+            _, (_, _, evicted) = _responses.popitem(last=False)
+            _response_cache['bytes'] -= len(evicted)
+
+
+def _cache_stream(chunks, key, tables, etag):
+    # Pass a streamed body through, keeping a copy if it completes within the
+    # size limit for one entry
+    kept, size = [], 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            if size <= RESPONSE_CACHE_MAX_BYTES // 4:
+                kept.append(chunk)
+            else:
+                kept = None
+        yield chunk
+    if kept is not None:
+        _store_cached_body(key, tables, etag, b''.join(kept))
+
+
+def evict_cached_responses(tables=None):
+    # Drop bodies built from any of `tables` (all of them when None)
+    with _response_lock:
+        for key, (entry_tables, _, body) in list(_responses.items()):
+            if tables is None or not tables.isdisjoint(entry_tables):
+                del _responses[key]
+                _response_cache['bytes'] -= len(body)
+
+
+def clear_response_cache():
+    # Forget every cached body and this process's copy of the table versions
+    with _version_lock:
+        _versions['checked_at'] = None
+        _versions['generation'] += 1
+    evict_cached_responses()
+
+
+def _http_datetime(value):
+    # Stored timestamps are naive UTC; HTTP dates have whole seconds
+    return value.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+def cached_response(*models):
+    # Conditional GET for a JSON view that reads only `models` and is the same
+    # for every user who may call it. The ETag is derived from the table
+    # versions and the query string, so a matching If-None-Match is answered
+    # with 304 before the view runs; a changed version serves the body from
+    # the LRU or rebuilds it.
+    tables = frozenset(model.__tablename__ for model in models)
+    names = sorted(tables)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = get_table_versions(names)
+            key = (request.endpoint, tuple(sorted(kwargs.items())), request.query_string)
+            etag = hashlib.blake2b(repr((key, names, versions)).encode(), digest_size=12).hexdigest()
+            modified = [modified_at for _, modified_at in versions if modified_at is not None]
+            last_modified = _http_datetime(max(modified)) if modified else None
+
+            # If-Modified-Since only counts when the client sent no ETag
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since)
+
+            body = None if not_modified else _get_cached_body(key, etag)
+            if not_modified:
+                response = current_app.response_class(status=304)
+            elif body is not None:
+                response = current_app.response_class(body, mimetype='application/json')
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if response.is_streamed:
+                    response.response = _cache_stream(response.response, key, tables, etag)
+                else:
+                    _store_cached_body(key, tables, etag, response.get_data())
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Private data: browsers may keep it but must revalidate every time
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
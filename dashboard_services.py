@@ -0,0 +1,224 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, case
+from models import (
+    db, Category, Item, Warehouse, WarehouseSection,
+    Inventory, InventoryTransaction, ItemStockSummary
+)
+from inventory_services import low_stock_query
+
+##############################################################################
+# DASHBOARD SNAPSHOT
+##############################################################################
+
+# Seconds a computed snapshot is served before it is rebuilt. Inventory writes in
+# this process drop it immediately; the TTL bounds staleness across workers.
+SNAPSHOT_TTL_SECONDS = 30
+SNAPSHOT_TOP_N = 10
+
+_snapshot_lock = threading.Lock()
+_snapshot_cache = {'value': None, 'expires_at': 0.0, 'generation': 0}
+
+
+def invalidate_dashboard_snapshot():
+    with _snapshot_lock:
+        _snapshot_cache['value'] = None
+        _snapshot_cache['generation'] += 1
+
+
+def get_dashboard_snapshot():
+    with _snapshot_lock:
+        if _snapshot_cache['value'] is not None and time.monotonic() < _snapshot_cache['expires_at']:
+            return _snapshot_cache['value']
+        generation = _snapshot_cache['generation']
+
+    snapshot = build_dashboard_snapshot()
+
+    with _snapshot_lock:
+        # An invalidation while we were building means the result may already be stale
+        if _snapshot_cache['generation'] == generation:
+            _snapshot_cache['value'] = snapshot
+            _snapshot_cache['expires_at'] = time.monotonic() + SNAPSHOT_TTL_SECONDS
+    return snapshot
+
+
+def _movement_sums():
+    # Quantity moved in and out, as two aggregate columns over a grouped query
+    return (
+        func.sum(case((InventoryTransaction.transaction_type == 'IN', InventoryTransaction.quantity), else_=0)),
+        func.sum(case((InventoryTransaction.transaction_type == 'OUT', InventoryTransaction.quantity), else_=0))
+    )
+
+
+def build_dashboard_snapshot():
+    now = datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    daily_start = today - timedelta(days=29)
+    # First day of the month eleven months back, so the monthly series has 12 points
+    month_index = today.year * 12 + today.month - 1 - 11
+    monthly_start = today.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+    # Headline counts in one round trip
+    counts = db.session.query(
+        db.session.query(func.count(Item.id)).scalar_subquery(),
+        db.session.query(func.count(Warehouse.id)).scalar_subquery(),
+        db.session.query(func.count(Category.id)).scalar_subquery(),
+        db.session.query(func.count(InventoryTransaction.id)).scalar_subquery(),
+        db.session.query(func.coalesce(func.sum(ItemStockSummary.total_quantity), 0)).scalar_subquery()
+    ).one()
+
+    # Stock units, value and layout per warehouse
+    stock_by_warehouse = dict(
+        (warehouse_id, (quantity, value)) for warehouse_id, quantity, value in
+        db.session.query(
+            Inventory.warehouse_id,
+            func.sum(Inventory.quantity),
+            func.sum(Inventory.quantity * Item.cost)
+        ).join(Item, Item.id == Inventory.item_id).group_by(Inventory.warehouse_id)
+    )
+    sections_by_warehouse = dict(
+        db.session.query(WarehouseSection.warehouse_id, func.count(WarehouseSection.id))
+        .group_by(WarehouseSection.warehouse_id)
+    )
+    warehouses = []
+    for w in db.session.query(Warehouse.id, Warehouse.name, Warehouse.capacity).order_by(Warehouse.id):
+        quantity, value = stock_by_warehouse.get(w.id, (0, 0))
+        warehouses.append({
+            'id': w.id,
+            'name': w.name,
+            'capacity': w.capacity or 0,
+            'quantity': quantity or 0,
+            'stock_value': round(value or 0, 2),
+            'sections': sections_by_warehouse.get(w.id, 0)
+        })
+
+    stock_by_category = [{
+        'id': category_id,
+        'name': name,
+        'quantity': quantity
+    } for category_id, name, quantity in db.session.query(
+        Category.id,
+        Category.name,
+        func.coalesce(func.sum(ItemStockSummary.total_quantity), 0)
+    ).join(Item, Item.category_id == Category.id)
+        .outerjoin(ItemStockSummary, ItemStockSummary.item_id == Item.id)
+        .group_by(Category.id, Category.name)
+        .order_by(Category.id)]
+
+    top_items = [{
+        'id': item_id,
+        'name': name,
+        'quantity': quantity
+    } for item_id, name, quantity in db.session.query(
+        Item.id, Item.name, ItemStockSummary.total_quantity
+    ).join(ItemStockSummary, ItemStockSummary.item_id == Item.id)
+        .filter(ItemStockSummary.total_quantity > 0)
+        .order_by(ItemStockSummary.total_quantity.desc())
+        .limit(SNAPSHOT_TOP_N)]
+
+    # Items with the most stock leaving in the last 30 days
+    moved_out = func.sum(InventoryTransaction.quantity)
+    top_movers = [{
+        'id': item_id,
+        'name': name,
+        'quantity_out': quantity
+    } for item_id, name, quantity in db.session.query(
+        Item.id, Item.name, moved_out
+    ).join(InventoryTransaction, InventoryTransaction.item_id == Item.id)
+        .filter(InventoryTransaction.transaction_type == 'OUT',
+                InventoryTransaction.transaction_date >= daily_start)
+        .group_by(Item.id, Item.name)
+        .order_by(moved_out.desc())
+        .limit(SNAPSHOT_TOP_N)]
+
+    in_sum, out_sum = _movement_sums()
+    day = func.date(InventoryTransaction.transaction_date)
+    daily = {d: (i or 0, o or 0) for d, i, o in db.session.query(day, in_sum, out_sum)
+             .filter(InventoryTransaction.transaction_date >= daily_start)
+             .group_by(day)}
+    daily_movements = []
+    for offset in range(30):
+        d = (daily_start + timedelta(days=offset)).strftime('%Y-%m-%d')
+        quantity_in, quantity_out = daily.get(d, (0, 0))
+        daily_movements.append({'date': d, 'in': quantity_in, 'out': quantity_out})
+
+    month = func.strftime('%Y-%m', InventoryTransaction.transaction_date)
+    monthly = {m: (i or 0, o or 0) for m, i, o in db.session.query(month, in_sum, out_sum)
+               .filter(InventoryTransaction.transaction_date >= monthly_start)
+               .group_by(month)}
+    monthly_movements = []
+    cursor = monthly_start
+    while cursor <= today:
+        m = cursor.strftime('%Y-%m')
+        quantity_in, quantity_out = monthly.get(m, (0, 0))
+        monthly_movements.append({'month': m, 'in': quantity_in, 'out': quantity_out})
+        cursor = (cursor + timedelta(days=32)).replace(day=1)
+
+    transaction_types = {'IN': 0, 'OUT': 0, 'TRANSFER': 0}
+    transaction_types.update(dict(
+        db.session.query(InventoryTransaction.transaction_type, func.count(InventoryTransaction.id))
+        .group_by(InventoryTransaction.transaction_type)
+    ))
+
+    low_stock = low_stock_query()
+    low_stock_items = [{
+        'id': r.id,
+        'name': r.name,
+        'quantity': r.quantity,
+        'reorder_level': r.reorder_level
+    } for r in low_stock.limit(SNAPSHOT_TOP_N)]
+
+    margin = Item.price - Item.cost
+    price_cost = [{
+        'id': item_id,
+        'name': name,
+        'cost': cost,
+        'price': price
+    } for item_id, name, cost, price in db.session.query(Item.id, Item.name, Item.cost, Item.price)
+        .order_by(margin.desc()).limit(SNAPSHOT_TOP_N)]
+
+    recent_transactions = [{
+        'id': t.id,
+        'item_id': t.item_id,
+        'item_name': t.item_name,
+        'warehouse_id': t.warehouse_id,
+        'transaction_type': t.transaction_type,
+        'quantity': t.quantity,
+        'transaction_date': t.transaction_date.isoformat(),
+        'reference': t.reference
+    } for t in db.session.query(
+        InventoryTransaction.id,
+        InventoryTransaction.item_id,
+        Item.name.label('item_name'),
+        InventoryTransaction.warehouse_id,
+        InventoryTransaction.transaction_type,
+        InventoryTransaction.quantity,
+        InventoryTransaction.transaction_date,
+        InventoryTransaction.reference
+    ).outerjoin(Item, Item.id == InventoryTransaction.item_id)
+        .order_by(InventoryTransaction.transaction_date.desc(), InventoryTransaction.id.desc())
+        .limit(5)]
+
+    return {
+        'generated_at': now.isoformat(),
+        'kpis': {
+            'total_items': counts[0],
+            'total_warehouses': counts[1],
+            'total_categories': counts[2],
+            'total_transactions': counts[3],
+            'total_stock_units': counts[4],
+            'stock_value': round(sum(w['stock_value'] for w in warehouses), 2),
+            'low_stock_count': low_stock.order_by(None).count()
+        },
+        'warehouses': warehouses,
+        'stock_by_category': stock_by_category,
+        'top_items': top_items,
+        'top_movers': top_movers,
+        'daily_movements': daily_movements,
+        'monthly_movements': monthly_movements,
+        'transaction_types': transaction_types,
+        'low_stock': low_stock_items,
+        'price_cost': price_cost,
+        'recent_transactions': recent_transactions
+    }
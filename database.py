@@ -0,0 +1,297 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from flask import current_app
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import object_session
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from models import db, ReportingHeartbeat
+
+##############################################################################
+# DATABASE PROFILE
+##############################################################################
+
+# Every setting can be overridden from the environment; the defaults suit a
+# single SQLite file shared by the web workers, the job runner and the CLI.
+DATABASE_URL = os.environ.get('KATILO_DATABASE_URL', 'sqlite:///katilo.db')
+# Reporting reads go to this URL; by default a read-only connection to the
+# primary SQLite file (in WAL mode readers never block the writer)
+REPORTING_DATABASE_URL = os.environ.get('KATILO_REPORTING_DATABASE_URL')
+
+DB_POOL_SIZE = int(os.environ.get('KATILO_DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('KATILO_DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = int(os.environ.get('KATILO_DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.environ.get('KATILO_DB_POOL_RECYCLE', '3600'))
+
+# How long a connection waits on a locked database before raising
+# "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('KATILO_SQLITE_BUSY_TIMEOUT_MS', '5000'))
+# NORMAL is durable across application crashes in WAL mode; only a power loss
+# can roll back the last commits. Use FULL to fsync on every commit.
+SQLITE_SYNCHRONOUS = os.environ.get('KATILO_SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('KATILO_SQLITE_CACHE_SIZE_KB', '65536'))
+SQLITE_MMAP_SIZE = int(os.environ.get('KATILO_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+SQLITE_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+REPORTING_BIND = 'reporting'
+
+
+def is_sqlite_file(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def readonly_sqlite_url(url):
+    # Same file opened through SQLite's URI syntax with mode=ro
+    url = make_url(url)
+    database = url.database
+    if url.query.get('uri'):
+        database = database[len('file:'):] if database.startswith('file:') else database
+    return url.set(database=f'file:{database}', query={'mode': 'ro', 'uri': 'true'})
+
+
+def pool_options(url):
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT
+    }
+    if make_url(url).get_backend_name() != 'sqlite':
+        options.update(pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+    return options
+
+
+def configure_database(app):
+    # Fill in the SQLAlchemy config for `app`; values already set on
+    # app.config (tests, scripts) take precedence
+    if SQLITE_SYNCHRONOUS not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f'KATILO_SQLITE_SYNCHRONOUS must be one of {", ".join(SQLITE_SYNCHRONOUS_MODES)}')
+
+    url = app.config.setdefault('SQLALCHEMY_DATABASE_URI', DATABASE_URL)
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    if make_url(url).database not in (None, '', ':memory:'):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', pool_options(url))
+
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    reporting_url = REPORTING_DATABASE_URL or (readonly_sqlite_url(url) if is_sqlite_file(url) else None)
+    if reporting_url is not None and REPORTING_BIND not in binds:
+        binds[REPORTING_BIND] = dict(url=str(reporting_url), **pool_options(reporting_url))
+        # A read-only view of the primary file is never behind it
+        app.config.setdefault('REPORTING_LIVE', REPORTING_DATABASE_URL is None)
+
+
+def apply_sqlite_pragmas(engine, read_only=False):
+    # Per-connection settings; journal_mode is stored in the file, the rest
+    # must be set on every new connection
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        else:
+            cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+        cursor.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.close()
+
+
+def init_database(app):
+    configure_database(app)
+    db.init_app(app)
+    with app.app_context():
+        for key, engine in db.engines.items():
+            if is_sqlite_file(engine.url):
+                apply_sqlite_pragmas(engine, read_only=key == REPORTING_BIND)
+
+
+def get_reporting_engine():
+    # Engine for read-only reporting queries; the primary when no reporting
+    # database is configured (e.g. in-memory SQLite)
+    return db.engines.get(REPORTING_BIND, db.engine)
+
+
+##############################################################################
+# DERIVED TABLES
+##############################################################################
+
+# Ids per IN list when a derived table re-reads its source rows, well under
+# SQLite's bound-parameter limit
+REFRESH_CHUNK = 500
+ROW_EVENTS = ('after_insert', 'after_update', 'after_delete')
+
+
+def chunked(ids, size=REFRESH_CHUNK):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def refresh_on_flush(refresh, **sources):
+    # Keep a derived table in step with ORM writes to its source rows. sources
+    # maps a keyword to (model, mapper events); the ids of the rows those
+    # events fire for are collected per session and handed over as
+    # refresh(keyword=ids, ..., connection=...) at the end of the same flush,
+    # so the derived rows commit or roll back with the change.
+    info_key = ('refresh_on_flush', refresh)
+
+    def mark(keyword):
+        def listener(mapper, connection, target):
+            session = object_session(target)
+            if session is not None:
+                dirty = session.info.setdefault(info_key, {name: set() for name in sources})
+                dirty[keyword].add(target.id)
+        return listener
+
+    for keyword, (model, events) in sources.items():
+        for name in events:
+            event.listen(model, name, mark(keyword))
+
+    @event.listens_for(db.session, 'after_flush')
+    def refresh_dirty(session, flush_context):
+        dirty = session.info.pop(info_key, None)
+        if dirty:
+            refresh(connection=session.connection(), **dirty)
+
+
+##############################################################################
+# REPORTING ROUTING
+##############################################################################
+
+# Reporting reads are served from a copy at most this many seconds behind the
+# primary; a staler or unreachable copy sends them to the primary instead
+REPORTING_MAX_STALENESS_SECONDS = int(os.environ.get('KATILO_REPORTING_MAX_STALENESS_SECONDS', '300'))
+# How often each process re-checks the reporting copy's lag
+REPORTING_CHECK_SECONDS = 5
+
+_reporting_lock = threading.Lock()
+_reporting_state = {'available': False, 'checked_at': None}
+
+
+def sqlite_file_path(url):
+    database = make_url(url).database
+    return database[len('file:'):] if database.startswith('file:') else database
+
+
+def reporting_lag():
+    # Seconds the reporting database is behind the primary, or None when it is
+    # not configured, unreachable or has never received a heartbeat
+    engine = db.engines.get(REPORTING_BIND)
+    if engine is None:
+        return None
+    if current_app.config.get('REPORTING_LIVE'):
+        return 0.0
+    try:
+        with engine.connect() as connection:
+            beat_at = connection.execute(
+                select(ReportingHeartbeat.beat_at).where(ReportingHeartbeat.id == 1)
+            ).scalar()
+    except SQLAlchemyError:
+        return None
+    if beat_at is None:
+        return None
+    return max(0.0, (datetime.utcnow() - beat_at).total_seconds())
+
+
+def reporting_available():
+    with _reporting_lock:
+        checked_at = _reporting_state['checked_at']
+        if checked_at is not None and time.monotonic() - checked_at < REPORTING_CHECK_SECONDS:
+            return _reporting_state['available']
+
+    lag = reporting_lag()
+    available = lag is not None and lag <= REPORTING_MAX_STALENESS_SECONDS
+    with _reporting_lock:
+        _reporting_state['available'] = available
+        _reporting_state['checked_at'] = time.monotonic()
+    return available
+
+
+def mark_reporting_unavailable():
+    # Use the primary until the next freshness check
+    with _reporting_lock:
+        _reporting_state['available'] = False
+        _reporting_state['checked_at'] = time.monotonic()
+
+
+@contextmanager
+def reporting_reads():
+    # SELECTs issued through db.session inside the block go to the reporting
+    # database when it is fresh enough; writes always stay on the primary
+    routed = reporting_available()
+    if routed:
+        db.session.info['read_bind'] = REPORTING_BIND
+    try:
+        yield routed
+    finally:
+        if routed:
+            db.session.info.pop('read_bind', None)
+
+
+def reporting_route(view):
+    # Serve a read-only view from the reporting database. If that database fails
+    # mid-request the view is run again on the primary; it only reads, so
+    # repeating it is safe.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with reporting_reads() as routed:
+            if not routed:
+                return view(*args, **kwargs)
+            try:
+                return view(*args, **kwargs)
+            except OperationalError:
+                mark_reporting_unavailable()
+                db.session.rollback()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def execute_reporting(statement):
+    # db.session.execute() routed like reporting_route, for results consumed
+    # after the view returns (streamed exports)
+    with reporting_reads() as routed:
+        if routed:
+            try:
+                return db.session.execute(statement)
+            except OperationalError:
+                mark_reporting_unavailable()
+                db.session.rollback()
+    return db.session.execute(statement)
+
+
+def beat_reporting_heartbeat():
+    now = datetime.utcnow()
+    table = ReportingHeartbeat.__table__
+    with db.engine.begin() as connection:
+        if not connection.execute(update(table).where(table.c.HeartbeatID == 1).values(BeatAt=now)).rowcount:
+            connection.execute(insert(table).values(HeartbeatID=1, BeatAt=now))
+    return now
+
+
+def snapshot_reporting_database():
+    # Stamp the heartbeat, then refresh a SQLite reporting copy from the primary
+    # with SQLite's online backup. A replica kept up to date by other means only
+    # needs the heartbeat; run this periodically (cron or the job runner).
+    beat_at = beat_reporting_heartbeat()
+    engine = db.engines.get(REPORTING_BIND)
+    copied = (engine is not None and not current_app.config.get('REPORTING_LIVE')
+              and is_sqlite_file(db.engine.url) and is_sqlite_file(engine.url))
+    if copied:
+        source = db.engine.raw_connection()
+        target = sqlite3.connect(sqlite_file_path(engine.url))
+        try:
+            source.driver_connection.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    with _reporting_lock:
+        _reporting_state['checked_at'] = None
+    return {'copied': copied, 'heartbeat': beat_at.isoformat()}
@@ -0,0 +1,155 @@
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask_login import login_required
+from sqlalchemy import select
+from models import Item, Inventory, InventoryTransaction
+from inventory_services import parse_datetime_param
+from database import execute_reporting
+from datetime import datetime
+import csv
+import io
+import json
+import zlib
+
+# Create a Blueprint for export routes
+export_bp = Blueprint('export', __name__)
+
+# Rows fetched per round trip; memory stays bounded by this, not by table size
+EXPORT_CHUNK_SIZE = 1000
+
+# Exportable datasets: output column name -> mapped column
+EXPORT_DATASETS = {
+    'transactions': (InventoryTransaction, [
+        ('id', InventoryTransaction.id),
+        ('item_id', InventoryTransaction.item_id),
+        ('warehouse_id', InventoryTransaction.warehouse_id),
+        ('transaction_type', InventoryTransaction.transaction_type),
+        ('quantity', InventoryTransaction.quantity),
+        ('transaction_date', InventoryTransaction.transaction_date),
+        ('reference', InventoryTransaction.reference)
+    ]),
+    'inventory': (Inventory, [
+        ('id', Inventory.id),
+        ('item_id', Inventory.item_id),
+        ('warehouse_id', Inventory.warehouse_id),
+        ('quantity', Inventory.quantity),
+        ('last_updated', Inventory.last_updated)
+    ]),
+    'items': (Item, [
+        ('id', Item.id),
+        ('name', Item.name),
+        ('category_id', Item.category_id),
+        ('sku', Item.sku),
+        ('description', Item.description),
+        ('unit_of_measure', Item.unit_of_measure),
+        ('cost', Item.cost),
+        ('price', Item.price),
+        ('reorder_level', Item.reorder_level)
+    ])
+}
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def build_export_query(dataset, args):
+    model, columns = EXPORT_DATASETS[dataset]
+    query = select(*[column for _, column in columns])
+
+    # Optional filters shared by every dataset that has the column
+    for param in ('item_id', 'warehouse_id', 'category_id'):
+        value = args.get(param, type=int)
+        if value is not None and hasattr(model, param):
+            query = query.where(getattr(model, param) == value)
+
+    if dataset == 'transactions':
+        if args.get('date_from'):
+            query = query.where(InventoryTransaction.transaction_date >= parse_datetime_param(args['date_from']))
+        if args.get('date_to'):
+            query = query.where(InventoryTransaction.transaction_date < parse_datetime_param(args['date_to']))
+
+    # Primary key order lets the database walk the table without sorting it
+    return query.order_by(columns[0][1]).execution_options(yield_per=EXPORT_CHUNK_SIZE)
+
+
+def iter_export_rows(query):
+    # Server-side cursor on the reporting database, consumed one partition at a time
+    result = execute_reporting(query)
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def iter_ndjson(partitions, names):
+    for partition in partitions:
+        yield ''.join(
+            json.dumps(dict(zip(names, map(_export_value, row))), ensure_ascii=False) + '\n'
+            for row in partition
+        ).encode('utf-8')
+
+
+def iter_csv(partitions, names):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the Arabic text as UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(names)
+    for partition in partitions:
+        writer.writerows([_export_value(v) for v in row] for row in partition)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_stream(chunks):
+    # wbits=31 writes a gzip header/trailer so the output is a valid .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+@export_bp.route('/api/export/<dataset>', methods=['GET'])
+@login_required
+def export_dataset(dataset):
+    if dataset not in EXPORT_DATASETS:
+        return jsonify({'message': f'Unknown dataset: {dataset}'}), 404
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'message': f'Unsupported format: {export_format}'}), 400
+
+    try:
+        query = build_export_query(dataset, request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    names = [name for name, _ in EXPORT_DATASETS[dataset][1]]
+    rows = iter_export_rows(query)
+    chunks = iter_csv(rows, names) if export_format == 'csv' else iter_ndjson(rows, names)
+
+    filename = f"{dataset}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    mimetype = EXPORT_FORMATS[export_format]
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = gzip_stream(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
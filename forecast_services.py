@@ -0,0 +1,314 @@
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, delete, or_
+from models import db, InventoryTransaction, DemandForecast
+
+try:
+    # Optional: fits a whole chunk of items at once with array operations
+    import numpy as np
+except ImportError:
+    np = None
+
+##############################################################################
+# DEMAND FORECASTING
+##############################################################################
+
+FORECAST_FREQUENCIES = ('daily', 'weekly')
+# Periods of history read per frequency, and periods forecast ahead
+FORECAST_HISTORY = {'daily': 90, 'weekly': 52}
+FORECAST_DEFAULT_HORIZON = 4
+MOVING_AVERAGE_WINDOW = 4
+SMOOTHING_ALPHA = 0.3
+CROSTON_ALPHA = 0.1
+# Items per worker task; small enough to spread over the pool, large enough to
+# keep pickling overhead well below the fitting work
+FORECAST_CHUNK_SIZE = 2000
+# OUT transactions fetched per round trip while building the series
+FORECAST_READ_CHUNK = 10000
+
+
+def period_start(moment, frequency):
+    day = datetime(moment.year, moment.month, moment.day)
+    if frequency == 'weekly':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def period_length(frequency):
+    return timedelta(weeks=1) if frequency == 'weekly' else timedelta(days=1)
+
+
+def load_demand_series(frequency, history, now=None):
+    # item_id -> list of OUT quantities per period, oldest first, with the current
+    # (incomplete) period left out. Transactions are streamed in chunks and
+    # bucketed in Python by their offset from the first period, so the query
+    # needs no backend-specific date function.
+    step = period_length(frequency)
+    end = period_start(now or datetime.utcnow(), frequency)
+    start = end - step * history
+
+    rows = db.session.execute(
+        select(InventoryTransaction.item_id, InventoryTransaction.transaction_date, InventoryTransaction.quantity)
+        .where(InventoryTransaction.transaction_type == 'OUT',
+               InventoryTransaction.transaction_date >= start,
+               InventoryTransaction.transaction_date < end)
+        .execution_options(yield_per=FORECAST_READ_CHUNK)
+    )
+
+    series = {}
+    for item_id, moment, quantity in rows:
+        values = series.get(item_id)
+        if values is None:
+            values = series[item_id] = [0.0] * history
+        values[(moment - start) // step] += quantity or 0
+    return series, end
+
+
+def moving_average_forecasts(series, window=MOVING_AVERAGE_WINDOW):
+    # One-step-ahead forecasts: forecasts[t] predicts series[t] from what came before it
+    forecasts = [None] * len(series)
+    running = 0.0
+    for t in range(1, len(series) + 1):
+        running += series[t - 1]
+        if t > window:
+            running -= series[t - 1 - window]
+        value = running / min(t, window)
+        if t < len(series):
+            forecasts[t] = value
+    return forecasts, value
+
+
+def exponential_smoothing_forecasts(series, alpha=SMOOTHING_ALPHA):
+    forecasts = [None] * len(series)
+    level = series[0]
+    for t in range(1, len(series)):
+        forecasts[t] = level
+        level += alpha * (series[t] - level)
+    return forecasts, level
+
+
+def croston_forecasts(series, alpha=CROSTON_ALPHA):
+    # Croston: smooth non-zero demand sizes and the intervals between them separately
+    forecasts = [None] * len(series)
+    size = interval = None
+    since_last = 1
+    for t, value in enumerate(series):
+        if t and size is not None:
+            forecasts[t] = size / interval
+        if value:
+            if size is None:
+                size, interval = value, since_last
+            else:
+                size += alpha * (value - size)
+                interval += alpha * (since_last - interval)
+            since_last = 1
+        else:
+            since_last += 1
+    return forecasts, (size / interval if size is not None else 0.0)
+
+
+FORECAST_METHODS = {
+    'moving_average': moving_average_forecasts,
+    'exponential_smoothing': exponential_smoothing_forecasts,
+    'croston': croston_forecasts
+}
+
+
+def fit_item(series, holdout):
+    # Backtest every method on the last `holdout` periods with one-step-ahead
+    # forecasts and keep the one with the lowest absolute error. Accuracy is
+    # 100 * (1 - WAPE) over the holdout, floored at 0.
+    best = None
+    holdout_actual = sum(series[-holdout:])
+    for method, fit in FORECAST_METHODS.items():
+        forecasts, next_value = fit(series)
+        error = sum(abs(series[t] - (forecasts[t] or 0.0)) for t in range(len(series) - holdout, len(series)))
+        if best is None or error < best[1]:
+            best = (method, error, next_value)
+
+    method, error, next_value = best
+    if holdout_actual:
+        accuracy = max(0.0, 100.0 * (1 - error / holdout_actual))
+    else:
+        accuracy = 100.0 if not error else 0.0
+    return method, max(0.0, next_value), round(accuracy, 2)
+
+
+##############################################################################
+# VECTORISED FITTING (NUMPY)
+##############################################################################
+
+# The same recursions as above, stepped through time once for all items of a
+# chunk: values is an items x periods array, and each function returns the
+# one-step-ahead forecasts (0 where a method has none yet) and the next value.
+
+def moving_average_forecasts_array(values, window=MOVING_AVERAGE_WINDOW):
+    periods = values.shape[1]
+    sums = np.zeros((values.shape[0], periods + 1))
+    np.cumsum(values, axis=1, out=sums[:, 1:])
+    ends = np.arange(1, periods + 1)
+    counts = np.minimum(ends, window)
+    means = (sums[:, ends] - sums[:, ends - counts]) / counts
+    forecasts = np.zeros_like(values)
+    forecasts[:, 1:] = means[:, :-1]
+    return forecasts, means[:, -1]
+
+
+def exponential_smoothing_forecasts_array(values, alpha=SMOOTHING_ALPHA):
+    forecasts = np.zeros_like(values)
+    level = values[:, 0].copy()
+    for t in range(1, values.shape[1]):
+        forecasts[:, t] = level
+        level += alpha * (values[:, t] - level)
+    return forecasts, level
+
+
+def croston_forecasts_array(values, alpha=CROSTON_ALPHA):
+    forecasts = np.zeros_like(values)
+    size = np.zeros(values.shape[0])
+    interval = np.ones(values.shape[0])
+    seen = np.zeros(values.shape[0], dtype=bool)
+    since_last = np.ones(values.shape[0])
+    for t in range(values.shape[1]):
+        if t:
+            forecasts[:, t] = np.where(seen, size / interval, 0.0)
+        demand = values[:, t]
+        nonzero = demand != 0
+        first = nonzero & ~seen
+        later = nonzero & seen
+        size = np.where(first, demand, np.where(later, size + alpha * (demand - size), size))
+        interval = np.where(first, since_last, np.where(later, interval + alpha * (since_last - interval), interval))
+        seen |= nonzero
+        since_last = np.where(nonzero, 1.0, since_last + 1.0)
+    return forecasts, np.where(seen, size / interval, 0.0)
+
+
+FORECAST_ARRAY_METHODS = {
+    'moving_average': moving_average_forecasts_array,
+    'exponential_smoothing': exponential_smoothing_forecasts_array,
+    'croston': croston_forecasts_array
+}
+
+
+def fit_items_array(chunk, holdout):
+    # fit_item for every (item_id, series) of the chunk at once; ties go to the
+    # earlier method, as in fit_item
+    values = np.array([series for _, series in chunk], dtype=float)
+    actual = values[:, -holdout:]
+    errors, next_values = [], []
+    for method in FORECAST_METHODS:
+        forecasts, next_value = FORECAST_ARRAY_METHODS[method](values)
+        errors.append(np.abs(actual - forecasts[:, -holdout:]).sum(axis=1))
+        next_values.append(next_value)
+    errors = np.array(errors)
+    best = errors.argmin(axis=0)
+    items = np.arange(len(chunk))
+    error = errors[best, items]
+    next_value = np.maximum(0.0, np.array(next_values)[best, items])
+
+    holdout_actual = actual.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accuracy = np.where(holdout_actual > 0,
+                            np.maximum(0.0, 100.0 * (1 - error / holdout_actual)),
+                            np.where(error == 0, 100.0, 0.0))
+    methods = list(FORECAST_METHODS)
+    return [(item_id, methods[best[index]], float(next_value[index]), round(float(accuracy[index]), 2))
+            for index, (item_id, _) in enumerate(chunk)]
+
+
+##############################################################################
+# FORECAST RUN
+##############################################################################
+
+def forecast_chunk(chunk, holdout):
+    # Runs in a worker process; takes and returns plain tuples only
+    if np is not None:
+        return fit_items_array(chunk, holdout)
+    return [(item_id,) + fit_item(series, holdout) for item_id, series in chunk]
+
+
+def check_forecast_parameters(frequency, horizon, history=None):
+    # Returns the history to use; raises ValueError for parameters a run would reject
+    if frequency not in FORECAST_FREQUENCIES:
+        raise ValueError(f'Invalid frequency: {frequency}')
+    if horizon < 1:
+        raise ValueError('Horizon must be at least 1')
+    history = history or FORECAST_HISTORY[frequency]
+    if history < 4:
+        raise ValueError('History must cover at least 4 periods')
+    return history
+
+
+def run_demand_forecast(frequency='weekly', horizon=FORECAST_DEFAULT_HORIZON, history=None, workers=None,
+                        progress=None):
+    # progress(percent, message) is called as item chunks are fitted, before
+    # anything is written; an exception it raises aborts the run
+    progress = progress or (lambda percent, message=None: None)
+    history = check_forecast_parameters(frequency, horizon, history)
+
+    started = datetime.utcnow()
+    progress(0, 'Loading demand history')
+    series, first_period = load_demand_series(frequency, history, started)
+    holdout = max(1, min(8, history // 4))
+
+    items = list(series.items())
+    chunks = [items[i:i + FORECAST_CHUNK_SIZE] for i in range(0, len(items), FORECAST_CHUNK_SIZE)]
+    fitted = {}
+
+    def fitted_chunk(index, rows):
+        fitted[index] = rows
+        progress(90 * len(fitted) / len(chunks), f'Fitted {len(fitted)} of {len(chunks)} item chunks')
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(chunks) > 1:
+        # Spawned rather than forked: the job worker running this has other
+        # threads, whose locks a fork would copy in whatever state they were in
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(forecast_chunk, chunk, holdout): index for index, chunk in enumerate(chunks)}
+            try:
+                for future in as_completed(futures):
+                    fitted_chunk(futures[future], future.result())
+            except BaseException:
+                # Leave the queued chunks unstarted; the running ones finish
+                pool.shutdown(cancel_futures=True)
+                raise
+    else:
+        for index, chunk in enumerate(chunks):
+            fitted_chunk(index, forecast_chunk(chunk, holdout))
+    results = [row for index in range(len(chunks)) for row in fitted[index]]
+
+    # A run replaces its frequency's earlier forecasts for the periods it covers
+    # (and unlabeled ones from before runs recorded a frequency); a Monday's
+    # daily forecast is not a week's
+    progress(90, 'Writing forecasts')
+    step = period_length(frequency)
+    periods = [first_period + step * offset for offset in range(horizon)]
+    db.session.execute(delete(DemandForecast).where(
+        DemandForecast.forecast_date.in_(periods),
+        or_(DemandForecast.frequency == frequency, DemandForecast.frequency.is_(None))
+    ))
+    if results:
+        db.session.execute(insert(DemandForecast), [{
+            'item_id': item_id,
+            'frequency': frequency,
+            'method': method,
+            'forecasted_quantity': round(quantity),
+            'forecast_date': period,
+            'accuracy_rate': accuracy
+        } for item_id, method, quantity, accuracy in results for period in periods])
+    db.session.commit()
+
+    return {
+        'frequency': frequency,
+        'history_periods': history,
+        'horizon': horizon,
+        'items_forecast': len(results),
+        'forecasts_written': len(results) * horizon,
+        'methods': dict(Counter(method for _, method, _, _ in results)),
+        'first_period': first_period.isoformat(),
+        'duration_seconds': round((datetime.utcnow() - started).total_seconds(), 3)
+    }
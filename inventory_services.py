@@ -0,0 +1,944 @@
+import base64
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func, case, insert, select, update, delete, bindparam, and_, or_, exists
+from sqlalchemy.orm import joinedload
+from models import (
+    db, Item, Warehouse, WarehouseSection, WarehouseSlot, Inventory, InventoryTransaction,
+    ItemStockSummary, Batch, BatchSlot, NearExpiryEntry, SalesOrder, SalesOrderDetail,
+    transaction_type_enum
+)
+from serialization import rows_to_dicts, project, page_bounds, paginate
+from database import ROW_EVENTS, chunked, refresh_on_flush
+
+##############################################################################
+# ITEM STOCK SUMMARY
+##############################################################################
+
+def apply_stock_summary_delta(item_id, quantity_before, quantity_after, moved_at=None):
+    # Fold one inventory row change into the item's summary row
+    adjust_stock_summary(
+        item_id,
+        quantity_after - quantity_before,
+        int(quantity_after > 0) - int(quantity_before > 0),
+        moved_at
+    )
+
+
+def adjust_stock_summary(item_id, quantity_delta, stocked_delta, moved_at=None):
+    adjust_stock_summaries({item_id: (quantity_delta, stocked_delta)}, moved_at)
+
+
+def adjust_stock_summaries(deltas, moved_at=None):
+    # deltas: {item_id: (quantity_delta, stocked_delta)}
+    # Runs inside the caller's transaction, so the summaries commit (or roll back)
+    # with the movement. Updates are relative (col = col + delta) so concurrent
+    # writers never lose counts, and are sent as a single executemany.
+    if not deltas:
+        return
+    moved_at = moved_at or datetime.utcnow()
+    db.session.flush()
+
+    existing = {item_id for (item_id,) in db.session.query(ItemStockSummary.item_id)
+                .filter(ItemStockSummary.item_id.in_(deltas.keys()))}
+
+    if existing:
+        table = ItemStockSummary.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.ItemID == bindparam('b_item_id'))
+            .values(
+                TotalQuantity=table.c.TotalQuantity + bindparam('b_quantity_delta'),
+                WarehousesWithStock=table.c.WarehousesWithStock + bindparam('b_stocked_delta'),
+                LastMovementAt=moved_at
+            ),
+            [{
+                'b_item_id': item_id,
+                'b_quantity_delta': deltas[item_id][0],
+                'b_stocked_delta': deltas[item_id][1]
+            } for item_id in existing]
+        )
+
+    missing = set(deltas) - existing
+    if missing:
+        # First movement for these items (or the summary was never built): start
+        # from the inventory rows already flushed in this transaction
+        totals = db.session.query(
+            Inventory.item_id,
+            func.sum(Inventory.quantity),
+            func.sum(case((Inventory.quantity > 0, 1), else_=0))
+        ).filter(Inventory.item_id.in_(missing)).group_by(Inventory.item_id).all()
+        db.session.execute(insert(ItemStockSummary), [{
+            'item_id': item_id,
+            'total_quantity': total or 0,
+            'warehouses_with_stock': stocked or 0,
+            'last_movement_at': moved_at
+        } for item_id, total, stocked in totals])
+
+
+def rebuild_stock_summaries():
+    # Recompute every summary row from the inventory and transaction tables
+    totals = db.session.query(
+        Inventory.item_id.label('item_id'),
+        func.sum(Inventory.quantity).label('total_quantity'),
+        func.sum(case((Inventory.quantity > 0, 1), else_=0)).label('warehouses_with_stock')
+    ).group_by(Inventory.item_id).subquery()
+    movements = db.session.query(
+        InventoryTransaction.item_id.label('item_id'),
+        func.max(InventoryTransaction.transaction_date).label('last_movement_at')
+    ).group_by(InventoryTransaction.item_id).subquery()
+
+    rows = select(
+        Item.id,
+        func.coalesce(totals.c.total_quantity, 0),
+        func.coalesce(totals.c.warehouses_with_stock, 0),
+        movements.c.last_movement_at
+    ).outerjoin(totals, totals.c.item_id == Item.id)\
+        .outerjoin(movements, movements.c.item_id == Item.id)
+
+    try:
+        ItemStockSummary.query.delete(synchronize_session=False)
+        db.session.execute(insert(ItemStockSummary).from_select([
+            ItemStockSummary.item_id,
+            ItemStockSummary.total_quantity,
+            ItemStockSummary.warehouses_with_stock,
+            ItemStockSummary.last_movement_at
+        ], rows))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return ItemStockSummary.query.count()
+
+
+def ensure_stock_summaries():
+    # Rebuild the summaries when a stocked item has no summary row, as on a
+    # database that had inventory before item_stock_summaries existed; the
+    # low-stock list and dashboard totals would show it with no stock.
+    # Returns the rebuilt row count, or None when nothing was missing.
+    unsummarized = db.session.query(Inventory.item_id)\
+        .outerjoin(ItemStockSummary, ItemStockSummary.item_id == Inventory.item_id)\
+        .filter(ItemStockSummary.item_id.is_(None)).first()
+    if unsummarized is None:
+        return None
+    return rebuild_stock_summaries()
+
+
+##############################################################################
+# BULK INVENTORY MOVEMENTS
+##############################################################################
+
+BULK_MAX_MOVEMENTS = 5000
+
+
+class MovementError(Exception):
+    # A single movement line that cannot be applied; index points into the request
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+    def to_dict(self):
+        return {'index': self.index, 'message': self.message}
+
+
+def _parse_movement(index, data):
+    if not isinstance(data, dict):
+        raise MovementError(index, 'Movement must be an object')
+    if not data.get('item_id') or not data.get('warehouse_id') or 'quantity' not in data:
+        raise MovementError(index, 'Missing required fields')
+    try:
+        item_id = int(data['item_id'])
+        warehouse_id = int(data['warehouse_id'])
+        quantity = int(data['quantity'])
+    except (TypeError, ValueError):
+        raise MovementError(index, 'item_id, warehouse_id and quantity must be integers')
+    if quantity == 0:
+        raise MovementError(index, 'Quantity must not be zero')
+
+    transaction_type = data.get('transaction_type', 'IN')
+    if transaction_type not in transaction_type_enum.enums:
+        raise MovementError(index, f'Invalid transaction type: {transaction_type}')
+
+    return {
+        'item_id': item_id,
+        'warehouse_id': warehouse_id,
+        'quantity': quantity,
+        'transaction_type': transaction_type,
+        'reference': data.get('reference', '')
+    }
+
+
+def load_inventory_rows(pairs, lock=True):
+    # Fetch every (item_id, warehouse_id) row in one statement, keyed by the pair.
+    # FOR UPDATE takes row locks where the backend supports them; SQLite holds the
+    # database write lock from the first write until commit instead.
+    if not pairs:
+        return {}
+    item_ids = {item_id for item_id, _ in pairs}
+    warehouse_ids = {warehouse_id for _, warehouse_id in pairs}
+    query = Inventory.query.filter(
+        Inventory.item_id.in_(item_ids),
+        Inventory.warehouse_id.in_(warehouse_ids)
+    )
+    if lock:
+        query = query.with_for_update()
+    return {
+        (inv.item_id, inv.warehouse_id): inv
+        for inv in query.all()
+        if (inv.item_id, inv.warehouse_id) in pairs
+    }
+
+
+def existing_ids(column, ids):
+    # Which of ids exist in column, in one IN query
+    if not ids:
+        return set()
+    return {value for (value,) in db.session.query(column).filter(column.in_(ids))}
+
+
+class StockBatch:
+    # Working set for one batch of stock changes: the affected inventory rows are
+    # loaded once, changed in memory line by line, and written back together with
+    # their ledger rows and stock summary deltas in a single commit.
+    def __init__(self, pairs):
+        self.rows = load_inventory_rows(pairs)
+        self.quantities_before = {pair: inv.quantity for pair, inv in self.rows.items()}
+        self.touched = set()
+        self.transactions = []
+        self.moved_at = datetime.utcnow()
+
+    def available(self, pair):
+        inventory = self.rows.get(pair)
+        return inventory.quantity if inventory else 0
+
+    def change(self, pair, quantity, transaction_type, reference):
+        # Raises ValueError (with the user-facing message) if stock would go negative
+        inventory = self.rows.get(pair)
+        if inventory is None:
+            if quantity < 0:
+                raise ValueError('لا يوجد مخزون كافٍ لهذا العنصر في المستودع المحدد')
+            inventory = Inventory(item_id=pair[0], warehouse_id=pair[1], quantity=quantity)
+            db.session.add(inventory)
+            self.rows[pair] = inventory
+            self.quantities_before[pair] = 0
+        else:
+            if inventory.quantity + quantity < 0:
+                raise ValueError(f'لا يوجد مخزون كافٍ. الكمية المتاحة: {inventory.quantity}')
+            inventory.quantity += quantity
+
+        self.touched.add(pair)
+        self.transactions.append({
+            'item_id': pair[0],
+            'warehouse_id': pair[1],
+            'transaction_type': transaction_type,
+            'quantity': abs(quantity),
+            'transaction_date': self.moved_at,
+            'reference': reference
+        })
+
+    def commit(self):
+        # Returns the resulting stock rows; rolls back and re-raises on failure
+        try:
+            db.session.flush()
+            # One multi-row INSERT for the whole ledger batch
+            db.session.execute(insert(InventoryTransaction), self.transactions)
+
+            # One summary update per item, however many lines and warehouses it had
+            summary_deltas = {}
+            stock_rows = []
+            for pair in sorted(self.touched):
+                inv = self.rows[pair]
+                before = self.quantities_before[pair]
+                quantity_delta, stocked_delta = summary_deltas.get(pair[0], (0, 0))
+                summary_deltas[pair[0]] = (
+                    quantity_delta + inv.quantity - before,
+                    stocked_delta + int(inv.quantity > 0) - int(before > 0)
+                )
+                stock_rows.append({
+                    'inventory_id': inv.id,
+                    'item_id': inv.item_id,
+                    'warehouse_id': inv.warehouse_id,
+                    'quantity': inv.quantity
+                })
+            adjust_stock_summaries(summary_deltas, self.moved_at)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return stock_rows
+
+
+def apply_inventory_movements(movements, atomic=False):
+    # Validate and apply a batch of movements in a single DB transaction.
+    # Lines are applied in order, so several lines may touch the same stock row.
+    # With atomic=True any invalid line rejects the whole batch; otherwise invalid
+    # lines are reported and the rest are committed.
+    # Returns (applied line count, list of MovementError, resulting stock rows).
+    errors = []
+    parsed = []
+    for index, data in enumerate(movements):
+        try:
+            parsed.append((index, _parse_movement(index, data)))
+        except MovementError as e:
+            errors.append(e)
+
+    known_items = existing_ids(Item.id, {m['item_id'] for _, m in parsed})
+    known_warehouses = existing_ids(Warehouse.id, {m['warehouse_id'] for _, m in parsed})
+    batch = StockBatch({(m['item_id'], m['warehouse_id']) for _, m in parsed})
+
+    for index, movement in parsed:
+        pair = (movement['item_id'], movement['warehouse_id'])
+        if movement['item_id'] not in known_items:
+            errors.append(MovementError(index, f"Item {movement['item_id']} not found"))
+            continue
+        if movement['warehouse_id'] not in known_warehouses:
+            errors.append(MovementError(index, f"Warehouse {movement['warehouse_id']} not found"))
+            continue
+        # For OUT transactions, we can't remove from non-existent inventory
+        if movement['transaction_type'] == 'OUT' and pair not in batch.rows:
+            errors.append(MovementError(index, 'لا يوجد مخزون كافٍ لهذا العنصر في المستودع المحدد'))
+            continue
+        try:
+            batch.change(pair, movement['quantity'], movement['transaction_type'], movement['reference'])
+        except ValueError as e:
+            errors.append(MovementError(index, str(e)))
+
+    errors.sort(key=lambda e: e.index)
+    if (atomic and errors) or not batch.transactions:
+        db.session.rollback()
+        return 0, errors, []
+
+    return len(batch.transactions), errors, batch.commit()
+
+
+##############################################################################
+# STOCK TRANSFERS
+##############################################################################
+
+def _parse_transfer(index, data):
+    if not isinstance(data, dict):
+        raise MovementError(index, 'Transfer must be an object')
+    required = ('item_id', 'source_warehouse_id', 'destination_warehouse_id', 'quantity')
+    if any(not data.get(field) for field in required):
+        raise MovementError(index, 'Missing required fields')
+    try:
+        transfer = {field: int(data[field]) for field in required}
+        for field in ('source_slot_id', 'destination_slot_id'):
+            transfer[field] = int(data[field]) if data.get(field) else None
+    except (TypeError, ValueError):
+        raise MovementError(index, 'Ids and quantity must be integers')
+    if transfer['quantity'] <= 0:
+        raise MovementError(index, 'Quantity must be positive')
+    if transfer['source_warehouse_id'] == transfer['destination_warehouse_id'] \
+            and transfer['source_slot_id'] == transfer['destination_slot_id']:
+        raise MovementError(index, 'لا يمكن النقل إلى نفس المستودع')
+    transfer['reference'] = data.get('reference', '')
+    return transfer
+
+
+def _move_between_slots(transfer, slots):
+    # Validates and applies the optional slot-to-slot part of a transfer.
+    # Raises ValueError before touching anything if either slot is unusable.
+    source = slots.get(transfer['source_slot_id']) if transfer['source_slot_id'] else None
+    destination = slots.get(transfer['destination_slot_id']) if transfer['destination_slot_id'] else None
+    quantity = transfer['quantity']
+
+    if transfer['source_slot_id']:
+        if source is None or source.section.warehouse_id != transfer['source_warehouse_id']:
+            raise ValueError(f"Slot {transfer['source_slot_id']} is not in the source warehouse")
+        if source.item_id != transfer['item_id'] or (source.quantity or 0) < quantity:
+            raise ValueError(f"Slot {source.id} does not hold {quantity} of item {transfer['item_id']}")
+    if transfer['destination_slot_id']:
+        if destination is None or destination.section.warehouse_id != transfer['destination_warehouse_id']:
+            raise ValueError(f"Slot {transfer['destination_slot_id']} is not in the destination warehouse")
+        if destination.item_id not in (None, transfer['item_id']) and destination.quantity:
+            raise ValueError(f'Slot {destination.id} already holds another item')
+
+    if source is not None:
+        source.quantity -= quantity
+    if destination is not None:
+        destination.item_id = transfer['item_id']
+        destination.quantity = (destination.quantity or 0) + quantity
+
+
+def apply_stock_transfers(transfers, atomic=True):
+    # Move stock between warehouses (and optionally slots) in one DB transaction.
+    # Each transfer writes a paired TRANSFER ledger row on each side. Same
+    # contract as apply_inventory_movements; a failed line changes nothing.
+    errors = []
+    parsed = []
+    for index, data in enumerate(transfers):
+        try:
+            parsed.append((index, _parse_transfer(index, data)))
+        except MovementError as e:
+            errors.append(e)
+
+    known_items = existing_ids(Item.id, {t['item_id'] for _, t in parsed})
+    known_warehouses = existing_ids(Warehouse.id, {
+        w for _, t in parsed for w in (t['source_warehouse_id'], t['destination_warehouse_id'])
+    })
+    slot_ids = {s for _, t in parsed for s in (t['source_slot_id'], t['destination_slot_id']) if s}
+    slots = {}
+    if slot_ids:
+        slots = {slot.id: slot for slot in WarehouseSlot.query
+                 .options(joinedload(WarehouseSlot.section))
+                 .filter(WarehouseSlot.id.in_(slot_ids)).all()}
+    batch = StockBatch({
+        (t['item_id'], w) for _, t in parsed
+        for w in (t['source_warehouse_id'], t['destination_warehouse_id'])
+    })
+
+    applied = 0
+    for index, transfer in parsed:
+        item_id = transfer['item_id']
+        source = (item_id, transfer['source_warehouse_id'])
+        destination = (item_id, transfer['destination_warehouse_id'])
+        quantity = transfer['quantity']
+
+        if item_id not in known_items:
+            errors.append(MovementError(index, f'Item {item_id} not found'))
+            continue
+        missing = [w for w in (source[1], destination[1]) if w not in known_warehouses]
+        if missing:
+            errors.append(MovementError(index, f'Warehouse {missing[0]} not found'))
+            continue
+        if batch.available(source) < quantity:
+            errors.append(MovementError(index, f'الكمية غير كافية في المستودع المصدر. الكمية المتاحة: {batch.available(source)}'))
+            continue
+        try:
+            _move_between_slots(transfer, slots)
+        except ValueError as e:
+            errors.append(MovementError(index, str(e)))
+            continue
+
+        reference = transfer['reference']
+        suffix = f' - {reference}' if reference else ''
+        batch.change(source, -quantity, 'TRANSFER', f'نقل إلى مستودع #{destination[1]}{suffix}')
+        batch.change(destination, quantity, 'TRANSFER', f'نقل من مستودع #{source[1]}{suffix}')
+        applied += 1
+
+    errors.sort(key=lambda e: e.index)
+    if (atomic and errors) or not applied:
+        db.session.rollback()
+        return 0, errors, []
+
+    return applied, errors, batch.commit()
+
+
+##############################################################################
+# LOW STOCK ENGINE
+##############################################################################
+
+# Fields the low-stock listing can be sorted by
+LOW_STOCK_SORT_FIELDS = ('shortage', 'quantity', 'name', 'sku', 'reorder_level')
+LOW_STOCK_MAX_PER_PAGE = 500
+
+
+def low_stock_query(category_id=None, warehouse_id=None, sort_by='shortage', descending=True):
+    # Across all warehouses the per-item totals come straight from the stock summary;
+    # a single-warehouse view aggregates that warehouse's inventory in one grouped query.
+    # Items with no stock rows at all count as zero on hand.
+    if warehouse_id is None:
+        totals = ItemStockSummary.__table__
+        total_quantity = func.coalesce(ItemStockSummary.total_quantity, 0)
+        join_condition = ItemStockSummary.item_id == Item.id
+    else:
+        totals = db.session.query(
+            Inventory.item_id.label('item_id'),
+            func.sum(Inventory.quantity).label('total_quantity')
+        ).filter(Inventory.warehouse_id == warehouse_id)\
+            .group_by(Inventory.item_id).subquery()
+        total_quantity = func.coalesce(totals.c.total_quantity, 0)
+        join_condition = totals.c.item_id == Item.id
+
+    shortage = Item.reorder_level - total_quantity
+
+    query = db.session.query(
+        Item.id,
+        Item.name,
+        Item.sku,
+        Item.category_id,
+        Item.reorder_level,
+        total_quantity.label('quantity'),
+        shortage.label('shortage')
+    ).outerjoin(totals, join_condition)\
+        .filter(total_quantity <= Item.reorder_level)
+
+    if category_id is not None:
+        query = query.filter(Item.category_id == category_id)
+
+    sort_columns = {
+        'shortage': shortage,
+        'quantity': total_quantity,
+        'name': Item.name,
+        'sku': Item.sku,
+        'reorder_level': Item.reorder_level
+    }
+    sort_column = sort_columns.get(sort_by, shortage)
+    sort_column = sort_column.desc() if descending else sort_column.asc()
+    # Item id as tie-breaker keeps pages stable between requests
+    return query.order_by(sort_column, Item.id.asc())
+
+
+def _low_stock_row(r):
+    return {
+        'id': r.id,
+        'name': r.name,
+        'sku': r.sku,
+        'category_id': r.category_id,
+        'quantity': r.quantity,
+        'reorder_level': r.reorder_level,
+        'shortage': r.shortage
+    }
+
+
+def list_low_stock_items(category_id=None, warehouse_id=None, sort_by='shortage', descending=True):
+    # Every low-stock item as a plain list (the unpaged shape of /api/dashboard/low-stock)
+    return [_low_stock_row(r) for r in low_stock_query(category_id, warehouse_id, sort_by, descending)]
+
+
+def get_low_stock_page(category_id=None, warehouse_id=None, sort_by='shortage',
+                       descending=True, page=1, per_page=50):
+    page, per_page = page_bounds(page, per_page, LOW_STOCK_MAX_PER_PAGE)
+    return paginate(low_stock_query(category_id, warehouse_id, sort_by, descending),
+                    page, per_page, _low_stock_row)
+
+
+##############################################################################
+# TRANSACTION LEDGER (KEYSET PAGINATION)
+##############################################################################
+
+TRANSACTIONS_DEFAULT_LIMIT = 100
+TRANSACTIONS_MAX_LIMIT = 1000
+# Ledger fields returned per transaction, selected as plain columns
+TRANSACTION_COLUMNS = (
+    ('id', InventoryTransaction.id),
+    ('item_id', InventoryTransaction.item_id),
+    ('warehouse_id', InventoryTransaction.warehouse_id),
+    ('transaction_type', InventoryTransaction.transaction_type),
+    ('quantity', InventoryTransaction.quantity),
+    ('transaction_date', InventoryTransaction.transaction_date),
+    ('reference', InventoryTransaction.reference)
+)
+TRANSACTION_EXPANSIONS = {
+    'item': (Item, InventoryTransaction.item_id, ('id', 'name', 'sku')),
+    'warehouse': (Warehouse, InventoryTransaction.warehouse_id, ('id', 'name'))
+}
+
+
+def parse_datetime_param(value):
+    # ISO-8601 from the query string; aware values are normalised to naive UTC
+    # because transaction dates are stored with datetime.utcnow
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def encode_transaction_cursor(transaction_date, transaction_id):
+    raw = f'{transaction_date.isoformat()}|{transaction_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_transaction_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    date_part, id_part = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return datetime.fromisoformat(date_part), int(id_part)
+
+
+def get_transactions_page(item_id=None, warehouse_id=None, transaction_type=None,
+                          date_from=None, date_to=None, cursor=None,
+                          limit=TRANSACTIONS_DEFAULT_LIMIT, fields=None, expand=None):
+    # Newest first, keyed on (transaction_date, id) so every page is an index range
+    # scan no matter how deep the client pages. Raises ValueError for a bad cursor.
+    # Transaction dates are returned as datetimes (see serialization.dumps).
+    # fields / expand as for serialization.project.
+    limit = min(max(limit, 1), TRANSACTIONS_MAX_LIMIT)
+    query, shape = project(InventoryTransaction, TRANSACTION_COLUMNS, TRANSACTION_EXPANSIONS, fields, expand)
+    # Trailing columns for the cursor, whatever fields were picked
+    query = query.add_columns(InventoryTransaction.transaction_date.label('cursor_date'),
+                              InventoryTransaction.id.label('cursor_id'))
+
+    if item_id is not None:
+        query = query.where(InventoryTransaction.item_id == item_id)
+    if warehouse_id is not None:
+        query = query.where(InventoryTransaction.warehouse_id == warehouse_id)
+    if transaction_type:
+        query = query.where(InventoryTransaction.transaction_type == transaction_type)
+    if date_from is not None:
+        query = query.where(InventoryTransaction.transaction_date >= date_from)
+    if date_to is not None:
+        query = query.where(InventoryTransaction.transaction_date < date_to)
+
+    if cursor:
+        try:
+            cursor_date, cursor_id = decode_transaction_cursor(cursor)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise ValueError('Invalid cursor') from e
+        query = query.where(or_(
+            InventoryTransaction.transaction_date < cursor_date,
+            and_(InventoryTransaction.transaction_date == cursor_date,
+                 InventoryTransaction.id < cursor_id)
+        ))
+
+    # One extra row tells us whether another page exists without a COUNT
+    rows = db.session.execute(query.order_by(
+        InventoryTransaction.transaction_date.desc(),
+        InventoryTransaction.id.desc()
+    ).limit(limit + 1)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_transaction_cursor(rows[-1].cursor_date, rows[-1].cursor_id)
+
+    return {
+        'transactions': rows_to_dicts(shape, rows),
+        'next_cursor': next_cursor,
+        'has_more': has_more
+    }
+
+##############################################################################
+# WAREHOUSE LAYOUT
+##############################################################################
+
+def get_warehouse_layout_compact(warehouse_id):
+    # Sections with their slots as dense row-major arrays of row_count x column_count
+    # cells; cell (row, col) is at index (row - 1) * column_count + (col - 1) and
+    # holds null where no slot exists. Slots outside the section's current grid
+    # are left out.
+    rows = db.session.execute(
+        select(
+            WarehouseSection.id, WarehouseSection.section_name,
+            WarehouseSection.row_count, WarehouseSection.column_count,
+            WarehouseSlot.id, WarehouseSlot.row_number, WarehouseSlot.column_number,
+            WarehouseSlot.item_id, WarehouseSlot.quantity
+        ).outerjoin(WarehouseSlot, WarehouseSlot.section_id == WarehouseSection.id)
+        .where(WarehouseSection.warehouse_id == warehouse_id)
+        .order_by(WarehouseSection.id)
+    )
+
+    sections = []
+    current = None
+    for section_id, name, row_count, column_count, slot_id, row, column, item_id, quantity in rows:
+        if current is None or current['id'] != section_id:
+            cells = (row_count or 0) * (column_count or 0)
+            current = {
+                'id': section_id,
+                'warehouse_id': warehouse_id,
+                'section_name': name,
+                'row_count': row_count,
+                'column_count': column_count,
+                'slot_count': 0,
+                'slot_ids': [None] * cells,
+                'item_ids': [None] * cells,
+                'quantities': [None] * cells
+            }
+            sections.append(current)
+        if slot_id is None or not (1 <= row <= row_count and 1 <= column <= column_count):
+            continue
+        index = (row - 1) * column_count + (column - 1)
+        current['slot_ids'][index] = slot_id
+        current['item_ids'][index] = item_id
+        current['quantities'][index] = quantity or 0
+        current['slot_count'] += 1
+    return sections
+
+##############################################################################
+# NEAR-EXPIRY REPORT
+##############################################################################
+
+NEAR_EXPIRY_DEFAULT_DAYS = 30
+NEAR_EXPIRY_MAX_PER_PAGE = 500
+
+
+def _near_expiry_source():
+    # The four-way join the report denormalizes
+    return select(
+        BatchSlot.id, Batch.id, Batch.item_id, Batch.lot_number, Batch.expiry_date,
+        WarehouseSection.warehouse_id, WarehouseSection.id, WarehouseSlot.id,
+        WarehouseSlot.row_number, WarehouseSlot.column_number, BatchSlot.quantity_in_slot
+    ).join(Batch, Batch.id == BatchSlot.batch_id)\
+        .join(WarehouseSlot, WarehouseSlot.id == BatchSlot.slot_id)\
+        .join(WarehouseSection, WarehouseSection.id == WarehouseSlot.section_id)\
+        .where(Batch.expiry_date.isnot(None), BatchSlot.quantity_in_slot > 0)
+
+
+_NEAR_EXPIRY_COLUMNS = [
+    'BatchSlotID', 'BatchID', 'ItemID', 'LotNumber', 'ExpiryDate', 'WarehouseID',
+    'SectionID', 'SlotID', 'RowNumber', 'ColumnNumber', 'Quantity'
+]
+
+
+def refresh_near_expiry(batch_ids=(), batch_slot_ids=(), connection=None):
+    # Re-derive the report rows of the given batches and batch slots inside the
+    # caller's transaction: delete what is there, insert what the join yields now
+    execute = (connection or db.session).execute
+    table = NearExpiryEntry.__table__
+    for column, source_column, ids in ((table.c.BatchID, Batch.id, batch_ids),
+                                       (table.c.BatchSlotID, BatchSlot.id, batch_slot_ids)):
+        for chunk in chunked(ids):
+            execute(delete(table).where(column.in_(chunk)))
+            execute(insert(table).from_select(
+                _NEAR_EXPIRY_COLUMNS, _near_expiry_source().where(source_column.in_(chunk))))
+
+
+def rebuild_near_expiry():
+    table = NearExpiryEntry.__table__
+    db.session.execute(delete(table))
+    db.session.execute(insert(table).from_select(_NEAR_EXPIRY_COLUMNS, _near_expiry_source()))
+    db.session.commit()
+    return db.session.query(func.count(NearExpiryEntry.batch_slot_id)).scalar()
+
+
+def ensure_near_expiry():
+    # Rebuild the report when a batch slot it should list is missing, as on a
+    # database that had batches before near_expiry_report existed. Returns the
+    # rebuilt row count, or None when nothing was missing.
+    missing = db.session.execute(
+        _near_expiry_source().where(~exists().where(NearExpiryEntry.batch_slot_id == BatchSlot.id)).limit(1)
+    ).first()
+    if missing is None:
+        return None
+    return rebuild_near_expiry()
+
+
+# ORM changes to batches and batch slots land in the report in the same flush
+refresh_on_flush(refresh_near_expiry,
+                 batch_ids=(Batch, ROW_EVENTS), batch_slot_ids=(BatchSlot, ROW_EVENTS))
+
+
+def get_near_expiry_page(days=NEAR_EXPIRY_DEFAULT_DAYS, warehouse_id=None, item_id=None,
+                         include_expired=False, page=1, per_page=50, now=None):
+    now = now or datetime.utcnow()
+    page, per_page = page_bounds(page, per_page, NEAR_EXPIRY_MAX_PER_PAGE)
+
+    query = db.session.query(NearExpiryEntry, Item.name)\
+        .outerjoin(Item, Item.id == NearExpiryEntry.item_id)\
+        .filter(NearExpiryEntry.expiry_date < now + timedelta(days=days))
+    if not include_expired:
+        query = query.filter(NearExpiryEntry.expiry_date >= now)
+    if warehouse_id is not None:
+        query = query.filter(NearExpiryEntry.warehouse_id == warehouse_id)
+    if item_id is not None:
+        query = query.filter(NearExpiryEntry.item_id == item_id)
+
+    def serialize(row):
+        entry = row[0]
+        return {
+            'batch_slot_id': entry.batch_slot_id,
+            'batch_id': entry.batch_id,
+            'item_id': entry.item_id,
+            'item_name': row[1],
+            'lot_number': entry.lot_number,
+            'expiry_date': entry.expiry_date.isoformat(),
+            'days_left': (entry.expiry_date - now).days,
+            'warehouse_id': entry.warehouse_id,
+            'section_id': entry.section_id,
+            'slot_id': entry.slot_id,
+            'row_number': entry.row_number,
+            'column_number': entry.column_number,
+            'quantity': entry.quantity
+        }
+
+    return paginate(query.order_by(NearExpiryEntry.expiry_date, NearExpiryEntry.batch_slot_id),
+                    page, per_page, serialize)
+
+
+##############################################################################
+# FEFO BATCH ALLOCATION
+##############################################################################
+
+class AllocationError(Exception):
+    # Not enough unexpired batch stock for one or more lines
+    def __init__(self, message, shortages=None):
+        super().__init__(message)
+        self.message = message
+        self.shortages = shortages or []
+
+    def to_dict(self):
+        return {'message': self.message, 'shortages': self.shortages}
+
+
+def load_fefo_candidates(item_ids, warehouse_id=None, as_of=None):
+    # item_id -> batch slots holding unexpired stock, in picking order: earliest
+    # expiry first, batches without an expiry date last. One query for all items.
+    query = select(
+        Batch.item_id, BatchSlot.id, BatchSlot.batch_id, Batch.lot_number, Batch.expiry_date,
+        BatchSlot.slot_id, WarehouseSection.warehouse_id, BatchSlot.quantity_in_slot
+    ).join(Batch, Batch.id == BatchSlot.batch_id)\
+        .join(WarehouseSlot, WarehouseSlot.id == BatchSlot.slot_id)\
+        .join(WarehouseSection, WarehouseSection.id == WarehouseSlot.section_id)\
+        .where(Batch.item_id.in_(item_ids),
+               BatchSlot.quantity_in_slot > 0,
+               or_(Batch.expiry_date.is_(None), Batch.expiry_date > (as_of or datetime.utcnow())))\
+        .order_by(Batch.item_id, Batch.expiry_date.is_(None), Batch.expiry_date, Batch.id, BatchSlot.id)\
+        .with_for_update()
+    if warehouse_id is not None:
+        query = query.where(WarehouseSection.warehouse_id == warehouse_id)
+
+    candidates = {}
+    for row in db.session.execute(query):
+        candidates.setdefault(row[0], []).append(row[1:])
+    return candidates
+
+
+def _pick_fefo(candidates, quantity, taken):
+    # Greedy pick in candidate order; taken tracks what earlier lines of the same
+    # call already claimed from each batch slot
+    picks = []
+    remaining = quantity
+    for batch_slot_id, batch_id, lot_number, expiry_date, slot_id, warehouse_id, in_slot in candidates:
+        if not remaining:
+            break
+        free = in_slot - taken.get(batch_slot_id, 0)
+        if free <= 0:
+            continue
+        picked = min(free, remaining)
+        taken[batch_slot_id] = taken.get(batch_slot_id, 0) + picked
+        remaining -= picked
+        picks.append({
+            'batch_slot_id': batch_slot_id,
+            'batch_id': batch_id,
+            'lot_number': lot_number,
+            'expiry_date': expiry_date.isoformat() if expiry_date else None,
+            'slot_id': slot_id,
+            'warehouse_id': warehouse_id,
+            'quantity': picked
+        })
+    return picks, remaining
+
+
+def _decrement_where_covered(table, key_column, quantity_column, amounts, message):
+    # Conditional UPDATE per row in one executemany; a row that no longer holds
+    # enough (a concurrent pick, or stock tables out of step) matches nothing
+    # and fails the whole allocation
+    result = db.session.execute(
+        update(table)
+        .where(key_column == bindparam('b_id'), quantity_column >= bindparam('b_quantity'))
+        .values({quantity_column.name: quantity_column - bindparam('b_quantity')}),
+        [{'b_id': key, 'b_quantity': quantity} for key, quantity in amounts.items()]
+    )
+    if result.rowcount != len(amounts):
+        raise AllocationError(message)
+
+
+def _decrement_batch_stock(allocations):
+    # Take the picked units out of the batch slots, their batches and the
+    # warehouse slots holding them
+    amounts = {'batch_slots': {}, 'batches': {}, 'slots': {}}
+    for allocation in allocations:
+        for key, object_id in (('batch_slots', allocation['batch_slot_id']),
+                               ('batches', allocation['batch_id']),
+                               ('slots', allocation['slot_id'])):
+            amounts[key][object_id] = amounts[key].get(object_id, 0) + allocation['quantity']
+
+    batch_slots, batches, slots = BatchSlot.__table__, Batch.__table__, WarehouseSlot.__table__
+    _decrement_where_covered(batch_slots, batch_slots.c.BatchSlotID, batch_slots.c.QuantityInSlot,
+                             amounts['batch_slots'], 'Batch stock changed during allocation, please retry')
+    _decrement_where_covered(batches, batches.c.BatchID, batches.c.Quantity,
+                             amounts['batches'], 'Batch quantity is lower than its slots hold')
+    _decrement_where_covered(slots, slots.c.id, slots.c.quantity,
+                             amounts['slots'], 'Slot quantity is lower than its batches hold')
+    # Core UPDATE bypasses the ORM events, so refresh the report rows directly
+    refresh_near_expiry(batch_slot_ids=amounts['batch_slots'])
+
+
+def _post_allocations(allocations, reference):
+    # Book the picked quantities as OUT movements on the matching inventory rows
+    totals = {}
+    for allocation in allocations:
+        pair = (allocation['item_id'], allocation['warehouse_id'])
+        totals[pair] = totals.get(pair, 0) + allocation['quantity']
+    batch = StockBatch(set(totals))
+    for pair, quantity in sorted(totals.items()):
+        try:
+            batch.change(pair, -quantity, 'OUT', reference)
+        except ValueError as e:
+            raise AllocationError(str(e), [{'item_id': pair[0], 'warehouse_id': pair[1]}])
+    return batch
+
+
+def _finish_allocation(allocations, post_stock, reference):
+    # Without post_stock an allocation is only a pick list and writes nothing, so
+    # running it again proposes the same units. Posting takes the units out of
+    # batch slots, batches, warehouse slots and inventory in one transaction.
+    if not post_stock or not allocations:
+        db.session.rollback()
+        return
+    try:
+        _decrement_batch_stock(allocations)
+        _post_allocations(allocations, reference).commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def allocate_fefo(item_id, quantity, warehouse_id=None, post_stock=False, reference=''):
+    # Pick `quantity` units of an item from its batch slots, earliest expiry first.
+    # Raises AllocationError (nothing written) if unexpired stock falls short.
+    # Only post_stock writes anything (see _finish_allocation).
+    taken = {}
+    picks, remaining = _pick_fefo(load_fefo_candidates([item_id], warehouse_id).get(item_id, []), quantity, taken)
+    if remaining:
+        db.session.rollback()
+        raise AllocationError('لا يوجد مخزون صالح كافٍ لهذا العنصر', [{
+            'item_id': item_id, 'requested': quantity, 'missing': remaining
+        }])
+
+    allocations = [dict(pick, item_id=item_id) for pick in picks]
+    _finish_allocation(allocations, post_stock, reference or 'FEFO')
+    return allocations
+
+
+def allocate_sales_order(sales_order_id, warehouse_id=None, post_stock=False, allow_partial=False):
+    # Allocate every open line of a sales order from one candidate query. Lines are
+    # served in order, so two lines of the same item never claim the same units.
+    # post_stock takes the picks out of stock and adds them to QuantityShipped, so
+    # a later call only allocates what is still open; without it the picks are a
+    # proposal and nothing is written.
+    order = db.session.get(SalesOrder, sales_order_id)
+    if order is None:
+        raise LookupError(f'Sales order {sales_order_id} not found')
+
+    lines = db.session.execute(
+        select(SalesOrderDetail.id, SalesOrderDetail.item_id,
+               SalesOrderDetail.quantity_ordered - func.coalesce(SalesOrderDetail.quantity_shipped, 0))
+        .where(SalesOrderDetail.sales_order_id == sales_order_id)
+        .order_by(SalesOrderDetail.id)
+    ).all()
+    candidates = load_fefo_candidates({item_id for _, item_id, _ in lines}, warehouse_id)
+
+    taken = {}
+    allocations = []
+    shortages = []
+    shipped = []
+    for line_id, item_id, open_quantity in lines:
+        if open_quantity <= 0:
+            continue
+        picks, remaining = _pick_fefo(candidates.get(item_id, []), open_quantity, taken)
+        allocations.extend(dict(pick, line_id=line_id, item_id=item_id) for pick in picks)
+        if remaining:
+            shortages.append({'line_id': line_id, 'item_id': item_id,
+                              'requested': open_quantity, 'missing': remaining})
+        if open_quantity - remaining:
+            shipped.append({'b_id': line_id, 'b_quantity': open_quantity - remaining})
+
+    if shortages and not allow_partial:
+        db.session.rollback()
+        raise AllocationError('لا يوجد مخزون صالح كافٍ لتلبية أمر البيع', shortages)
+
+    if post_stock and shipped:
+        table = SalesOrderDetail.__table__
+        db.session.execute(
+            update(table).where(table.c.SODetailID == bindparam('b_id'))
+            .values(QuantityShipped=func.coalesce(table.c.QuantityShipped, 0) + bindparam('b_quantity')),
+            shipped
+        )
+        if not shortages:
+            order.status = 'Shipped'
+
+    _finish_allocation(allocations, post_stock, f'أمر بيع #{sales_order_id}')
+    return allocations, shortages
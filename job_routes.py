@@ -0,0 +1,107 @@
+from flask import Blueprint, request, jsonify, current_app, send_file
+from flask_login import current_user, login_required
+from models import db, Job
+from serialization import page_bounds, paginate
+from job_services import (
+    JOB_HANDLERS, JOB_FINAL_STATUSES, job_to_dict, submit_job, cancel_job,
+    ensure_job_runner, job_export_path
+)
+import os
+
+# Create a Blueprint for background job routes
+job_bp = Blueprint('jobs', __name__)
+
+JOBS_MAX_PER_PAGE = 200
+# Job types any logged-in user may queue; the others (MRP, forecasts, rebuilds
+# and snapshots) are admin maintenance
+USER_JOB_TYPES = ('export',)
+
+
+@job_bp.before_app_request
+def start_job_runner():
+    # The runner starts with the first request rather than at import, so CLI
+    # commands and scripts that import the app never pick up queued jobs
+    ensure_job_runner(current_app._get_current_object())
+
+
+def _is_admin():
+    return current_user.role is not None and current_user.role.name == 'admin'
+
+
+def _get_visible_job(job_id):
+    # Admins see every job; other users only the ones they submitted
+    job = db.session.get(Job, job_id)
+    if job is None or (job.created_by != current_user.id and not _is_admin()):
+        return None
+    return job
+
+
+@job_bp.route('/api/jobs', methods=['POST'])
+@login_required
+def create_job():
+    data = request.get_json() or {}
+    job_type = data.get('job_type')
+    if job_type not in JOB_HANDLERS:
+        return jsonify({'message': f'Unknown job type: {job_type}',
+                        'job_types': sorted(JOB_HANDLERS)}), 400
+    if job_type not in USER_JOB_TYPES and not _is_admin():
+        return jsonify({'message': 'Unauthorized'}), 403
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'message': 'params must be an object'}), 400
+
+    job = submit_job(job_type, params, created_by=current_user.id, max_attempts=data.get('max_attempts'))
+    return jsonify(job_to_dict(job)), 202
+
+
+@job_bp.route('/api/jobs', methods=['GET'])
+@login_required
+def get_jobs():
+    page, per_page = page_bounds(request.args.get('page', 1, type=int),
+                                 request.args.get('per_page', 50, type=int), JOBS_MAX_PER_PAGE)
+
+    query = db.session.query(Job)
+    if not _is_admin():
+        query = query.filter(Job.created_by == current_user.id)
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    if request.args.get('job_type'):
+        query = query.filter(Job.job_type == request.args['job_type'])
+
+    return jsonify(paginate(query.order_by(Job.id.desc()), page, per_page, lambda row: job_to_dict(row[0])))
+
+
+@job_bp.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    job = _get_visible_job(job_id)
+    if job is None:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(job_to_dict(job))
+
+
+@job_bp.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job_route(job_id):
+    job = _get_visible_job(job_id)
+    if job is None:
+        return jsonify({'message': 'Job not found'}), 404
+    if job.status in JOB_FINAL_STATUSES:
+        return jsonify({'message': f'Job already {job.status.lower()}'}), 409
+    return jsonify(job_to_dict(cancel_job(job_id)))
+
+
+@job_bp.route('/api/jobs/<int:job_id>/download', methods=['GET'])
+@login_required
+def download_job_result(job_id):
+    job = _get_visible_job(job_id)
+    if job is None:
+        return jsonify({'message': 'Job not found'}), 404
+    filename = (job.result or {}).get('filename') if job.status == 'Succeeded' else None
+    if not filename:
+        return jsonify({'message': 'Job has no file to download'}), 404
+
+    path = job_export_path(job.id, filename)
+    if not os.path.exists(path):
+        return jsonify({'message': 'Job file no longer exists'}), 410
+    return send_file(path, as_attachment=True, download_name=filename)
@@ -0,0 +1,369 @@
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update, func, or_
+from werkzeug.datastructures import MultiDict
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+##############################################################################
+# JOB RUNNER
+##############################################################################
+
+# Worker threads each web process starts for jobs. None by default: web
+# processes only enqueue and `flask jobs-worker` runs the jobs, so a server with
+# several web workers does not also run several job pools.
+JOB_WORKERS = int(os.environ.get('KATILO_JOB_WORKERS', '0'))
+# Threads of a `flask jobs-worker` process when neither --workers nor
+# KATILO_JOB_WORKERS says otherwise
+JOB_WORKER_THREADS = 2
+JOB_POLL_SECONDS = 1.0
+JOB_HEARTBEAT_SECONDS = 10
+# A Running job whose heartbeat is older than this lost its worker process
+JOB_STALE_SECONDS = 60
+JOB_RETRY_BASE_SECONDS = 5
+JOB_PROGRESS_MIN_INTERVAL = 1.0
+JOB_FINAL_STATUSES = ('Succeeded', 'Failed', 'Cancelled')
+
+# job_type -> (handler, default max attempts)
+JOB_HANDLERS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_handler(job_type, max_attempts=1):
+    # Register fn(context, **params) as the handler for job_type; its return value
+    # must be JSON-serializable and becomes the job's result
+    def decorator(fn):
+        JOB_HANDLERS[job_type] = (fn, max_attempts)
+        return fn
+    return decorator
+
+
+class JobContext:
+    # Handed to every handler. Progress is written on its own connection so it is
+    # visible while the job runs; call it between the handler's own commits, since
+    # SQLite allows one writer at a time.
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._last_write = 0.0
+
+    def progress(self, percent, message=None):
+        now = time.monotonic()
+        if now - self._last_write < JOB_PROGRESS_MIN_INTERVAL and percent < 100:
+            return
+        self._last_write = now
+        with db.engine.begin() as connection:
+            connection.execute(update(Job.__table__).where(Job.__table__.c.JobID == self.job_id).values(
+                Progress=max(0.0, min(100.0, float(percent))),
+                ProgressMessage=(message or '')[:255],
+                HeartbeatAt=datetime.utcnow()
+            ))
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        with db.engine.connect() as connection:
+            if connection.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar():
+                raise JobCancelled()
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'job_type': job.job_type,
+        'status': job.status,
+        'params': job.params or {},
+        'result': job.result,
+        'error': job.error,
+        'progress': job.progress or 0.0,
+        'progress_message': job.progress_message,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'cancel_requested': job.cancel_requested,
+        'created_by': job.created_by,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def submit_job(job_type, params=None, created_by=None, max_attempts=None):
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job type: {job_type}')
+    job = Job(
+        job_type=job_type,
+        params=params or {},
+        created_by=created_by,
+        max_attempts=max(1, int(max_attempts or JOB_HANDLERS[job_type][1]))
+    )
+    db.session.add(job)
+    db.session.commit()
+    if _runner is not None:
+        _runner.wakeup.set()
+    return job
+
+
+def cancel_job(job_id):
+    # Queued jobs are cancelled outright; running ones are asked to stop at their
+    # next progress call
+    now = datetime.utcnow()
+    db.session.execute(update(Job).where(Job.id == job_id, Job.status == 'Queued')
+                       .values(status='Cancelled', cancel_requested=True, finished_at=now))
+    db.session.execute(update(Job).where(Job.id == job_id, Job.status == 'Running')
+                       .values(cancel_requested=True))
+    db.session.commit()
+    return db.session.get(Job, job_id)
+
+
+def execute_job(job_id):
+    # Run one claimed job to completion in the current app context
+    job = db.session.get(Job, job_id)
+    handler = JOB_HANDLERS.get(job.job_type)
+    params = dict(job.params or {})
+    db.session.commit()
+
+    try:
+        if handler is None:
+            raise ValueError(f'Unknown job type: {job.job_type}')
+        result = handler[0](JobContext(job_id), **params)
+    except JobCancelled:
+        db.session.rollback()
+        _finish(job_id, status='Cancelled')
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Job %s (%s) failed', job_id, job.job_type)
+        job = db.session.get(Job, job_id)
+        if job.attempts < job.max_attempts and not job.cancel_requested:
+            # Exponential backoff: 5s, 10s, 20s, ...
+            job.status = 'Queued'
+            job.run_after = datetime.utcnow() + timedelta(
+                seconds=JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+            job.error = str(e)
+            db.session.commit()
+        else:
+            _finish(job_id, status='Failed', error=traceback.format_exc()[-4000:])
+    else:
+        _finish(job_id, status='Succeeded', result=result, error=None, progress=100.0)
+
+
+def _finish(job_id, **values):
+    db.session.execute(update(Job).where(Job.id == job_id).values(finished_at=datetime.utcnow(), **values))
+    db.session.commit()
+
+
+def claim_jobs(limit):
+    # Move up to `limit` runnable queued jobs to Running. The claim is a
+    # conditional UPDATE, so two runners polling the same database never both win.
+    now = datetime.utcnow()
+    candidates = db.session.execute(
+        select(Job.id).where(Job.status == 'Queued', or_(Job.run_after.is_(None), Job.run_after <= now))
+        .order_by(Job.id).limit(limit)
+    ).scalars().all()
+    claimed = []
+    for job_id in candidates:
+        result = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'Queued')
+            .values(status='Running', started_at=now, heartbeat_at=now, attempts=Job.attempts + 1)
+        )
+        if result.rowcount:
+            claimed.append(job_id)
+    db.session.commit()
+    return claimed
+
+
+def recover_stale_jobs():
+    # Running jobs whose process stopped heartbeating are retried or failed
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = db.session.execute(
+        select(Job).where(Job.status == 'Running', or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < cutoff))
+    ).scalars().all()
+    for job in stale:
+        if job.attempts < job.max_attempts and not job.cancel_requested:
+            job.status = 'Queued'
+            job.run_after = None
+        else:
+            job.status = 'Cancelled' if job.cancel_requested else 'Failed'
+            job.error = job.error or 'Worker stopped while the job was running'
+            job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return len(stale)
+
+
+class JobRunner:
+    # Dispatcher thread that claims queued jobs and hands them to a thread pool.
+    # Handlers that are CPU bound can fan out to processes themselves (the
+    # forecast job does).
+    def __init__(self, app, workers):
+        self.app = app
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='katilo-job')
+        self.wakeup = threading.Event()
+        self.running = set()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._loop, name='katilo-job-dispatcher', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, wait=True):
+        self.stopped = True
+        self.wakeup.set()
+        self.executor.shutdown(wait=wait)
+
+    def _loop(self):
+        last_heartbeat = 0.0
+        while not self.stopped:
+            try:
+                with self.app.app_context():
+                    if time.monotonic() - last_heartbeat >= JOB_HEARTBEAT_SECONDS:
+                        last_heartbeat = time.monotonic()
+                        self._heartbeat()
+                        recover_stale_jobs()
+                    free = self.workers - len(self.running)
+                    if free > 0:
+                        for job_id in claim_jobs(free):
+                            self.running.add(job_id)
+                            self.executor.submit(self._run, job_id)
+            except Exception:
+                logger.exception('Job dispatcher iteration failed')
+            self.wakeup.wait(JOB_POLL_SECONDS)
+            self.wakeup.clear()
+
+    def _heartbeat(self):
+        if self.running:
+            db.session.execute(update(Job).where(Job.id.in_(list(self.running)), Job.status == 'Running')
+                               .values(heartbeat_at=datetime.utcnow()))
+            db.session.commit()
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                execute_job(job_id)
+        except Exception:
+            logger.exception('Job %s crashed the worker', job_id)
+        finally:
+            self.running.discard(job_id)
+            self.wakeup.set()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def ensure_job_runner(app, workers=None):
+    # Start this process's runner once; a no-op when workers is 0
+    global _runner
+    workers = JOB_WORKERS if workers is None else workers
+    if _runner is not None or workers <= 0:
+        return _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(app, workers)
+            _runner.start()
+    return _runner
+
+
+##############################################################################
+# BUILT-IN JOBS
+##############################################################################
+
+@job_handler('mrp', max_attempts=2)
+def _mrp_job(context, incremental=False):
+    from production_services import run_mrp
+    return run_mrp(incremental=bool(incremental), progress=context.progress)
+
+
+@job_handler('forecast', max_attempts=2)
+def _forecast_job(context, frequency='weekly', horizon=None, history=None, workers=None):
+    from forecast_services import FORECAST_DEFAULT_HORIZON, run_demand_forecast
+    return run_demand_forecast(frequency=frequency, horizon=int(horizon or FORECAST_DEFAULT_HORIZON),
+                               history=history, workers=workers, progress=context.progress)
+
+
+@job_handler('rebuild-stock-summary')
+def _rebuild_stock_summary_job(context):
+    from inventory_services import rebuild_stock_summaries
+    return {'items': rebuild_stock_summaries()}
+
+
+@job_handler('rebuild-near-expiry')
+def _rebuild_near_expiry_job(context):
+    from inventory_services import rebuild_near_expiry
+    return {'batch_slots': rebuild_near_expiry()}
+
+
+@job_handler('rebuild-item-search')
+def _rebuild_item_search_job(context):
+    from search_services import rebuild_item_search
+    return {'items': rebuild_item_search()}
+
+
+@job_handler('dashboard-snapshot')
+def _dashboard_snapshot_job(context):
+    from dashboard_services import get_dashboard_snapshot, invalidate_dashboard_snapshot
+    invalidate_dashboard_snapshot()
+    return {'generated_at': get_dashboard_snapshot()['generated_at']}
+
+
+@job_handler('reporting-snapshot')
+def _reporting_snapshot_job(context):
+    from database import snapshot_reporting_database
+    return snapshot_reporting_database()
+
+
+def job_export_path(job_id, filename):
+    return os.path.join(current_app.instance_path, 'exports', f'{job_id}_{filename}')
+
+
+@job_handler('export')
+def _export_job(context, dataset, format='ndjson', gzip=False, **filters):
+    # Same datasets and filters as /api/export/<dataset>, written to a file under
+    # instance/exports for download through /api/jobs/<id>/download
+    from export_routes import (EXPORT_DATASETS, EXPORT_FORMATS, build_export_query, iter_export_rows,
+                               iter_csv, iter_ndjson, gzip_stream)
+    from database import execute_reporting
+    if dataset not in EXPORT_DATASETS:
+        raise ValueError(f'Unknown dataset: {dataset}')
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported format: {format}')
+
+    query = build_export_query(dataset, MultiDict(filters))
+    total = execute_reporting(select(func.count()).select_from(query.order_by(None).subquery())).scalar()
+
+    def counted(partitions):
+        # Progress by rows handed to the writer; rows added since the count
+        # just pin it at 100
+        done = 0
+        for partition in partitions:
+            yield partition
+            done += len(partition)
+            context.progress(100 * done / total if total else 100, f'{done} of {total} rows exported')
+
+    names = [name for name, _ in EXPORT_DATASETS[dataset][1]]
+    rows = counted(iter_export_rows(query))
+    chunks = iter_csv(rows, names) if format == 'csv' else iter_ndjson(rows, names)
+    filename = f"{dataset}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{format}"
+    if gzip:
+        chunks = gzip_stream(chunks)
+        filename += '.gz'
+
+    path = job_export_path(context.job_id, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    try:
+        with open(path, 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return {'filename': filename, 'bytes': written}
@@ -1,11 +1,29 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
-from sqlalchemy import Enum as SAEnum, CheckConstraint, UniqueConstraint
-
-db = SQLAlchemy()
+import copy
+import threading
+import time
+from sqlalchemy import Enum as SAEnum, CheckConstraint, UniqueConstraint, Select, select, text, insert as sa_insert, inspect as sa_inspect
+from sqlalchemy.orm import make_transient_to_detached, contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
+
+class RoutingSession(Session):
+    # Sends plain SELECTs to the bind named in session.info['read_bind'] while it
+    # is set; flushes and every other statement keep using the model's own bind
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        read_bind = self.info.get('read_bind')
+        if bind is None and read_bind is not None and not self._flushing and isinstance(clause, Select):
+            engine = self._db.engines.get(read_bind)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 ##############################################################################
 # ENUMERATIONS
@@ -31,6 +49,7 @@ recurring_frequency_enum = SAEnum('Daily', 'Weekly', 'Monthly', 'Yearly', name='
 return_status_enum = SAEnum('Pending', 'Approved', 'Denied', name='return_status_enum')
 return_reason_enum = SAEnum('Defective', 'WrongItem', 'Damaged', 'Other', name='return_reason_enum')
 interaction_type_enum = SAEnum('Call', 'Email', 'Visit', 'Other', name='interaction_type_enum')
+job_status_enum = SAEnum('Queued', 'Running', 'Succeeded', 'Failed', 'Cancelled', name='job_status_enum')
 
 ##############################################################################
 # CORE ENTITIES AND RELATIONSHIPS
@@ -68,6 +87,8 @@ class Item(db.Model):
                                      foreign_keys='BOMDetail.component_item_id')
     transactions = db.relationship('InventoryTransaction', backref='item', lazy=True)
     slots = db.relationship('WarehouseSlot', backref='item_ref', lazy=True)
+    stock_summary = db.relationship('ItemStockSummary', backref='item', lazy=True,
+                                    uselist=False, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<Item {self.name}>'
@@ -155,12 +176,32 @@ class InventoryTransaction(db.Model):
 
     __table_args__ = (
         CheckConstraint('Quantity > 0', name='chk_transaction_qty_positive'),
+        # Keyset pagination indexes: newest-first ledger, optionally narrowed by item/warehouse/type
+        db.Index('ix_inventory_transactions_date_id', 'TransactionDate', 'TransactionID'),
+        db.Index('ix_inventory_transactions_item_date_id', 'ItemID', 'TransactionDate', 'TransactionID'),
+        db.Index('ix_inventory_transactions_warehouse_date_id', 'WarehouseID', 'TransactionDate', 'TransactionID'),
+        db.Index('ix_inventory_transactions_type_date_id', 'transaction_type', 'TransactionDate', 'TransactionID'),
     )
 
     def __repr__(self):
         return (f'<Transaction {self.transaction_type} of Item {self.item_id} '
                 f'in Warehouse {self.warehouse_id} (Qty: {self.quantity})>')
 
+class ItemStockSummary(db.Model):
+    # Per-item totals across all warehouses, maintained alongside every inventory write
+    __tablename__ = 'item_stock_summaries'
+    item_id = db.Column('ItemID', db.Integer, db.ForeignKey('items.ItemID'), primary_key=True)
+    total_quantity = db.Column('TotalQuantity', db.Integer, nullable=False, default=0)
+    warehouses_with_stock = db.Column('WarehousesWithStock', db.Integer, nullable=False, default=0)
+    last_movement_at = db.Column('LastMovementAt', db.DateTime)
+
+    __table_args__ = (
+        CheckConstraint('TotalQuantity >= 0', name='chk_stock_summary_qty_nonnegative'),
+    )
+
+    def __repr__(self):
+        return f'<ItemStockSummary Item {self.item_id} (Qty: {self.total_quantity})>'
+
 #########################################################################################
 #################  #  Returns & Refunds Management  ####################################
 #########################################################################################
@@ -344,6 +385,10 @@ class Batch(db.Model):
 
     __table_args__ = (
         CheckConstraint('Quantity >= 0', name='chk_batch_qty_nonnegative'),
+        # FEFO picking walks an item's batches in expiry order
+        db.Index('ix_batches_item_expiry', 'ItemID', 'ExpiryDate', 'BatchID'),
+        # Expiry horizon scans across all items
+        db.Index('ix_batches_expiry', 'ExpiryDate', 'BatchID'),
     )
 
     def __repr__(self):
@@ -358,11 +403,38 @@ class BatchSlot(db.Model):
 
     __table_args__ = (
         CheckConstraint('QuantityInSlot >= 0', name='chk_batchslot_qty_nonnegative'),
+        db.Index('ix_batch_slots_batch', 'BatchID'),
+        db.Index('ix_batch_slots_slot', 'SlotID'),
     )
 
     def __repr__(self):
         return f"<BatchSlot {self.id} Batch {self.batch_id} Slot {self.slot_id}>"
 
+class NearExpiryEntry(db.Model):
+    # One row per stocked batch slot whose batch has an expiry date, with its
+    # location copied in so horizon queries read a single indexed table. Kept in
+    # sync by inventory_services; rebuild with `flask rebuild-near-expiry`.
+    __tablename__ = 'near_expiry_report'
+    batch_slot_id = db.Column('BatchSlotID', db.Integer, primary_key=True, autoincrement=False)
+    batch_id = db.Column('BatchID', db.Integer, nullable=False, index=True)
+    item_id = db.Column('ItemID', db.Integer, nullable=False)
+    lot_number = db.Column('LotNumber', db.String(100), nullable=False)
+    expiry_date = db.Column('ExpiryDate', db.DateTime, nullable=False)
+    warehouse_id = db.Column('WarehouseID', db.Integer, nullable=False)
+    section_id = db.Column('SectionID', db.Integer, nullable=False)
+    slot_id = db.Column('SlotID', db.Integer, nullable=False)
+    row_number = db.Column('RowNumber', db.Integer)
+    column_number = db.Column('ColumnNumber', db.Integer)
+    quantity = db.Column('Quantity', db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_near_expiry_report_expiry', 'ExpiryDate', 'BatchSlotID'),
+        db.Index('ix_near_expiry_report_warehouse_expiry', 'WarehouseID', 'ExpiryDate', 'BatchSlotID'),
+    )
+
+    def __repr__(self):
+        return f"<NearExpiryEntry BatchSlot {self.batch_slot_id} Expires {self.expiry_date}>"
+
 ##############################################################################
 # QUALITY CONTROL (QC) & INSPECTIONS
 ##############################################################################
@@ -481,6 +553,36 @@ class RolePermission(db.Model):
     role_id = db.Column('RoleID', db.Integer, db.ForeignKey('roles.id'), primary_key=True)
     permission_id = db.Column('PermissionID', db.Integer, db.ForeignKey('permissions.PermissionID'), primary_key=True)
 
+# Per-process cache of each role's permission names. Entries are stamped with the
+# cache version; invalidate_role_permissions() bumps it whenever grants change in
+# this process, and the TTL bounds how long other workers keep serving old grants.
+PERMISSION_CACHE_TTL_SECONDS = 60
+_permission_cache_lock = threading.Lock()
+_permission_cache = {'version': 0, 'roles': {}}
+
+def get_role_permissions(role_id):
+    now = time.monotonic()
+    version = _permission_cache['version']
+    entry = _permission_cache['roles'].get(role_id)
+    if entry and entry[0] == version and entry[1] > now:
+        return entry[2]
+
+    names = frozenset(name for (name,) in db.session.query(Permission.permission_name)
+                      .join(RolePermission, RolePermission.permission_id == Permission.id)
+                      .filter(RolePermission.role_id == role_id))
+    _store_role_permissions(role_id, version, names)
+    return names
+
+def _store_role_permissions(role_id, version, names):
+    with _permission_cache_lock:
+        if _permission_cache['version'] == version:
+            _permission_cache['roles'][role_id] = (version, time.monotonic() + PERMISSION_CACHE_TTL_SECONDS, names)
+
+def invalidate_role_permissions():
+    with _permission_cache_lock:
+        _permission_cache['version'] += 1
+        _permission_cache['roles'] = {}
+
 ##############################################################################
 # DOCUMENT MANAGEMENT
 ##############################################################################
@@ -678,12 +780,9 @@ class User(db.Model, UserMixin):
         return check_password_hash(self.password_hash, password)
 
     def has_permission(self, permission_name):
-        if not self.role:
+        if not self.role_id:
             return False
-        role_perms = RolePermission.query.filter_by(role_id=self.role.id).all()
-        perm_ids = [rp.permission_id for rp in role_perms]
-        perms = Permission.query.filter(Permission.id.in_(perm_ids)).all()
-        return any(p.permission_name == permission_name for p in perms)
+        return permission_name in get_role_permissions(self.role_id)
 
     def update_profile(self, data):
         if data.get('phone'):
@@ -742,6 +841,57 @@ class User(db.Model, UserMixin):
 
 # 1. Advanced Inventory Forecasting & Demand Planning
 
+
+# Per-process cache of the logged-in user's identity for load_user. Only plain column
+# values are kept; every request gets fresh detached User/Role instances built from
+# them, so nothing mutable is shared between requests or sessions.
+USER_CACHE_TTL_SECONDS = 30
+_user_cache_lock = threading.Lock()
+_user_cache = {'version': 0, 'users': {}}
+
+def _column_values(obj):
+    return {attr.key: getattr(obj, attr.key) for attr in sa_inspect(obj).mapper.column_attrs}
+
+def _detached(model, values):
+    obj = model(**copy.deepcopy(values))
+    make_transient_to_detached(obj)
+    return obj
+
+def load_user_identity(user_id):
+    now = time.monotonic()
+    version = _user_cache['version']
+    entry = _user_cache['users'].get(user_id)
+    if entry is None or entry[0] != version or entry[1] <= now:
+        # User, role and the role's permission names in one joined query
+        rows = db.session.query(User, Role, Permission.permission_name)\
+            .outerjoin(Role, Role.id == User.role_id)\
+            .outerjoin(RolePermission, RolePermission.role_id == Role.id)\
+            .outerjoin(Permission, Permission.id == RolePermission.permission_id)\
+            .options(contains_eager(User.role))\
+            .filter(User.id == user_id).all()
+        if not rows:
+            return None
+        user, role = rows[0][0], rows[0][1]
+        if role is not None:
+            _store_role_permissions(role.id, _permission_cache['version'],
+                                    frozenset(name for _, _, name in rows if name is not None))
+        entry = (version, now + USER_CACHE_TTL_SECONDS, _column_values(user),
+                 _column_values(role) if role is not None else None)
+        with _user_cache_lock:
+            if _user_cache['version'] == version:
+                _user_cache['users'][user_id] = entry
+        # Already attached to this session with the role loaded
+        return user
+
+    user = _detached(User, entry[2])
+    set_committed_value(user, 'role', _detached(Role, entry[3]) if entry[3] is not None else None)
+    return db.session.merge(user, load=False)
+
+def invalidate_user_identities():
+    with _user_cache_lock:
+        _user_cache['version'] += 1
+        _user_cache['users'] = {}
+
 class DemandForecast(db.Model):
     __tablename__ = 'demand_forecasts'
     id = db.Column(db.Integer, primary_key=True)
@@ -749,10 +899,16 @@ class DemandForecast(db.Model):
     forecasted_quantity = db.Column(db.Integer, default=0)
     forecast_date = db.Column(db.DateTime, default=datetime.utcnow)
     accuracy_rate = db.Column(db.Float, default=0.0)  # 0-100 or 0-1
+    # Period length ('daily' / 'weekly') and model picked by forecast_services;
+    # null on rows written before runs recorded them
+    frequency = db.Column(db.String(10))
+    method = db.Column(db.String(30))
 
     __table_args__ = (
         CheckConstraint('forecasted_quantity >= 0', name='chk_forecast_qty_nonnegative'),
         CheckConstraint('accuracy_rate >= 0', name='chk_accuracy_rate_positive'),
+        # Forecasts are listed and replaced one frequency at a time
+        db.Index('ix_demand_forecasts_frequency_item_date', 'frequency', 'item_id', 'forecast_date'),
     )
 
     item = db.relationship('Item', backref='demand_forecasts', lazy=True)
@@ -779,6 +935,31 @@ class InventoryReplenishmentPlan(db.Model):
     def __repr__(self):
         return f"<ReplenishPlan {self.id} Item {self.item_id} Qty {self.recommended_order_quantity}>"
 
+class MRPRun(db.Model):
+    __tablename__ = 'mrp_runs'
+    id = db.Column('MRPRunID', db.Integer, primary_key=True)
+    started_at = db.Column('StartedAt', db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column('FinishedAt', db.DateTime)
+    incremental = db.Column('Incremental', db.Boolean, default=False)
+    bom_fingerprint = db.Column('BOMFingerprint', db.String(64))
+    items_recomputed = db.Column('ItemsRecomputed', db.Integer, default=0)
+    plans_written = db.Column('PlansWritten', db.Integer, default=0)
+
+    def __repr__(self):
+        return f"<MRPRun {self.id} Items {self.items_recomputed}>"
+
+class MRPItemState(db.Model):
+    # Inputs and result of the last MRP run per item, diffed by incremental runs
+    __tablename__ = 'mrp_item_states'
+    item_id = db.Column('ItemID', db.Integer, db.ForeignKey('items.ItemID'), primary_key=True)
+    independent_demand = db.Column('IndependentDemand', db.Float, default=0)
+    on_hand = db.Column('OnHand', db.Float, default=0)
+    scheduled_receipts = db.Column('ScheduledReceipts', db.Float, default=0)
+    planned_quantity = db.Column('PlannedQuantity', db.Integer, default=0)
+
+    def __repr__(self):
+        return f"<MRPItemState Item {self.item_id} Planned {self.planned_quantity}>"
+
 # 2. Employee Shift & Productivity Tracking
 
 class EmployeeShift(db.Model):
@@ -993,10 +1174,149 @@ class DiscountPromotion(db.Model):
 #     def __repr__(self):
 #         return f"<FraudAlert {self.id} Item {self.item_id} Txn {self.unusual_transaction_id}>"
 
+##############################################################################
+# BACKGROUND JOBS
+##############################################################################
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column('JobID', db.Integer, primary_key=True)
+    job_type = db.Column('JobType', db.String(50), nullable=False)
+    status = db.Column('Status', job_status_enum, nullable=False, default='Queued')
+    params = db.Column('Params', db.JSON)
+    result = db.Column('Result', db.JSON)
+    error = db.Column('Error', db.Text)
+    progress = db.Column('Progress', db.Float, default=0.0)  # 0-100
+    progress_message = db.Column('ProgressMessage', db.String(255))
+    attempts = db.Column('Attempts', db.Integer, nullable=False, default=0)
+    max_attempts = db.Column('MaxAttempts', db.Integer, nullable=False, default=1)
+    cancel_requested = db.Column('CancelRequested', db.Boolean, nullable=False, default=False)
+    run_after = db.Column('RunAfter', db.DateTime)
+    created_by = db.Column('CreatedBy', db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column('CreatedAt', db.DateTime, default=datetime.utcnow)
+    started_at = db.Column('StartedAt', db.DateTime)
+    heartbeat_at = db.Column('HeartbeatAt', db.DateTime)
+    finished_at = db.Column('FinishedAt', db.DateTime)
+
+    __table_args__ = (
+        # The dispatcher polls for the oldest runnable queued job
+        db.Index('ix_jobs_status_run_after', 'Status', 'RunAfter', 'JobID'),
+    )
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.job_type} {self.status}>"
+
+##############################################################################
+# REPORTING DATABASE
+##############################################################################
+
+class ReportingHeartbeat(db.Model):
+    # Single row stamped on the primary; read back on the reporting database it
+    # tells how far behind that copy is
+    __tablename__ = 'reporting_heartbeat'
+    id = db.Column('HeartbeatID', db.Integer, primary_key=True)
+    beat_at = db.Column('BeatAt', db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<ReportingHeartbeat {self.beat_at}>"
+
+##############################################################################
+# RESPONSE CACHE
+##############################################################################
+
+class TableVersion(db.Model):
+    # Change counter per table, bumped in the same transaction as the write so
+    # every worker sees a new version exactly when the new rows are visible
+    __tablename__ = 'table_versions'
+    table_name = db.Column('TableName', db.String(64), primary_key=True)
+    version = db.Column('Version', db.Integer, nullable=False, default=0)
+    modified_at = db.Column('ModifiedAt', db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<TableVersion {self.table_name} {self.version}>"
+
 ##############################################################################
 # INIT DB
 ##############################################################################
 
+def ensure_indexes():
+    # create_all only builds indexes together with new tables, so indexes added
+    # to existing tables are created here (no-op for the ones already present)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def ensure_columns():
+    # create_all never alters a table that exists, so nullable columns added to
+    # a model later are added here with ALTER TABLE
+    inspector = sa_inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    quote = db.engine.dialect.identifier_preparer.quote
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present or not column.nullable or column.primary_key:
+                    continue
+                connection.execute(text(
+                    f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} '
+                    f'{column.type.compile(dialect=db.engine.dialect)}'
+                ))
+
+def init_db():
+    # Create missing tables, then columns and indexes added to tables that
+    # already existed. Only the primary bind: the reporting bind is a read-only
+    # view or a copy.
+    db.create_all(bind_key=None)
+    ensure_columns()
+    ensure_indexes()
+
+DEFAULT_PERMISSIONS = (
+    'view_users', 'create_users', 'edit_users', 'delete_users',
+    'view_roles', 'create_roles', 'edit_roles', 'delete_roles',
+    'view_inventory', 'manage_inventory',
+    'view_categories', 'manage_categories',
+    'view_items', 'manage_items',
+    'view_transactions', 'manage_transactions'
+)
+# Created in this order, so a fresh database gets admin=1 and user=2
+DEFAULT_ROLES = ('admin', 'user')
+
+def _insert_ignore(model):
+    # INSERT that skips rows clashing with an existing unique key
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return sa_insert(model).prefix_with('IGNORE')
+    return insert(model).on_conflict_do_nothing()
+
+def seed_defaults():
+    # Idempotent: three set-based statements in one transaction, so concurrent
+    # runs and re-runs never duplicate or fail on existing rows. The admin role
+    # is (re)granted every default permission.
+    from cache_services import bump_table_versions
+    # Core tables, not the models: ORM bulk inserts report no rowcount
+    inserted = db.session.execute(_insert_ignore(Permission.__table__), [
+        {'PermissionName': name} for name in DEFAULT_PERMISSIONS
+    ]).rowcount
+    inserted += db.session.execute(_insert_ignore(Role.__table__), [{'name': name} for name in DEFAULT_ROLES]).rowcount
+    inserted += db.session.execute(_insert_ignore(RolePermission.__table__).from_select(
+        ['RoleID', 'PermissionID'],
+        select(Role.id, Permission.id)
+        .join(Permission, Permission.permission_name.in_(DEFAULT_PERMISSIONS))
+        .where(Role.name == 'admin')
+    )).rowcount
+    if inserted:
+        # Cached role and permission lists revalidate against these versions
+        bump_table_versions(Role, Permission, RolePermission)
+    db.session.commit()
+    invalidate_role_permissions()
+
 # Support Ticket System Models
 class SupportTicket(db.Model):
     __tablename__ = 'support_tickets'
@@ -1013,6 +1333,11 @@ class SupportTicket(db.Model):
     # Relationships
     user = db.relationship('User', backref='support_tickets', lazy=True)
     responses = db.relationship('TicketResponse', backref='ticket', lazy=True, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # A user's tickets, newest first (/api/my-tickets)
+        db.Index('ix_support_tickets_user_created', 'user_id', 'created_at'),
+    )
     
     def __repr__(self):
         return f"<SupportTicket {self.id}: {self.subject}>"
@@ -1020,7 +1345,7 @@ class SupportTicket(db.Model):
 class TicketResponse(db.Model):
     __tablename__ = 'ticket_responses'
     id = db.Column(db.Integer, primary_key=True)
-    ticket_id = db.Column(db.Integer, db.ForeignKey('support_tickets.id'), nullable=False)
+    ticket_id = db.Column(db.Integer, db.ForeignKey('support_tickets.id'), index=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     message = db.Column(db.Text, nullable=False)
     is_staff_response = db.Column(db.Boolean, default=False)
@@ -0,0 +1,466 @@
+import hashlib
+import math
+import threading
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import event, select, insert, func, and_, bindparam
+from cache_services import bump_table_versions, get_table_versions
+from database import ROW_EVENTS, refresh_on_flush
+from models import (
+    db, BOM, BOMDetail, ProductionRun, ProductionRunDetail, Inventory,
+    SalesOrder, SalesOrderDetail, PurchaseOrder, PurchaseOrderDetail, SupplierItem,
+    InventoryReplenishmentPlan, MRPRun, MRPItemState
+)
+
+##############################################################################
+# BOM EXPLOSION
+##############################################################################
+
+# Digits kept on exploded quantities; QuantityRequired is a float and nested
+# multiplication otherwise leaves noise like 2.9999999999999996
+BOM_QUANTITY_PRECISION = 6
+
+# The BOM graph and every per-unit explosion computed from it, kept per process
+# for one version of the bom / bom_details tables. ORM writes bump those
+# versions in their own transaction, so changes made by scripts or other
+# processes are picked up within TABLE_VERSION_CHECK_SECONDS.
+BOM_TABLES = (BOM.__tablename__, BOMDetail.__tablename__)
+_bom_cache_lock = threading.Lock()
+_bom_cache = {'version': None, 'graph': None, 'explosions': {}}
+
+
+class BOMCycleError(ValueError):
+    def __init__(self, path):
+        self.path = path
+        super().__init__('BOM cycle detected: ' + ' -> '.join(str(item_id) for item_id in path))
+
+    def to_dict(self):
+        return {'message': str(self), 'cycle': self.path}
+
+
+class BOMGraph:
+    def __init__(self, boms, details):
+        # bom_id -> final product, bom_id -> [(component item, quantity per unit)]
+        self.products = {}
+        self.components = defaultdict(list)
+        # A product with several BOMs explodes through its newest one
+        self.default_boms = {}
+        for bom_id, final_product_id in boms:
+            self.products[bom_id] = final_product_id
+            self.default_boms[final_product_id] = max(bom_id, self.default_boms.get(final_product_id, 0))
+        for bom_id, component_item_id, quantity_required in details:
+            self.components[bom_id].append((component_item_id, quantity_required or 0))
+
+
+def invalidate_bom_cache(*args):
+    with _bom_cache_lock:
+        _bom_cache['version'] = None
+        _bom_cache['graph'] = None
+        _bom_cache['explosions'] = {}
+
+
+def _bump_bom_versions(connection, **changed):
+    bump_table_versions(BOM, BOMDetail, connection=connection)
+    db.session.info['bom_changed'] = True
+
+
+# Other processes see the new versions once this transaction commits. This one
+# drops its cache at the flush, so it never explodes a changed recipe through
+# the old graph, and again on rollback, so the graph of a change that never
+# committed is not kept under the old version.
+for _model in (BOM, BOMDetail):
+    for _event in ROW_EVENTS:
+        event.listen(_model, _event, invalidate_bom_cache)
+refresh_on_flush(_bump_bom_versions, boms=(BOM, ROW_EVENTS), details=(BOMDetail, ROW_EVENTS))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _forget_bom_change(session):
+    session.info.pop('bom_changed', None)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_uncommitted_bom_graph(session):
+    if session.info.pop('bom_changed', None):
+        invalidate_bom_cache()
+
+
+def load_bom_graph():
+    # The whole graph in two queries; recipes are small next to the work of re-walking them
+    return BOMGraph(
+        db.session.execute(select(BOM.id, BOM.final_product_id)).all(),
+        db.session.execute(select(BOMDetail.bom_id, BOMDetail.component_item_id, BOMDetail.quantity_required)).all()
+    )
+
+
+def get_bom_graph():
+    version = tuple(version for version, _ in get_table_versions(BOM_TABLES))
+    with _bom_cache_lock:
+        if _bom_cache['version'] == version and _bom_cache['graph'] is not None:
+            return _bom_cache['graph'], version
+
+    graph = load_bom_graph()
+    with _bom_cache_lock:
+        if _bom_cache['version'] != version:
+            _bom_cache['explosions'] = {}
+        _bom_cache['version'] = version
+        _bom_cache['graph'] = graph
+    return graph, version
+
+
+def _explode_bom(graph, bom_id, memo, path):
+    # Per-unit requirements of one BOM: (leaf components, sub-assemblies), each
+    # item_id -> quantity. Sub-assemblies are exploded through their default BOM
+    # and their results memoized, so shared sub-assemblies are walked once.
+    if bom_id in memo:
+        return memo[bom_id]
+
+    product_id = graph.products[bom_id]
+    if product_id in path:
+        raise BOMCycleError(path[path.index(product_id):] + [product_id])
+    path.append(product_id)
+
+    components = defaultdict(float)
+    subassemblies = defaultdict(float)
+    for component_id, quantity in graph.components.get(bom_id, ()):
+        child_bom_id = graph.default_boms.get(component_id)
+        if child_bom_id is None:
+            components[component_id] += quantity
+            continue
+        subassemblies[component_id] += quantity
+        child_components, child_subassemblies = _explode_bom(graph, child_bom_id, memo, path)
+        for item_id, child_quantity in child_components.items():
+            components[item_id] += quantity * child_quantity
+        for item_id, child_quantity in child_subassemblies.items():
+            subassemblies[item_id] += quantity * child_quantity
+
+    path.pop()
+    memo[bom_id] = (dict(components), dict(subassemblies))
+    return memo[bom_id]
+
+
+def explode_bom_per_unit(bom_id):
+    graph, version = get_bom_graph()
+    if bom_id not in graph.products:
+        raise ValueError(f'BOM {bom_id} not found')
+
+    explosions = _bom_cache['explosions']
+    if bom_id in explosions:
+        return explosions[bom_id]
+
+    memo = dict(explosions)
+    result = _explode_bom(graph, bom_id, memo, [])
+    with _bom_cache_lock:
+        # Keep every sub-assembly explosion computed on the way, unless the graph changed meanwhile
+        if _bom_cache['version'] == version:
+            _bom_cache['explosions'].update(memo)
+    return result
+
+
+def _requirement_rows(quantities):
+    return [{
+        'item_id': item_id,
+        'quantity': round(quantity, BOM_QUANTITY_PRECISION)
+    } for item_id, quantity in sorted(quantities.items())]
+
+
+def _scaled(per_unit, quantity, totals=None):
+    totals = totals if totals is not None else defaultdict(float)
+    for item_id, unit_quantity in per_unit.items():
+        totals[item_id] += unit_quantity * quantity
+    return totals
+
+
+def default_bom_id(item_id):
+    graph, _ = get_bom_graph()
+    return graph.default_boms.get(item_id)
+
+
+def explode_bom(item_id=None, quantity=1, bom_id=None):
+    # Flattened gross requirements for `quantity` units of a product, through the
+    # given BOM or the product's default one
+    if bom_id is None:
+        bom_id = default_bom_id(item_id)
+        if bom_id is None:
+            raise ValueError(f'No BOM found for item {item_id}')
+
+    components, subassemblies = explode_bom_per_unit(bom_id)
+    return {
+        'bom_id': bom_id,
+        'final_product_id': get_bom_graph()[0].products[bom_id],
+        'quantity': quantity,
+        'components': _requirement_rows(_scaled(components, quantity)),
+        'subassemblies': _requirement_rows(_scaled(subassemblies, quantity))
+    }
+
+
+def explode_production_run(run_id):
+    # Requirements for every line of a production run, plus run-wide totals
+    if db.session.get(ProductionRun, run_id) is None:
+        raise LookupError(f'Production run {run_id} not found')
+
+    lines = db.session.execute(
+        select(ProductionRunDetail.id, ProductionRunDetail.item_id,
+               ProductionRunDetail.quantity_planned, ProductionRunDetail.bom_id)
+        .where(ProductionRunDetail.production_run_id == run_id)
+        .order_by(ProductionRunDetail.id)
+    ).all()
+
+    total_components = defaultdict(float)
+    total_subassemblies = defaultdict(float)
+    results = []
+    for detail_id, item_id, quantity_planned, bom_id in lines:
+        bom_id = bom_id or default_bom_id(item_id)
+        line = {
+            'detail_id': detail_id,
+            'item_id': item_id,
+            'quantity_planned': quantity_planned,
+            'bom_id': bom_id,
+            'components': [],
+            'subassemblies': []
+        }
+        if bom_id is not None:
+            components, subassemblies = explode_bom_per_unit(bom_id)
+            line['components'] = _requirement_rows(_scaled(components, quantity_planned))
+            line['subassemblies'] = _requirement_rows(_scaled(subassemblies, quantity_planned))
+            _scaled(components, quantity_planned, total_components)
+            _scaled(subassemblies, quantity_planned, total_subassemblies)
+        results.append(line)
+
+    return {
+        'production_run_id': run_id,
+        'lines': results,
+        'components': _requirement_rows(total_components),
+        'subassemblies': _requirement_rows(total_subassemblies)
+    }
+
+##############################################################################
+# MRP NETTING
+##############################################################################
+
+# Status of the InventoryReplenishmentPlan rows owned by MRP; each run replaces
+# them and leaves plans entered by hand alone
+MRP_PLAN_STATUS = 'Proposed'
+# Items netted between progress reports (and cancellation checks)
+MRP_PROGRESS_CHUNK = 5000
+OPEN_SALES_ORDER_STATUSES = ('Pending',)
+OPEN_PURCHASE_ORDER_STATUSES = ('Pending', 'Approved')
+OPEN_PRODUCTION_RUN_STATUSES = ('Planned', 'In Progress')
+
+
+def _sum_into(totals, rows):
+    for item_id, quantity in rows:
+        totals[item_id] += quantity or 0
+    return totals
+
+
+def collect_mrp_inputs(graph):
+    # Per-item independent demand, stock on hand and scheduled receipts, each as
+    # one grouped query over the whole table
+    demand = defaultdict(float)
+    _sum_into(demand, db.session.execute(
+        select(SalesOrderDetail.item_id,
+               func.sum(SalesOrderDetail.quantity_ordered - func.coalesce(SalesOrderDetail.quantity_shipped, 0)))
+        .join(SalesOrder, SalesOrder.id == SalesOrderDetail.sales_order_id)
+        .where(SalesOrder.status.in_(OPEN_SALES_ORDER_STATUSES))
+        .group_by(SalesOrderDetail.item_id)
+    ))
+
+    # Open production runs consume their BOM's direct components and deliver their product
+    receipts = defaultdict(float)
+    run_lines = db.session.execute(
+        select(ProductionRunDetail.item_id, ProductionRunDetail.bom_id,
+               func.sum(ProductionRunDetail.quantity_planned))
+        .join(ProductionRun, ProductionRun.id == ProductionRunDetail.production_run_id)
+        .where(ProductionRun.status.in_(OPEN_PRODUCTION_RUN_STATUSES))
+        .group_by(ProductionRunDetail.item_id, ProductionRunDetail.bom_id)
+    )
+    for item_id, bom_id, quantity in run_lines:
+        receipts[item_id] += quantity
+        for component_id, per_unit in graph.components.get(bom_id or graph.default_boms.get(item_id), ()):
+            demand[component_id] += per_unit * quantity
+
+    _sum_into(receipts, db.session.execute(
+        select(PurchaseOrderDetail.item_id,
+               func.sum(PurchaseOrderDetail.quantity_ordered - func.coalesce(PurchaseOrderDetail.quantity_received, 0)))
+        .join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderDetail.po_id)
+        .where(PurchaseOrder.status.in_(OPEN_PURCHASE_ORDER_STATUSES))
+        .group_by(PurchaseOrderDetail.item_id)
+    ))
+
+    on_hand = _sum_into(defaultdict(float), db.session.execute(
+        select(Inventory.item_id, func.sum(Inventory.quantity)).group_by(Inventory.item_id)
+    ))
+    return demand, on_hand, receipts
+
+
+def bom_fingerprint(graph):
+    digest = hashlib.sha1()
+    for bom_id in sorted(graph.products):
+        digest.update(f'{bom_id}:{graph.products[bom_id]}:{sorted(graph.components.get(bom_id, ()))};'.encode())
+    return digest.hexdigest()
+
+
+def bom_planning_order(graph):
+    # Items that sit in some default BOM, parents before children, so an item is
+    # netted only after every planned order that feeds its dependent demand
+    children = {product_id: [c for c, _ in graph.components.get(bom_id, ())]
+                for product_id, bom_id in graph.default_boms.items()}
+    parent_counts = defaultdict(int)
+    for components in children.values():
+        for component_id in components:
+            parent_counts[component_id] += 1
+
+    nodes = set(children) | set(parent_counts)
+    ready = [item_id for item_id in nodes if not parent_counts[item_id]]
+    order = []
+    while ready:
+        item_id = ready.pop()
+        order.append(item_id)
+        for component_id in children.get(item_id, ()):
+            parent_counts[component_id] -= 1
+            if not parent_counts[component_id]:
+                ready.append(component_id)
+
+    if len(order) < len(nodes):
+        # Whatever is left sits on or below a cycle; walk it to report the loop
+        remaining = nodes - set(order)
+        path = [next(iter(remaining))]
+        while True:
+            next_id = next(c for c in children.get(path[-1], ()) if c in remaining)
+            if next_id in path:
+                raise BOMCycleError(path[path.index(next_id):] + [next_id])
+            path.append(next_id)
+    return order
+
+
+def cheapest_suppliers():
+    # item_id -> supplier with the lowest listed cost, ties broken by lowest id
+    ranked = select(
+        SupplierItem.item_id, SupplierItem.supplier_id,
+        func.row_number().over(partition_by=SupplierItem.item_id,
+                               order_by=(SupplierItem.cost, SupplierItem.supplier_id)).label('rank')
+    ).subquery()
+    return dict(db.session.execute(
+        select(ranked.c.item_id, ranked.c.supplier_id).where(ranked.c.rank == 1)
+    ).all())
+
+
+def run_mrp(incremental=False, progress=None):
+    # progress(percent, message) is called between phases and item chunks, before
+    # anything is written; an exception it raises aborts the run
+    progress = progress or (lambda percent, message=None: None)
+    started = datetime.utcnow()
+    progress(0, 'Loading MRP inputs')
+    # Read fresh rather than from the cache: the fingerprint decides whether an
+    # incremental run may reuse the last run's netting, and a cached graph can
+    # lag a BOM change committed elsewhere by a few seconds
+    graph = load_bom_graph()
+    order = bom_planning_order(graph)
+    fingerprint = bom_fingerprint(graph)
+    demand, on_hand, receipts = collect_mrp_inputs(graph)
+
+    previous = {}
+    if incremental:
+        last_run = MRPRun.query.filter(MRPRun.finished_at.isnot(None))\
+            .order_by(MRPRun.id.desc()).first()
+        # A changed BOM moves dependent demand everywhere below it; start over
+        if last_run is None or last_run.bom_fingerprint != fingerprint:
+            incremental = False
+        else:
+            previous = {row[0]: row[1:] for row in db.session.execute(select(
+                MRPItemState.item_id, MRPItemState.independent_demand, MRPItemState.on_hand,
+                MRPItemState.scheduled_receipts, MRPItemState.planned_quantity
+            ))}
+
+    item_ids = set(demand) | set(on_hand) | set(receipts) | set(previous) | set(order)
+    inputs = {item_id: (demand.get(item_id, 0), on_hand.get(item_id, 0), receipts.get(item_id, 0))
+              for item_id in item_ids}
+
+    # Touched items are those whose inputs moved since the last run
+    if incremental:
+        dirty = {item_id for item_id in item_ids
+                 if item_id not in previous or tuple(previous[item_id][:3]) != inputs[item_id]}
+    else:
+        dirty = item_ids
+
+    parents = defaultdict(list)
+    for product_id, bom_id in graph.default_boms.items():
+        for component_id, per_unit in graph.components.get(bom_id, ()):
+            parents[component_id].append((product_id, per_unit))
+
+    planned = {item_id: state[3] for item_id, state in previous.items()}
+    recomputed = set()
+    replanned = set()
+    in_bom = set(order)
+    planning_order = order + [i for i in item_ids if i not in in_bom]
+    for position, item_id in enumerate(planning_order):
+        if position % MRP_PROGRESS_CHUNK == 0:
+            progress(10 + 80 * position / len(planning_order), f'Netted {position} of {len(planning_order)} items')
+        # Clean items keep their last result unless a parent's planned order moved
+        if item_id not in dirty and not any(p in replanned for p, _ in parents.get(item_id, ())):
+            continue
+        independent, stock, scheduled = inputs[item_id]
+        gross = independent + sum(planned.get(p, 0) * per_unit for p, per_unit in parents.get(item_id, ()))
+        quantity = max(0, math.ceil(round(gross - stock - scheduled, BOM_QUANTITY_PRECISION)))
+        recomputed.add(item_id)
+        if quantity != planned.get(item_id, 0):
+            replanned.add(item_id)
+        planned[item_id] = quantity
+
+    changed = replanned if incremental else recomputed
+    plans = [item_id for item_id in changed if planned[item_id]]
+    # Manufactured items are made in house and get no supplier
+    suppliers = cheapest_suppliers() if plans else {}
+
+    # Replace this run's slice of the MRP-owned plans and item state in bulk
+    progress(90, 'Writing plans')
+    run = MRPRun(started_at=started)
+    db.session.add(run)
+    now = datetime.utcnow()
+    plan_table = InventoryReplenishmentPlan.__table__
+    state_table = MRPItemState.__table__
+    if incremental:
+        if changed:
+            db.session.execute(plan_table.delete().where(and_(
+                plan_table.c.item_id == bindparam('b_item_id'),
+                plan_table.c.status == MRP_PLAN_STATUS)), [{'b_item_id': item_id} for item_id in changed])
+        if recomputed:
+            db.session.execute(state_table.delete().where(state_table.c.ItemID == bindparam('b_item_id')),
+                               [{'b_item_id': item_id} for item_id in recomputed])
+    else:
+        db.session.execute(plan_table.delete().where(plan_table.c.status == MRP_PLAN_STATUS))
+        db.session.execute(state_table.delete())
+
+    if plans:
+        db.session.execute(insert(InventoryReplenishmentPlan), [{
+            'item_id': item_id,
+            'supplier_id': None if item_id in graph.default_boms else suppliers.get(item_id),
+            'recommended_order_quantity': planned[item_id],
+            'replenishment_date': now,
+            'status': MRP_PLAN_STATUS
+        } for item_id in plans])
+    if recomputed:
+        db.session.execute(insert(MRPItemState), [{
+            'item_id': item_id,
+            'independent_demand': inputs[item_id][0],
+            'on_hand': inputs[item_id][1],
+            'scheduled_receipts': inputs[item_id][2],
+            'planned_quantity': planned[item_id]
+        } for item_id in recomputed])
+
+    run.incremental = incremental
+    run.bom_fingerprint = fingerprint
+    run.items_recomputed = len(recomputed)
+    run.plans_written = len(plans)
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+
+    return {
+        'run_id': run.id,
+        'incremental': incremental,
+        'items_considered': len(item_ids),
+        'items_recomputed': run.items_recomputed,
+        'plans_written': run.plans_written,
+        'duration_seconds': round((run.finished_at - run.started_at).total_seconds(), 3)
+    }
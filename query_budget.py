@@ -0,0 +1,144 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+##############################################################################
+# QUERY BUDGETS
+##############################################################################
+
+# SQL statements each GET may issue against a database seeded with
+# QUERY_BUDGET_ROWS rows per table. The counts must not grow with the data,
+# so a per-row lookup (N+1) shows up as about QUERY_BUDGET_ROWS extra
+# statements. Every request runs with cold in-process caches (login identity,
+# table versions, cached responses), so each count includes those lookups.
+QUERY_BUDGETS = (
+    ('/api/dashboard/recent-transactions', 2),
+    ('/api/dashboard/recent-transactions?expand=item,warehouse', 2),
+    ('/api/dashboard/stats', 5),
+    ('/api/dashboard/low-stock', 2),
+    ('/api/admin/support-tickets', 2),
+    ('/api/my-tickets', 2),
+    ('/api/tickets/1', 3),
+    ('/api/categories', 3),
+    ('/api/items', 3),
+    ('/api/items?fields=id,name&expand=category', 3),
+    ('/api/warehouses', 3),
+    ('/api/warehouse-sections?expand=warehouse', 3),
+    ('/api/warehouses/1/sections', 2),
+    ('/api/warehouse-slots?expand=item,section', 2),
+    ('/api/roles', 3),
+    ('/api/admin/users?expand=role', 2),
+    ('/api/inventory?expand=item,warehouse', 2),
+    ('/api/transactions?expand=item,warehouse', 2)
+)
+QUERY_BUDGET_ROWS = 25
+QUERY_BUDGET_USER = 'query-budget-admin'
+
+
+def seed_query_budget_data(rows):
+    # `rows` of every listed entity, each tied to a different related row so
+    # per-row lookups cannot be served from the identity map
+    from models import (
+        db, Role, User, Category, Item, Warehouse, WarehouseSection, WarehouseSlot,
+        Inventory, InventoryTransaction, SupportTicket, TicketResponse
+    )
+    now = datetime.utcnow()
+    admin_role = Role.query.filter_by(name='admin').one()
+    user_role = Role.query.filter_by(name='user').one()
+    admin = User(username=QUERY_BUDGET_USER, email=f'{QUERY_BUDGET_USER}@example.com', role_id=admin_role.id)
+    admin.set_password(QUERY_BUDGET_USER)
+    users = [User(username=f'user{n}', email=f'user{n}@example.com', role_id=user_role.id) for n in range(rows)]
+    db.session.add_all([admin] + users)
+    db.session.flush()
+
+    for n in range(1, rows + 1):
+        db.session.add(Category(id=n, name=f'Category {n}'))
+        db.session.add(Warehouse(id=n, name=f'Warehouse {n}'))
+        db.session.add(Item(id=n, name=f'Item {n}', category_id=n, sku=f'SKU-{n}',
+                            cost=1, price=2, reorder_level=10))
+        db.session.add(WarehouseSection(id=n, warehouse_id=1, section_name=f'Section {n}'))
+        db.session.add(WarehouseSlot(section_id=n, row_number=1, column_number=1, item_id=n, quantity=1))
+        db.session.add(Inventory(item_id=n, warehouse_id=n, quantity=n % 3))
+        db.session.add(InventoryTransaction(item_id=n, warehouse_id=n, transaction_type='IN', quantity=n,
+                                            transaction_date=now - timedelta(minutes=n), reference=f'REF-{n}'))
+        owner = admin if n % 2 else users[n - 1]
+        ticket = SupportTicket(id=n, user_id=owner.id, subject=f'Ticket {n}', message='Help')
+        db.session.add(ticket)
+        for responder in (users[n - 1], admin):
+            db.session.add(TicketResponse(ticket_id=n, user_id=responder.id, message='Reply'))
+    db.session.commit()
+
+
+def measure_query_counts(database_path, rows=QUERY_BUDGET_ROWS):
+    # Runs inside a fresh interpreter (see count_queries) against a throwaway
+    # database at `database_path`: {url: {'status': code, 'queries': count}}
+    from sqlalchemy import event
+    from app import create_app
+    from models import db, init_db, seed_defaults, invalidate_role_permissions, invalidate_user_identities
+    from cache_services import clear_response_cache
+    from dashboard_services import invalidate_dashboard_snapshot
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_path}', 'TESTING': True})
+    counter = {'queries': 0}
+
+    def count_statement(*args):
+        counter['queries'] += 1
+
+    with app.app_context():
+        init_db()
+        seed_defaults()
+        seed_query_budget_data(rows)
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+    client = app.test_client()
+    response = client.post('/api/auth/login', json={
+        'login_identifier': QUERY_BUDGET_USER, 'password': QUERY_BUDGET_USER
+    })
+    if response.status_code != 200:
+        raise RuntimeError(f'login failed with {response.status_code}')
+
+    counts = {}
+    for url, _ in QUERY_BUDGETS:
+        clear_response_cache()
+        invalidate_user_identities()
+        invalidate_role_permissions()
+        invalidate_dashboard_snapshot()
+        counter['queries'] = 0
+        response = client.get(url)
+        response.get_data()
+        counts[url] = {'status': response.status_code, 'queries': counter['queries']}
+
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+        engine.dispose()
+    return counts
+
+
+def count_queries(rows=QUERY_BUDGET_ROWS):
+    # Statement count per budgeted GET, measured in a fresh interpreter with
+    # the job runner off so it never touches the configured database
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        completed = subprocess.run(
+            [sys.executable, '-c',
+             'import json, sys, query_budget; '
+             'print(json.dumps(query_budget.measure_query_counts(sys.argv[1], int(sys.argv[2]))))',
+             os.path.join(directory, 'query_budget.db'), str(rows)],
+            cwd=project_root, capture_output=True, text=True,
+            env=dict(os.environ, KATILO_JOB_WORKERS='0')
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip()
+                           else f'query count process exited with {completed.returncode}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def check_query_budgets(counts, budgets=QUERY_BUDGETS):
+    # (url, status, queries, budget) rows that failed or went over budget
+    return [(url, counts[url]['status'], counts[url]['queries'], budget) for url, budget in budgets
+            if counts[url]['status'] != 200 or counts[url]['queries'] > budget]
@@ -0,0 +1,243 @@
+import re
+from sqlalchemy import DDL, event, func, select, delete, insert, text, bindparam, table, column, literal, union_all, false
+from models import db, Item, Category
+from database import ROW_EVENTS, chunked, refresh_on_flush
+from serialization import page_bounds, page_envelope
+
+##############################################################################
+# ITEM SEARCH INDEX
+##############################################################################
+
+# FTS5 index over item name, SKU, description and category name, keyed by
+# ItemID (its rowid). Text is normalized in Python before it is indexed or
+# searched, so Arabic spelling variants and diacritics match each other.
+ITEM_SEARCH_TABLE = 'item_search'
+SEARCH_MAX_PER_PAGE = 200
+# Shortest final term that is matched as a prefix (typeahead); shorter ones
+# would expand to most of the vocabulary
+SEARCH_MIN_PREFIX = 2
+
+item_search = table(ITEM_SEARCH_TABLE, column('rowid'), column('name'), column('sku'),
+                    column('description'), column('category'))
+
+# create_all() builds the virtual table alongside the mapped ones (SQLite only)
+event.listen(db.metadata, 'after_create', DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {ITEM_SEARCH_TABLE} USING fts5("
+    "name, sku, description, category, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+).execute_if(dialect='sqlite'))
+
+# Harakat, superscript alef and tatweel are dropped; hamza-carrying alef forms
+# become a bare alef and alef maqsura a yaa; Arabic-Indic digits become ASCII
+_ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_LETTERS = str.maketrans({
+    '\u0623': '\u0627', '\u0625': '\u0627', '\u0622': '\u0627', '\u0671': '\u0627',
+    '\u0649': '\u064a',
+    **{chr(0x0660 + d): str(d) for d in range(10)},
+    **{chr(0x06f0 + d): str(d) for d in range(10)}
+})
+_SEARCH_TERM = re.compile(r'\w+')
+
+
+def normalize_search_text(value):
+    if not value:
+        return ''
+    return _ARABIC_DIACRITICS.sub('', value).translate(_ARABIC_LETTERS).lower()
+
+
+def _sku_search_text(sku):
+    # One compact token ("SKU-00042" -> "sku00042") so typed prefixes of the code
+    # match whatever separators are used; its parts would be shared by every SKU
+    return ''.join(_SEARCH_TERM.findall(normalize_search_text(sku)))
+
+
+def search_terms(query):
+    # Normalized terms of a query; a short final term is still being typed and
+    # would not narrow anything down yet
+    terms = _SEARCH_TERM.findall(normalize_search_text(query))
+    if len(terms) > 1 and len(terms[-1]) < SEARCH_MIN_PREFIX:
+        terms.pop()
+    return terms
+
+
+def _match_parts(query):
+    # Column-free FTS5 expressions for the terms (the last one as a prefix) and
+    # for the whole query as a SKU prefix. Terms come from \w+ so they never
+    # contain FTS5 syntax.
+    terms = search_terms(query)
+    if not terms:
+        return None
+    compact = ''.join(_SEARCH_TERM.findall(normalize_search_text(query)))
+    phrases = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= SEARCH_MIN_PREFIX:
+        phrases[-1] += '*'
+    sku = f'"{compact}"*' if len(compact) >= SEARCH_MIN_PREFIX else f'"{compact}"'
+    return f"({' '.join(phrases)})", sku
+
+
+def build_match_expression(query):
+    # FTS5 MATCH string: every term must appear in name, description or category,
+    # or the whole query is a prefix of the SKU
+    parts = _match_parts(query)
+    if parts is None:
+        return None
+    words, sku = parts
+    return f'{{name description category}} : {words} OR sku : {sku}'
+
+
+def tier_match_expressions(query):
+    # Result tiers, best first: every term in the name, then a SKU prefix, then
+    # the terms spread over name, description and category. NOT keeps an item
+    # out of the later tiers, so they add up to build_match_expression(). Each
+    # tier is read in ItemID order straight off the FTS5 doclists; bm25() would
+    # score every match of a common prefix before returning the first page.
+    parts = _match_parts(query)
+    if parts is None:
+        return None
+    words, sku = parts
+    name = f'name : {words}'
+    sku = f'sku : {sku}'
+    return (
+        name,
+        f'({sku}) NOT ({name})',
+        f'(({{name description category}} : {words}) NOT ({name})) NOT ({sku})'
+    )
+
+
+def _search_source():
+    return select(Item.id, Item.name, Item.sku, Item.description, Category.name)\
+        .outerjoin(Category, Category.id == Item.category_id)
+
+
+def _search_rows(rows):
+    return [{
+        'b_rowid': item_id,
+        'b_name': normalize_search_text(name),
+        'b_sku': _sku_search_text(sku),
+        'b_description': normalize_search_text(description),
+        'b_category': normalize_search_text(category_name)
+    } for item_id, name, sku, description, category_name in rows]
+
+
+_insert_search_row = insert(item_search).values(
+    rowid=bindparam('b_rowid'), name=bindparam('b_name'), sku=bindparam('b_sku'),
+    description=bindparam('b_description'), category=bindparam('b_category')
+)
+
+
+def refresh_item_search(item_ids=(), category_ids=(), connection=None):
+    # Re-index the given items (and every item of the given categories) inside
+    # the caller's transaction
+    execute = (connection or db.session).execute
+    item_ids = set(item_ids)
+    if category_ids:
+        item_ids.update(execute(select(Item.id).where(Item.category_id.in_(list(category_ids)))).scalars())
+    for chunk in chunked(item_ids):
+        execute(delete(item_search).where(item_search.c.rowid.in_(chunk)))
+        rows = _search_rows(execute(_search_source().where(Item.id.in_(chunk))))
+        if rows:
+            execute(_insert_search_row, rows)
+
+
+def rebuild_item_search():
+    db.session.execute(delete(item_search))
+    result = db.session.execute(_search_source().execution_options(yield_per=5000))
+    for partition in result.partitions():
+        db.session.execute(_insert_search_row, _search_rows(partition))
+    db.session.execute(text(f"INSERT INTO {ITEM_SEARCH_TABLE}({ITEM_SEARCH_TABLE}) VALUES ('optimize')"))
+    db.session.commit()
+    return db.session.execute(select(func.count()).select_from(item_search)).scalar()
+
+
+def ensure_item_search():
+    # Build the index when an item is missing from it, as on a database that had
+    # items before item_search existed (create_all() makes it empty); search and
+    # the ?q= list filters would not find them. Returns the indexed row count,
+    # or None when nothing was missing.
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    unindexed = db.session.execute(
+        select(Item.id).where(Item.id.not_in(select(item_search.c.rowid))).limit(1)
+    ).first()
+    if unindexed is None:
+        return None
+    return rebuild_item_search()
+
+
+def _refresh_flushed_items(item_ids, category_ids, connection):
+    # The index is an FTS5 table, so there is nothing to refresh elsewhere
+    if connection.dialect.name == 'sqlite':
+        refresh_item_search(item_ids, category_ids, connection=connection)
+
+
+# ORM changes to items land in the index in the same flush; a renamed category
+# changes how its items are found
+refresh_on_flush(_refresh_flushed_items,
+                 item_ids=(Item, ROW_EVENTS), category_ids=(Category, ('after_update',)))
+
+
+def _search_match(expression, name='match'):
+    return text(f'{ITEM_SEARCH_TABLE} MATCH :{name}').bindparams(**{name: expression})
+
+
+def _in_category(statement, category_id):
+    if category_id is None:
+        return statement
+    return statement.join(Item, Item.id == item_search.c.rowid).where(Item.category_id == category_id)
+
+
+def item_search_filter(item_id_column, query):
+    # WHERE clause keeping the rows whose item matches the search text, for list
+    # endpoints that filter instead of ranking
+    match = build_match_expression(query)
+    if match is None:
+        return false()
+    return item_id_column.in_(select(item_search.c.rowid).where(_search_match(match)))
+
+
+def search_items(query, category_id=None, page=1, per_page=20):
+    page, per_page = page_bounds(page, per_page, SEARCH_MAX_PER_PAGE)
+    match = build_match_expression(query)
+    if match is None:
+        return page_envelope([], 0, page, per_page)
+
+    total = db.session.execute(
+        _in_category(select(func.count()).select_from(item_search).where(_search_match(match)), category_id)
+    ).scalar()
+    page_ids = []
+    if total > (page - 1) * per_page:
+        # The tiers come back already in (tier, ItemID) order, so SQLite merges
+        # them and stops at the end of the page
+        ranked = union_all(*(
+            _in_category(select(item_search.c.rowid.label('item_id'), literal(position).label('tier'))
+                         .select_from(item_search)
+                         .where(_search_match(expression, f'match_{position}')), category_id)
+            for position, expression in enumerate(tier_match_expressions(query))
+        ))
+        page_ids = db.session.execute(
+            ranked.order_by(ranked.selected_columns.tier, ranked.selected_columns.item_id)
+            .limit(per_page).offset((page - 1) * per_page)
+        ).scalars().all()
+
+    rows = {}
+    if page_ids:
+        rows = {row.id: row for row in db.session.execute(
+            select(Item.id, Item.name, Item.sku, Item.description, Item.category_id,
+                   Category.name.label('category_name'),
+                   Item.unit_of_measure, Item.cost, Item.price, Item.reorder_level)
+            .outerjoin(Category, Category.id == Item.category_id)
+            .where(Item.id.in_(page_ids))
+        )}
+
+    return page_envelope([{
+        'id': row.id,
+        'name': row.name,
+        'sku': row.sku,
+        'description': row.description,
+        'category_id': row.category_id,
+        'category_name': row.category_name,
+        'unit_of_measure': row.unit_of_measure,
+        'cost': row.cost,
+        'price': row.price,
+        'reorder_level': row.reorder_level
+    } for row in (rows[item_id] for item_id in page_ids if item_id in rows)], total, page, per_page)
@@ -0,0 +1,195 @@
+import json
+from datetime import date, datetime
+from flask import current_app, stream_with_context
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+from models import db
+
+try:
+    # Optional: several times faster, encodes datetimes itself (ISO 8601, as
+    # isoformat() writes them) and returns UTF-8 bytes directly
+    import orjson
+except ImportError:
+    orjson = None
+
+##############################################################################
+# JSON SERIALIZATION
+##############################################################################
+
+# Rows fetched and encoded per chunk of a streamed array
+JSON_STREAM_CHUNK_ROWS = 1000
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(value):
+    # JSON as UTF-8 bytes; datetimes become ISO 8601 strings
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+
+def _nested_dict(shape, row):
+    obj, position = {}, 0
+    for entry in shape:
+        if isinstance(entry, str):
+            obj[entry] = row[position]
+            position += 1
+        else:
+            name, subfields = entry
+            values = row[position:position + len(subfields)]
+            position += len(subfields)
+            # No related row on the other side of the LEFT JOIN
+            obj[name] = dict(zip(subfields, values)) if any(v is not None for v in values) else None
+    return obj
+
+
+def rows_to_dicts(shape, rows):
+    # Column tuples (e.g. from select(Model.a, Model.b)) to JSON objects, without
+    # building ORM instances. `shape` lists a key per column; a (name, keys)
+    # entry (see project) nests the next len(keys) columns as one object.
+    # Columns past the shape are ignored.
+    if all(isinstance(entry, str) for entry in shape):
+        return [dict(zip(shape, row)) for row in rows]
+    return [_nested_dict(shape, row) for row in rows]
+
+
+def json_response(value, status=200):
+    return current_app.response_class(dumps(value), status=status, mimetype='application/json')
+
+
+def json_rows(statement, shape):
+    # JSON array of objects for a column select that fits in one response
+    return json_response(rows_to_dicts(shape, db.session.execute(statement)))
+
+
+def _iter_json_array(statement, shape, chunk_rows):
+    result = db.session.execute(statement.execution_options(yield_per=chunk_rows))
+    try:
+        separator = b'['
+        for partition in result.partitions():
+            # Encode the chunk as one array and splice its elements in
+            chunk = dumps(rows_to_dicts(shape, partition))
+            yield separator + chunk[1:-1]
+            separator = b','
+        yield b'[]' if separator == b'[' else b']'
+    finally:
+        result.close()
+
+
+def stream_json_rows(statement, shape, chunk_rows=JSON_STREAM_CHUNK_ROWS):
+    # JSON array of objects for a column select, streamed `chunk_rows` rows at a
+    # time so memory stays bounded by the chunk, not the table. `shape` as for
+    # rows_to_dicts.
+    return current_app.response_class(
+        stream_with_context(_iter_json_array(statement, shape, chunk_rows)),
+        mimetype='application/json'
+    )
+
+##############################################################################
+# PAGINATION
+##############################################################################
+
+def page_bounds(page, per_page, max_per_page):
+    # Pages count from 1; per_page is kept within 1..max_per_page
+    return max(1, page), max(1, min(per_page, max_per_page))
+
+
+def page_envelope(items, total, page, per_page, **extra):
+    return {
+        'items': items,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page,
+        **extra
+    }
+
+
+def paginate(query, page, per_page, serialize):
+    # page_envelope for one page of an ORM query, serialize(row) making each
+    # item. The total rides along with the page rows as a window count, so a
+    # page is a single statement; past the last page there is no row to carry
+    # it and a plain count runs instead.
+    rows = query.add_columns(func.count().over().label('page_total'))\
+        .offset((page - 1) * per_page).limit(per_page).all()
+    if rows:
+        total = rows[0].page_total
+    else:
+        total = query.order_by(None).count() if page > 1 else 0
+    return page_envelope([serialize(row) for row in rows], total, page, per_page)
+
+##############################################################################
+# FIELD SELECTION
+##############################################################################
+
+# List endpoints take ?fields=id,name to return only some keys and
+# ?expand=item to add a related row as a nested object. Only the requested
+# columns are selected, and every expansion is a LEFT JOIN in the same query.
+# A dotted field (item.name) picks keys of an expansion and implies it.
+
+
+class FieldSelectionError(ValueError):
+    pass
+
+
+def _parse_list_param(value):
+    names = []
+    for name in (value or '').split(','):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def project(model, columns, expansions=None, fields=None, expand=None):
+    # columns: ((key, column), ...) returned by default, in order
+    # expansions: {name: (related model, foreign key column, (attribute, ...))}
+    # fields / expand: the raw comma-separated query parameters
+    # Returns (select statement, shape for rows_to_dicts); the caller adds
+    # filters and ordering. Raises FieldSelectionError for unknown names.
+    expansions = expansions or {}
+    known = dict(columns)
+    requested = _parse_list_param(fields)
+    top = [name for name, _ in columns] if not requested else []
+    nested = {}
+    for field in requested:
+        name, _, key = field.partition('.')
+        if key:
+            if name not in expansions or key not in expansions[name][2]:
+                raise FieldSelectionError(f'Unknown field: {field}')
+            keys = nested.setdefault(name, [])
+            if keys is not None:
+                keys.append(key)
+        elif name in known:
+            top.append(name)
+        elif name in expansions:
+            # The whole related object
+            nested[name] = None
+        else:
+            raise FieldSelectionError(f'Unknown field: {field}')
+    for name in _parse_list_param(expand):
+        if name not in expansions:
+            raise FieldSelectionError(f'Unknown expansion: {name}')
+        nested.setdefault(name, None)
+
+    selected = [known[name] for name in top]
+    shape = list(top)
+    joins = []
+    for name, keys in nested.items():
+        related, foreign_key, attributes = expansions[name]
+        keys = keys or list(attributes)
+        # Aliased so a model can be expanded twice or already be joined
+        alias = aliased(related)
+        selected.extend(getattr(alias, key) for key in keys)
+        shape.append((name, keys))
+        joins.append((alias, alias.id == foreign_key))
+
+    statement = select(*selected).select_from(model)
+    for alias, onclause in joins:
+        statement = statement.outerjoin(alias, onclause)
+    return statement, shape
@@ -0,0 +1,124 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+##############################################################################
+# STARTUP PROFILING
+##############################################################################
+
+# Rows reported by profile_startup(), in start-up order. Import rows are
+# incremental: each excludes modules already loaded by the rows above it.
+STARTUP_STEPS = (
+    'import flask',
+    'import sqlalchemy',
+    'import models',
+    'import support_routes',
+    'import app',
+    'create_app: init_database',
+    'create_app: register_blueprints',
+    'create_all',
+    'ensure_indexes',
+    'seed (empty db)',
+    'seed (seeded db)',
+    'total'
+)
+# Heaviest modules listed from -X importtime
+STARTUP_TOP_MODULES = 15
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def _timed(timings, name, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings[name] = timings.get(name, 0.0) + (time.perf_counter() - started) * 1000
+    return result
+
+
+def measure_startup(database_path):
+    # Runs inside a fresh interpreter (see profile_startup) so every import is
+    # cold. Schema creation and seeding run against `database_path`.
+    timings = {}
+    started = time.perf_counter()
+    _timed(timings, 'import flask', __import__, 'flask')
+    _timed(timings, 'import sqlalchemy', __import__, 'sqlalchemy')
+    _timed(timings, 'import models', __import__, 'models')
+    _timed(timings, 'import support_routes', __import__, 'support_routes')
+
+    # Wrap the factory's steps before app.py runs create_app() at import
+    import database
+    from flask import Flask
+    init_database = database.init_database
+    register_blueprint = Flask.register_blueprint
+    database.init_database = lambda app: _timed(timings, 'create_app: init_database', init_database, app)
+    Flask.register_blueprint = lambda self, *args, **kwargs: _timed(
+        timings, 'create_app: register_blueprints', register_blueprint, self, *args, **kwargs)
+    try:
+        app_module = _timed(timings, 'import app', __import__, 'app')
+    finally:
+        database.init_database = init_database
+        Flask.register_blueprint = register_blueprint
+
+    from models import db, ensure_indexes, seed_defaults
+    app = app_module.create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_path}'})
+    with app.app_context():
+        _timed(timings, 'create_all', db.create_all, bind_key=None)
+        _timed(timings, 'ensure_indexes', ensure_indexes)
+        _timed(timings, 'seed (empty db)', seed_defaults)
+        _timed(timings, 'seed (seeded db)', seed_defaults)
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    timings['total'] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+def parse_importtime(stderr):
+    # module -> (self ms, cumulative ms) from `python -X importtime` output
+    modules = {}
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)) / 1000, int(match.group(2)) / 1000)
+    return modules
+
+
+def profile_startup(repeat=1):
+    # Cold-start breakdown, median of `repeat` fresh interpreters:
+    # {'steps': {step: ms}, 'modules': [(module, self ms, cumulative ms), ...]}
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    runs, module_runs = [], []
+    for _ in range(max(1, repeat)):
+        with tempfile.TemporaryDirectory() as directory:
+            completed = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c',
+                 'import json, sys, startup_profile; '
+                 'print(json.dumps(startup_profile.measure_startup(sys.argv[1])))',
+                 os.path.join(directory, 'startup.db')],
+                cwd=project_root, capture_output=True, text=True,
+                env=dict(os.environ, KATILO_JOB_WORKERS='0')
+            )
+        if completed.returncode != 0:
+            raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip()
+                               else f'profiling process exited with {completed.returncode}')
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        module_runs.append(parse_importtime(completed.stderr))
+
+    steps = {step: statistics.median(run.get(step, 0.0) for run in runs) for step in STARTUP_STEPS}
+    modules = [
+        (name, statistics.median(run.get(name, (0, 0))[0] for run in module_runs),
+         statistics.median(run.get(name, (0, 0))[1] for run in module_runs))
+        for name in module_runs[0]
+    ]
+    modules.sort(key=lambda row: row[2], reverse=True)
+    return {'steps': steps, 'modules': modules[:STARTUP_TOP_MODULES]}
+
+
+def check_thresholds(steps, thresholds):
+    # thresholds: {step: max ms}; returns the (step, ms, limit) rows over budget
+    return [(step, steps[step], limit) for step, limit in thresholds.items() if steps[step] > limit]
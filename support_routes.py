@@ -7,7 +7,9 @@ from datetime import datetime
 from flask import Blueprint, request, jsonify, render_template, abort, current_app, session, url_for, redirect, flash
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
-from models import db, SupportTicket, TicketResponse, Document
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload
+from models import db, SupportTicket, TicketResponse, Document, User
 import os
 from datetime import datetime
 
@@ -30,7 +32,7 @@ def contact_support():
         # Flash a message to inform the user
         flash('يرجى تسجيل الدخول أولاً لإرسال تذكرة دعم', 'warning')
         # Redirect to login page
-        return redirect(url_for('login_page'))
+        return redirect(url_for('main.login_page'))
     return render_template('contact_support.html')
 
 @support_bp.route('/api/support-tickets', methods=['POST'])
@@ -81,10 +83,24 @@ def create_support_ticket():
 def my_tickets():
     return render_template('my_tickets.html')
 
+def _response_counts():
+    # Responses per ticket, as a grouped subquery to join the ticket lists to
+    return select(TicketResponse.ticket_id, func.count().label('responses_count'))\
+        .group_by(TicketResponse.ticket_id).subquery()
+
 @support_bp.route('/api/my-tickets', methods=['GET'])
 @login_required
 def get_my_tickets():
-    tickets = SupportTicket.query.filter_by(user_id=current_user.id).order_by(SupportTicket.created_at.desc()).all()
+    counts = _response_counts()
+    tickets = db.session.execute(
+        select(
+            SupportTicket.id, SupportTicket.subject, SupportTicket.message, SupportTicket.ticket_type,
+            SupportTicket.status, SupportTicket.priority, SupportTicket.created_at, SupportTicket.updated_at,
+            func.coalesce(counts.c.responses_count, 0).label('responses_count')
+        ).outerjoin(counts, counts.c.ticket_id == SupportTicket.id)
+        .where(SupportTicket.user_id == current_user.id)
+        .order_by(SupportTicket.created_at.desc())
+    )
     return jsonify([{
         'id': t.id,
         'subject': t.subject,
@@ -94,7 +110,7 @@ def get_my_tickets():
         'priority': t.priority,
         'created_at': t.created_at.isoformat(),
         'updated_at': t.updated_at.isoformat(),
-        'responses_count': len(t.responses)
+        'responses_count': t.responses_count
     } for t in tickets])
 
 @support_bp.route('/ticket/<int:id>')
@@ -117,6 +133,7 @@ def get_ticket(id):
     if ticket.user_id != current_user.id and (not current_user.role or current_user.role.name != 'admin'):
         return jsonify({'message': 'Unauthorized'}), 403
     
+    # Responders loaded with the responses rather than one query each
     responses = [{
         'id': r.id,
         'message': r.message,
@@ -127,7 +144,8 @@ def get_ticket(id):
             'username': r.user.username,
             'profile_image': r.user.profile_image
         } if r.user else None
-    } for r in ticket.responses]
+    } for r in TicketResponse.query.options(joinedload(TicketResponse.user))
+        .filter_by(ticket_id=ticket.id).order_by(TicketResponse.id)]
     
     return jsonify({
         'id': ticket.id,
@@ -204,12 +222,19 @@ def get_all_tickets():
     
     status_filter = request.args.get('status')
     
-    query = SupportTicket.query
+    # Ticket, submitter and response count in one query
+    counts = _response_counts()
+    query = select(
+        SupportTicket.id, SupportTicket.subject, SupportTicket.ticket_type, SupportTicket.status,
+        SupportTicket.priority, SupportTicket.created_at, SupportTicket.updated_at,
+        User.id.label('user_id'), User.username, func.coalesce(counts.c.responses_count, 0).label('responses_count')
+    ).outerjoin(User, User.id == SupportTicket.user_id)\
+        .outerjoin(counts, counts.c.ticket_id == SupportTicket.id)
     
     if status_filter:
-        query = query.filter_by(status=status_filter)
+        query = query.where(SupportTicket.status == status_filter)
     
-    tickets = query.order_by(SupportTicket.created_at.desc()).all()
+    tickets = db.session.execute(query.order_by(SupportTicket.created_at.desc()))
     
     return jsonify([{
         'id': t.id,
@@ -220,10 +245,10 @@ def get_all_tickets():
         'created_at': t.created_at.isoformat(),
         'updated_at': t.updated_at.isoformat(),
         'user': {
-            'id': t.user.id,
-            'username': t.user.username
-        } if t.user else None,
-        'responses_count': len(t.responses)
+            'id': t.user_id,
+            'username': t.username
+        } if t.user_id is not None else None,
+        'responses_count': t.responses_count
     } for t in tickets])
 
 @support_bp.route('/api/admin/support-tickets/<int:id>', methods=['PUT'])